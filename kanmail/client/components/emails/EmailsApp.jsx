@@ -6,7 +6,8 @@ import HTML5Backend from "react-dnd-html5-backend";
 
 import keyboard from "keyboard.js";
 import { createWindowPositionHandlers } from "window.js";
-import { ALWAYS_SYNC_FOLDERS } from "constants.js";
+import { ALWAYS_SYNC_FOLDERS, INBOX } from "constants.js";
+import { get } from "util/requests.js";
 
 import AddNewColumnForm from "components/emails/AddNewColumnForm.jsx";
 import EmailColumn from "components/emails/EmailColumn.jsx";
@@ -26,6 +27,10 @@ import mainEmailStore from "stores/emails/main.js";
 import { getColumnMetaStore } from "stores/columns.js";
 import { subscribe } from "stores/base.jsx";
 
+// Folders watched (via IMAP IDLE) are still fully synced every N sync ticks
+const WATCHED_FOLDER_SYNC_EVERY = 10;
+const WATCH_RETRY_MS = 10000;
+
 @subscribe(settingsStore)
 @DragDropContext(HTML5Backend)
 export default class EmailsApp extends React.Component {
@@ -44,6 +49,18 @@ export default class EmailsApp extends React.Component {
     );
   }
 
+  constructor(props) {
+    super(props);
+
+    this.syncTicks = 0;
+    this.watchedFolders = new Set();
+  }
+
+  getFoldersToWatch() {
+    // Inbox first, the server only watches a few folders per account
+    return _.uniq(_.concat([INBOX], this.getFoldersToSync()));
+  }
+
   componentDidMount() {
     // Enable keyboard controls
     if (!_.isEmpty(this.props.accounts)) {
@@ -67,26 +84,79 @@ export default class EmailsApp extends React.Component {
     });
 
     this.newAliasEmailCheck = setInterval(this.getNewEmails, sync_interval);
+    this.watchFolderChanges();
     updateStore.checkUpdate();
   }
 
   componentWillUnmount() {
     clearInterval(this.newAliasEmailCheck);
+    clearTimeout(this.watchRetryTimeout);
+    this.unmounted = true;
   }
 
+  watchFolderChanges = (since) => {
+    /*
+        Long poll for folders changed on the server, syncing any that change.
+    */
+
+    if (this.unmounted) {
+      return;
+    }
+
+    const query = { folder: this.getFoldersToWatch() };
+    if (!_.isUndefined(since)) {
+      query.since = since;
+    }
+
+    get("/api/emails/changes", query)
+      .then((data) => {
+        this.watchedFolders = new Set(data.watched_folders);
+
+        _.each(data.changes, (change) => {
+          mainEmailStore.syncFolderEmails(change.folder, {
+            accountName: change.account,
+            skipUnreadSync: filterStore.props.mainColumn !== change.folder,
+          });
+        });
+
+        this.watchFolderChanges(data.change_number);
+      })
+      .catch(() => {
+        this.watchedFolders = new Set();
+        this.watchRetryTimeout = setTimeout(
+          () => this.watchFolderChanges(since),
+          WATCH_RETRY_MS
+        );
+      });
+  };
+
   getNewEmails = () => {
-    _.map(this.getFoldersToSync(), (folder) => {
+    this.syncTicks += 1;
+    const syncWatchedFolders = this.syncTicks % WATCHED_FOLDER_SYNC_EVERY === 0;
+
+    const folderOptions = {};
+
+    _.each(this.getFoldersToSync(), (folder) => {
+      if (this.watchedFolders.has(folder) && !syncWatchedFolders) {
+        return;
+      }
+
       const columnMetaStore = getColumnMetaStore(folder);
       if (columnMetaStore.props.isSyncing) {
         console.debug(`Not syncing ${folder} as we are already syncing!`);
         return;
       }
 
-      mainEmailStore.syncFolderEmails(folder, {
+      folderOptions[folder] = {
         // Only sync unreads if this column is shown
         skipUnreadSync: filterStore.props.mainColumn !== folder,
-      });
+      };
     });
+
+    // Sync every folder of every account in a single request
+    if (!_.isEmpty(folderOptions)) {
+      mainEmailStore.syncFoldersEmails(folderOptions);
+    }
   };
 
   renderColumns() {
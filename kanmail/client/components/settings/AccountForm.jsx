@@ -503,6 +503,17 @@ export default class AccountForm extends React.Component {
                 type: "checkbox",
               })}
             </div>
+            <div className="half">
+              <label
+                className="checkbox"
+                htmlFor="imapSettings-disable_compression"
+              >
+                Disable compression (COMPRESS=DEFLATE)?
+              </label>
+              {this.renderInput("imapSettings", "disable_compression", {
+                type: "checkbox",
+              })}
+            </div>
             <div className="quarter"></div>
           </div>
         </div>
@@ -466,6 +466,22 @@ export default class SettingsApp extends AccountAndSignatureSettingsMixin {
             )}
           />
 
+          <label htmlFor="excerpt_fetch_size">
+            Excerpt size
+            <small>Bytes of each email body to fetch for excerpts.</small>
+          </label>
+          <input
+            required
+            type="number"
+            id="excerpt_fetch_size"
+            value={this.state.systemSettings.excerpt_fetch_size}
+            onChange={_.partial(
+              this.handleInputUpdate,
+              "systemSettings",
+              "excerpt_fetch_size"
+            )}
+          />
+
           <label>
             Clear cache
             <small>
@@ -83,10 +83,74 @@ class MainEmails extends BaseEmails {
     return Promise.all(requests).then(finishLoading).catch(finishLoading);
   };
 
-  syncEmails(accountKey, folderName, options = {}) {
-    const url = `/api/emails/${accountKey}/${encodeFolderName(
-      folderName
-    )}/sync`;
+  syncFoldersEmails = (folderOptions) => {
+    /*
+            Get new emails for many folders, across all accounts, in a single
+            bulk request and trigger any updates. Takes an object of folder
+            name -> sync options.
+        */
+
+    const folderNames = _.keys(folderOptions);
+    const columnMetaStores = _.map(folderNames, getColumnMetaStore);
+    _.each(columnMetaStores, (columnMetaStore) =>
+      columnMetaStore.setSyncing(true)
+    );
+
+    const folders = [];
+
+    _.each(folderNames, (folderName) => {
+      _.each(this.getAccountKeys(), (accountKey) => {
+        const folder = _.assign(
+          { account: accountKey, folder: folderName },
+          this.getSyncQuery(accountKey, folderName, folderOptions[folderName])
+        );
+        folders.push(folder);
+      });
+    });
+
+    const finishLoading = () =>
+      _.each(columnMetaStores, (columnMetaStore) =>
+        columnMetaStore.setSyncing(false)
+      );
+
+    return requestStore
+      .post(`Sync emails in ${folderNames.join(", ")}`, "/api/emails/sync", {
+        folders,
+      })
+      .then((data) => {
+        _.each(data.results, (result) => {
+          if (result.error_name) {
+            const errorData = {
+              url: `/api/emails/${result.account}/${encodeFolderName(
+                result.folder
+              )}/sync`,
+              status: result.status_code,
+              errorName: result.error_name,
+              errorMessage: result.error_message,
+            };
+
+            // Handled as the per folder sync requests would be
+            if (result.status_code == 503) {
+              requestStore.addNetworkError(errorData);
+            } else {
+              requestStore.addRequestError(errorData);
+            }
+            return;
+          }
+
+          this.handleSyncData(
+            result.account,
+            result.folder,
+            result,
+            folderOptions[result.folder]
+          );
+        });
+      })
+      .then(finishLoading)
+      .catch(finishLoading);
+  };
+
+  getSyncQuery(accountKey, folderName, options = {}) {
     const query = options.query || {};
 
     if (!options.skipUnreadSync) {
@@ -94,50 +158,59 @@ class MainEmails extends BaseEmails {
       query.unread_uids = uids;
     }
 
+    return query;
+  }
+
+  syncEmails(accountKey, folderName, options = {}) {
+    const url = `/api/emails/${accountKey}/${encodeFolderName(
+      folderName
+    )}/sync`;
+    const query = this.getSyncQuery(accountKey, folderName, options);
+
     return requestStore
       .get(`Sync emails in ${accountKey}/${folderName}`, url, query)
-      .then((data) => {
-        this.setMetaForAccountFolder(accountKey, folderName, data.meta);
+      .then((data) =>
+        this.handleSyncData(accountKey, folderName, data, options)
+      );
+  }
 
-        let changed = false;
+  handleSyncData(accountKey, folderName, data, options = {}) {
+    this.setMetaForAccountFolder(accountKey, folderName, data.meta);
 
-        if (data.read_uids.length > 0) {
-          this.setEmailsReadByUid(accountKey, folderName, data.read_uids);
-          changed = true;
-        }
+    let changed = false;
 
-        if (data.deleted_uids.length > 0) {
-          this.deleteEmailsFromAccountFolder(
-            accountKey,
-            folderName,
-            data.deleted_uids
-          );
-          changed = true;
-        }
+    if (data.read_uids.length > 0) {
+      this.setEmailsReadByUid(accountKey, folderName, data.read_uids);
+      changed = true;
+    }
 
-        if (data.new_emails.length > 0) {
-          this.addEmailsToAccountFolder(
-            accountKey,
-            folderName,
-            data.new_emails
-          );
-          changed = true;
+    if (data.deleted_uids.length > 0) {
+      this.deleteEmailsFromAccountFolder(
+        accountKey,
+        folderName,
+        data.deleted_uids
+      );
+      changed = true;
+    }
 
-          if (folderName == INBOX) {
-            data.new_emails.map((email) => {
-              post("/api/notifications/send", {
-                title: email.subject,
-                subtitle: email.from.map(formatAddress).join(", "),
-                body: email.excerpt,
-              });
-            });
-          }
-        }
+    if (data.new_emails.length > 0) {
+      this.addEmailsToAccountFolder(accountKey, folderName, data.new_emails);
+      changed = true;
+
+      if (folderName == INBOX) {
+        data.new_emails.map((email) => {
+          post("/api/notifications/send", {
+            title: email.subject,
+            subtitle: email.from.map(formatAddress).join(", "),
+            body: email.excerpt,
+          });
+        });
+      }
+    }
 
-        if (changed || options.forceProcess) {
-          this.processEmailChanges();
-        }
-      });
+    if (changed || options.forceProcess) {
+      this.processEmailChanges();
+    }
   }
 
   getFolderEmails = (folderName, options = {}) => {
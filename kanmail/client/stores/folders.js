@@ -13,12 +13,15 @@ class FolderStore extends BaseStore {
 
     this.props = {
       folders: [],
+      // Map of account -> folder list & statuses (message/unseen counts)
+      folderMeta: {},
     };
   }
 
   getFolderNames() {
     requestStore.get("Load folders", "/api/folders").then((data) => {
       this.props.folders = data.folders;
+      this.props.folderMeta = data.folder_meta;
       this.triggerUpdate();
     });
   }
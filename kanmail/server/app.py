@@ -28,6 +28,10 @@ from kanmail.settings.constants import (
 from kanmail.settings.hidden import get_hidden_value
 from kanmail.version import get_version
 
+# Per-connection SQLite page cache (KB) & memory mapped IO size (bytes)
+SQLITE_CACHE_SIZE = 16 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
 
 @event.listens_for(Engine, "connect")
 def enable_sqlite_foreign_keys(dbapi_connection, connection_record) -> None:
@@ -37,6 +41,22 @@ def enable_sqlite_foreign_keys(dbapi_connection, connection_record) -> None:
         cursor.close()
 
 
+@event.listens_for(Engine, "connect")
+def enable_sqlite_wal(dbapi_connection, connection_record) -> None:
+    if isinstance(dbapi_connection, SQLite3Connection):
+        cursor = dbapi_connection.cursor()
+        # Only applies to new databases, existing ones are switched over by a one
+        # off VACUUM (see vacuum_folder_cache).
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        # WAL means readers never block on (or block) the writer, and with WAL
+        # synchronous=NORMAL is still safe but avoids an fsync on every commit.
+        cursor.execute("PRAGMA journal_mode=WAL;")
+        cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE};")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};")
+        cursor.close()
+
+
 class JsonEncoder(JSONEncoder):
     def default(self, obj) -> Union[str, int]:
         if isinstance(obj, bytes):
@@ -136,6 +156,7 @@ def boot(prepare_server: bool = True) -> None:
 
     # Database models
     from kanmail.server.mail.contacts import Contact  # noqa: F401
+    from kanmail.server.mail.folder_cache import check_folder_cache_version
 
     # API views
     from kanmail.server.views import contacts_api  # noqa: F401
@@ -151,4 +172,5 @@ def boot(prepare_server: bool = True) -> None:
         window_api,
     )
 
+    check_folder_cache_version()
     db.create_all()
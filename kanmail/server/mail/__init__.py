@@ -1,4 +1,5 @@
 from collections import defaultdict
+from contextlib import nullcontext
 from threading import Lock
 
 from kanmail.log import logger
@@ -7,6 +8,7 @@ from kanmail.settings import get_settings
 
 from .account import Account
 from .allowed_images import is_email_allowed_images
+from .idle import FOLDER_WATCHERS
 from .util import markdownify
 
 ACCOUNTS = {}
@@ -48,6 +50,8 @@ def get_account(key):
 
 
 def reset_accounts():
+    FOLDER_WATCHERS.stop_all()
+
     for key in list(ACCOUNTS.keys()):
         ACCOUNTS.pop(key, None)
 
@@ -55,24 +59,36 @@ def reset_accounts():
 def get_all_folders():
     def get_folders(account):
         folders = []
+        statuses = {}
 
         try:
             folders = account.get_folders()
+            # Already loaded by get_folders, so no extra requests
+            for name, (_, status) in account.get_folder_overview().items():
+                if status:
+                    statuses[name] = {
+                        "count": status.get(b"MESSAGES"),
+                        "unseen": status.get(b"UNSEEN"),
+                        "uid_next": status.get(b"UIDNEXT"),
+                    }
         except Exception as e:
             logger.warning(f"Failed to load folders for {account}: {e}")
 
-        return account.name, folders
+        return account.name, folders, statuses, account.connection_pool.transfer_stats
 
     account_folder_names = execute_threaded(get_folders, [(account,) for account in get_accounts()])
 
     meta = {}
     folder_names = []
 
-    for account_name, names in account_folder_names:
+    for account_name, names, statuses, transfer_stats in account_folder_names:
         folder_names.extend(names)
         meta[account_name] = {
             "count": len(names),
             "folders": names,
+            "statuses": statuses,
+            # Bytes transferred over compressed connections, before/after compression
+            "transfer": transfer_stats.get_stats(),
         }
 
     return sorted(list(set(folder_names))), meta
@@ -132,6 +148,107 @@ def sync_folder_emails(
     return emails, deleted_uids, read_uids, meta
 
 
+def bulk_sync_folder_emails(folder_syncs):
+    """
+    Sync many folders, across accounts, at once. Takes a list of dicts of
+    `sync_folder_emails` kwargs and returns a list, in the same order, of each
+    sync result - or the exception raised, so one failure doesn't fail them all.
+
+    Each account's folders are synced by (up to) its fetch parallelism workers,
+    accounts in parallel. Workers hold one of the account's fetch workers while
+    syncing, so header fetches within a sync only fan out over those left free.
+    """
+
+    account_key_to_indexes = defaultdict(list)
+    for i, folder_sync in enumerate(folder_syncs):
+        account_key_to_indexes[folder_sync["account_key"]].append(i)
+
+    def sync_folders(connection_pool, indexes):
+        results = []
+
+        reserve_worker = (
+            connection_pool.reserve_fetch_workers(1, blocking=True)
+            if connection_pool
+            else nullcontext()
+        )
+
+        with reserve_worker:
+            for i in indexes:
+                try:
+                    result = sync_folder_emails(**folder_syncs[i])
+                except Exception as e:
+                    folder_sync = folder_syncs[i]
+                    logger.warning(
+                        "Failed to sync "
+                        f"{folder_sync['account_key']}/{folder_sync['folder_name']}: {e}",
+                    )
+                    result = e
+
+                results.append((i, result))
+
+        return results
+
+    worker_indexes = []
+
+    for account_key, indexes in account_key_to_indexes.items():
+        try:
+            connection_pool = get_account(account_key).connection_pool
+        except AccountNotFoundError:
+            connection_pool = None
+            workers = 1
+        else:
+            workers = connection_pool.fetch_parallelism
+
+        workers = min(workers, len(indexes))
+        # Spread the folders round-robin over the workers
+        worker_indexes.extend((connection_pool, indexes[i::workers]) for i in range(workers))
+
+    results = [None] * len(folder_syncs)
+
+    for worker_results in execute_threaded(sync_folders, worker_indexes):
+        for i, result in worker_results:
+            results[i] = result
+
+    return results
+
+
+def get_folder_threads(account_key, folder_name, query=None):
+    """
+    Get the threads (lists of UIDs) of a folder within an account, as computed
+    by the server - `None` if the server doesn't support threading.
+    """
+
+    account = get_account(account_key)
+    folder = account.get_folder(folder_name, query=query)
+
+    threads = folder.get_threads()
+
+    meta = {
+        "count": len(folder),
+        "exists": folder.exists,
+    }
+
+    return threads, meta
+
+
+def get_folder_changes(folder_names, since=None, timeout=None):
+    """
+    Get any folders changed (in any account) since a given change number, waiting
+    up to timeout seconds for changes. Folders are watched (via IMAP IDLE) from
+    their first request.
+    """
+
+    watched_folder_names = FOLDER_WATCHERS.watch_folders(get_accounts(), folder_names)
+
+    if since is None:
+        change_number = FOLDER_WATCHERS.changes.get_change_number()
+        changes = []
+    else:
+        change_number, changes = FOLDER_WATCHERS.changes.wait_for_changes(since, timeout)
+
+    return change_number, changes, sorted(watched_folder_names)
+
+
 def _get_folder_email_parts(account_key, folder_name, uid_parts):
     """
     Get email parts (body parts) for a given folder and a given map of
@@ -1,3 +1,6 @@
+from threading import Lock
+from time import time
+
 from kanmail.log import logger
 from kanmail.server.util import lock_class_method
 from kanmail.settings.constants import ALIAS_FOLDER_NAMES
@@ -8,6 +11,10 @@ from .message import make_email_message
 
 NOSELECT_FLAG = b"\\Noselect"
 
+# How long the folder overview (all folders + status) is reused for, long enough
+# to cover syncing every folder column once.
+FOLDER_OVERVIEW_TTL = 10
+
 
 class Account(object):
     capabilities = None
@@ -35,6 +42,11 @@ class Account(object):
         self.folders = {}
         self.query_folders = {}
 
+        # Map of server folder name -> (flags, status), see `get_folder_overview`
+        self.folder_overview = None
+        self.folder_overview_time = 0
+        self.folder_overview_lock = Lock()
+
     def get_imap_connection(self, *args, **kwargs):
         return self.connection_pool.get_connection(*args, **kwargs)
 
@@ -49,6 +61,84 @@ class Account(object):
 
         return self.capabilities
 
+    def get_folder_status_items(self):
+        status_items = [b"MESSAGES", b"UNSEEN", b"UIDNEXT", b"UIDVALIDITY"]
+
+        # HIGHESTMODSEQ (RFC 7162) changes whenever any message/flag changes
+        capabilities = self.get_capabilities()
+        if b"CONDSTORE" in capabilities or b"QRESYNC" in capabilities:
+            status_items.append(b"HIGHESTMODSEQ")
+
+        return status_items
+
+    def get_folder_overview(self):
+        """
+        Get all folders in this account with their flags & status as a dict of
+        server folder name -> (flags, status), status is `None` for folders that
+        can't be selected.
+
+        Uses LIST-STATUS (RFC 5819) where supported, otherwise LIST followed by
+        pipelined STATUS commands - one round trip either way rather than one per
+        folder. The result is cached for FOLDER_OVERVIEW_TTL seconds.
+        """
+
+        with self.folder_overview_lock:
+            if (
+                self.folder_overview is not None
+                and time() - self.folder_overview_time < FOLDER_OVERVIEW_TTL
+            ):
+                return self.folder_overview
+
+            status_items = self.get_folder_status_items()
+
+            with self.get_imap_connection() as connection:
+                if b"LIST-STATUS" in self.get_capabilities():
+                    folders = connection.list_folders_with_status(status_items)
+                else:
+                    folders = connection.list_folders()
+                    folder_statuses = connection.folder_statuses(
+                        [name for flags, _, name in folders if NOSELECT_FLAG not in flags],
+                        status_items,
+                    )
+                    folders = [
+                        (flags, delimiter, name, folder_statuses.get(name))
+                        for flags, delimiter, name in folders
+                    ]
+
+            self.folder_overview = {name: (flags, status) for flags, _, name, status in folders}
+            self.folder_overview_time = time()
+
+            logger.debug(f"Loaded folder overview for {self.name}: {len(folders)} folders")
+            return self.folder_overview
+
+    def get_folder_status(self, folder_name):
+        """
+        Get a folder's status from the overview if already loaded (and not expired),
+        `None` if not available - never loads the overview, as for a single folder
+        that's more work than a STATUS command.
+        """
+
+        with self.folder_overview_lock:
+            if (
+                self.folder_overview is None
+                or time() - self.folder_overview_time >= FOLDER_OVERVIEW_TTL
+            ):
+                return
+
+            if folder_name in self.folder_overview:
+                return self.folder_overview[folder_name][1]
+
+    def invalidate_folder_status(self, folder_name):
+        """
+        Remove the status of a folder that has (or may have) changed from the
+        overview, so it's fetched fresh until the overview is next reloaded.
+        """
+
+        with self.folder_overview_lock:
+            overview = self.folder_overview
+            if overview is not None and folder_name in overview:
+                overview[folder_name] = (overview[folder_name][0], None)
+
     def get_folders(self):
         """
         List all available folders for this account.
@@ -64,21 +154,20 @@ class Account(object):
 
         prefix = self.settings["folders"].get("prefix")
 
-        with self.get_imap_connection() as connection:
-            for flags, delimeter, name in connection.list_folders():
-                if NOSELECT_FLAG in flags:
-                    continue
+        for name, (flags, _) in self.get_folder_overview().items():
+            if NOSELECT_FLAG in flags:
+                continue
 
-                if name == alias_folders.get("inbox"):
-                    continue
+            if name == alias_folders.get("inbox"):
+                continue
 
-                name_without_prefix = name
-                if prefix:
-                    name_without_prefix = name[len(prefix) :]
-                    name = f"{prefix}{name}"
+            name_without_prefix = name
+            if prefix:
+                name_without_prefix = name[len(prefix) :]
+                name = f"{prefix}{name}"
 
-                if name_without_prefix not in alias_folder_names:
-                    folder_names.append(name_without_prefix)
+            if name_without_prefix not in alias_folder_names:
+                folder_names.append(name_without_prefix)
 
         return folder_names
 
@@ -119,6 +208,9 @@ class Account(object):
             with self.get_imap_connection() as connection:
                 connection.create_folder(folder.name)
 
+            with self.folder_overview_lock:
+                self.folder_overview = None
+
             folder.get_and_set_email_uids()
 
         return folder.name
@@ -0,0 +1,135 @@
+"""
+Compression of the (small, repetitive) header text stored in the folder cache,
+using zlib with a preset dictionary built from the existing cache.
+
+Stored values are prefixed with the codec & dictionary ID used, so any value can
+be read back whatever the current dictionary is.
+"""
+
+import re
+import struct
+import zlib
+from collections import Counter
+
+RAW = 0
+ZLIB = 1
+
+# Codec (byte) + dictionary ID (0 = none)
+VALUE_HEADER = struct.Struct(">BI")
+
+# Values shorter than this are stored raw, compression can't win
+MIN_COMPRESS_SIZE = 32
+
+# zlib only uses the last 32KB of a preset dictionary
+DICTIONARY_SIZE = 32 * 1024
+
+ZLIB_LEVEL = 6
+ZLIB_WBITS = -15  # raw deflate, no zlib header/checksum
+
+# Tokens used to build raw content dictionaries: domains, words & punctuation runs
+DICTIONARY_TOKEN_REGEX = re.compile(rb"@[\w.-]+>?|\w+\s*|[^\w\s]+\s*")
+
+
+class CompressionError(Exception):
+    pass
+
+
+class CompressionDictionary(object):
+    def __init__(self, dictionary_id, codec, data):
+        self.id = dictionary_id
+        self.codec = codec
+        self.data = data
+
+        if codec != ZLIB:
+            raise CompressionError(f"Unsupported dictionary codec: {codec}")
+
+    def __str__(self):
+        return f"CompressionDictionary({self.id})"
+
+    def compress(self, data):
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, ZLIB_WBITS, zdict=self.data)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        decompressor = zlib.decompressobj(ZLIB_WBITS, zdict=self.data)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+def compress_value(value, dictionary=None, compress=True):
+    """
+    Compress a text value for storage, with the (optional) dictionary.
+    """
+
+    if value is None:
+        return None
+
+    data = value.encode("utf-8", "surrogateescape")
+
+    if compress and len(data) >= MIN_COMPRESS_SIZE:
+        if dictionary:
+            compressed_data = dictionary.compress(data)
+            codec, dictionary_id = dictionary.codec, dictionary.id
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, ZLIB_WBITS)
+            compressed_data = compressor.compress(data) + compressor.flush()
+            codec, dictionary_id = ZLIB, 0
+
+        if len(compressed_data) < len(data):
+            return VALUE_HEADER.pack(codec, dictionary_id) + compressed_data
+
+    return VALUE_HEADER.pack(RAW, 0) + data
+
+
+def decompress_value(value, get_dictionary):
+    """
+    Decompress a stored value, `get_dictionary` is called with the dictionary ID
+    when the value was compressed with a dictionary.
+    """
+
+    if value is None:
+        return None
+
+    codec, dictionary_id = VALUE_HEADER.unpack_from(value)
+    data = value[VALUE_HEADER.size :]
+
+    if codec == ZLIB and not dictionary_id:
+        data = zlib.decompress(data, ZLIB_WBITS)
+    elif codec != RAW:
+        dictionary = get_dictionary(dictionary_id)
+        if not dictionary:
+            raise CompressionError(f"Missing compression dictionary: {dictionary_id}")
+        data = dictionary.decompress(data)
+
+    return data.decode("utf-8", "surrogateescape")
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """
+    Build dictionary data from a list of (bytes) sample values.
+    """
+
+    # zlib has no dictionary trainer - instead collect the repeated tokens that
+    # save the most bytes, with the most valuable last (cheapest to reference).
+    token_counts = Counter()
+    for sample in samples:
+        token_counts.update(DICTIONARY_TOKEN_REGEX.findall(sample))
+
+    scored_tokens = sorted(
+        (
+            (count * len(token), token)
+            for token, count in token_counts.items()
+            if count > 1 and len(token) > 2
+        ),
+        reverse=True,
+    )
+
+    tokens = []
+    dictionary_size = 0
+
+    for _, token in scored_tokens:
+        if dictionary_size + len(token) > size:
+            break
+        tokens.append(token)
+        dictionary_size += len(token)
+
+    return b"".join(reversed(tokens))
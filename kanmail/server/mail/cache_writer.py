@@ -0,0 +1,187 @@
+from collections import defaultdict
+from threading import Condition, Event, Thread
+
+from kanmail.log import logger
+from kanmail.server.app import db
+
+# Max number of queued writes to apply in a single transaction
+MAX_WRITES_PER_TRANSACTION = 1000
+
+
+class CacheWriter(object):
+    """
+    Single background thread that applies cache writes, so request threads never
+    wait on SQLite commits/fsyncs.
+
+    Writes are applied in the order they were queued, but all pending writes are
+    drained & committed in one transaction. Consecutive header writes for the same
+    folder are coalesced into a single (last write wins per UID) batch write.
+
+    If a folder write fails even when retried alone it's dropped, and
+    `on_dropped_folder_write` (if set) is called with the folder ID so the folder's
+    cache can be invalidated.
+    """
+
+    def __init__(self, on_dropped_folder_write=None):
+        self.pending = []
+        self.condition = Condition()
+        self.thread = None
+
+        self.on_dropped_folder_write = on_dropped_folder_write
+        # Map of folder ID -> number of queued (not yet applied) folder writes
+        self.pending_folder_writes = defaultdict(int)
+
+    def __str__(self):
+        return "CacheWriter"
+
+    def log(self, method, message):
+        func = getattr(logger, method)
+        func(f"[{self}]: {message}")
+
+    def ensure_started(self):
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.thread = Thread(name="Cache writer", target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _queue(self, item):
+        with self.condition:
+            self.ensure_started()
+            self.pending.append(item)
+
+            kind, _, args = item
+            if kind == "folder":
+                self.pending_folder_writes[args[0]] += 1
+
+            self.condition.notify()
+
+    def write(self, func, *args):
+        """
+        Queue a write function, called (in the writer thread) with any args, to
+        make changes to `db.session` - the writer commits.
+        """
+
+        self._queue(("call", func, args))
+
+    def write_folder(self, func, folder_id, *args):
+        """
+        Queue a write changing a folder's existing cache rows (flags, deletes, UID
+        ranges), `func` is called with the folder ID & any args. Readers that miss
+        the memory cache flush these first, see `flush_folder`.
+        """
+
+        self._queue(("folder", func, (folder_id, *args)))
+
+    def write_headers(self, func, folder_id, uid_to_headers):
+        """
+        Queue a (coalescable) headers write, `func` is called with the folder ID
+        and a dict of UID -> headers.
+        """
+
+        self._queue(("headers", func, (folder_id, dict(uid_to_headers))))
+
+    def flush(self):
+        """
+        Block until all writes queued before this call have been committed.
+        """
+
+        event = Event()
+        self._queue(("flush", event.set, ()))
+        event.wait()
+
+    def flush_folder(self, folder_id):
+        """
+        Flush, only if there are queued folder writes for the given folder ID - so
+        reads from the DB never see rows those writes are yet to change.
+        """
+
+        with self.condition:
+            if not self.pending_folder_writes.get(folder_id):
+                return
+
+        self.flush()
+
+    def _take_pending(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+
+            items = self.pending[:MAX_WRITES_PER_TRANSACTION]
+            self.pending = self.pending[MAX_WRITES_PER_TRANSACTION:]
+
+        return items
+
+    def _coalesce(self, items):
+        writes = []
+        flushes = []
+
+        for kind, func, args in items:
+            if kind == "flush":
+                flushes.append(func)
+                continue
+
+            if kind == "headers" and writes:
+                last_kind, last_func, last_args = writes[-1]
+                if last_kind == "headers" and last_func is func and last_args[0] == args[0]:
+                    last_args[1].update(args[1])
+                    continue
+
+            writes.append((kind, func, args))
+
+        return writes, flushes
+
+    def _apply(self, writes):
+        for _, func, args in writes:
+            func(*args)
+        db.session.commit()
+
+    def _drop_write(self, write):
+        kind, func, args = write
+        if kind not in ("folder", "headers") or not self.on_dropped_folder_write:
+            return
+
+        try:
+            self.on_dropped_folder_write(args[0])
+            db.session.commit()
+        except Exception as e:
+            logger.exception(f"[{self}]: failed to handle dropped write {func}: {e}")
+            db.session.rollback()
+
+    def _complete_folder_writes(self, writes):
+        with self.condition:
+            for kind, _, args in writes:
+                if kind == "folder":
+                    self.pending_folder_writes[args[0]] -= 1
+                    if not self.pending_folder_writes[args[0]]:
+                        self.pending_folder_writes.pop(args[0])
+
+    def run(self):
+        while True:
+            writes, flushes = self._coalesce(self._take_pending())
+
+            try:
+                self._apply(writes)
+            except Exception as e:
+                self.log("warning", f"Failed to apply {len(writes)} writes, retrying each: {e}")
+                db.session.rollback()
+
+                for write in writes:
+                    try:
+                        self._apply([write])
+                    except Exception as e:
+                        logger.exception(f"[{self}]: failed to apply write {write[1]}: {e}")
+                        db.session.rollback()
+                        self._drop_write(write)
+            finally:
+                db.session.remove()
+                self._complete_folder_writes(writes)
+
+                for flush in flushes:
+                    flush()
+
+            self.log("debug", f"Applied {len(writes)} writes")
+
+
+FOLDER_CACHE_WRITER = CacheWriter()
@@ -2,24 +2,27 @@ import ssl
 from base64 import b64encode
 from contextlib import contextmanager
 from imaplib import IMAP4
-from queue import LifoQueue
+from queue import Empty, LifoQueue
 from socket import error as socket_error
+from threading import BoundedSemaphore, Lock
 from time import time
 
 import certifi
-from imapclient import IMAPClient
 from imapclient.exceptions import IMAPClientAbortError, IMAPClientError, LoginError
 
 from kanmail.log import logger
 from kanmail.secrets import get_password, set_password
 from kanmail.settings.constants import DEBUG_SMTP
 
+from .imap_client import KanmailIMAPClient, TransferStats
 from .oauth import get_oauth_tokens_from_refresh_token, invalidate_access_token
 from .smtp import SMTP, SMTP_SSL
 
 DEFAULT_ATTEMPTS = 3
 DEFAULT_CONNECTIONS = 10
 DEFAULT_TIMEOUT = 10
+DEFAULT_FETCH_CHUNK_SIZE = 100
+DEFAULT_FETCH_PARALLELISM = 4
 
 
 class ConnectionSettingsError(ValueError):
@@ -42,8 +45,9 @@ class ImapConnectionWrapper(object):
     _imap = None
     _selected_folder = None
 
-    def __init__(self, config):
+    def __init__(self, config, selected_folder=None):
         self.config = config
+        self._selected_folder = selected_folder
 
     def __getattr__(self, key):
         if self._imap is None:
@@ -92,6 +96,16 @@ class ImapConnectionWrapper(object):
 
         return wrapper
 
+    def get_imap(self):
+        """
+        Get the underlying IMAPClient (connecting if needed), for callers that
+        handle their own errors/reconnects, eg IDLE watchers.
+        """
+
+        if self._imap is None:
+            self.try_make_imap()
+        return self._imap
+
     def try_make_imap(self):
         try:
             self.make_imap()
@@ -113,7 +127,7 @@ class ImapConnectionWrapper(object):
             self.config.log("warning", "Disabling SSL hostname verification!")
             ssl_context.check_hostname = False
 
-        imap = IMAPClient(
+        imap = KanmailIMAPClient(
             self.config.host,
             port=self.config.port,
             ssl=self.config.ssl,
@@ -135,16 +149,37 @@ class ImapConnectionWrapper(object):
         else:
             imap.login(self.config.username, self.config.password)
 
-        if self._selected_folder:
-            imap.select_folder(self._selected_folder)
-
         # Ensure the IMAP object has capabilities cached as this is used internally
         # within imapclient.
-        imap.capabilities()
+        capabilities = imap.capabilities()
+
+        # Compress everything after login (RFC 4978), header fetches are large &
+        # very repetitive.
+        if self.config.compress and b"COMPRESS=DEFLATE" in capabilities:
+            imap.compress(self.config.transfer_stats)
+            self.config.log("debug", "Enabled COMPRESS=DEFLATE")
+
+        # QRESYNC (RFC 7162) must be enabled before selecting a folder, once enabled
+        # the server sends VANISHED responses instead of EXPUNGE.
+        if b"QRESYNC" in capabilities:
+            imap.enable("QRESYNC")
+
+        if self._selected_folder:
+            imap.select_folder(self._selected_folder)
 
         self._imap = imap
         self.config.log("info", f"Connected to IMAP server: {server_string}")
 
+    def pop_untagged_responses(self, name):
+        """
+        Pop any untagged responses (eg VANISHED) imaplib has collected but imapclient
+        doesn't handle.
+        """
+
+        if self._imap is None:
+            return []
+        return self._imap._imap.untagged_responses.pop(name, [])
+
     def set_selected_folder(self, selected_folder):
         self.select_folder(selected_folder)
         self._selected_folder = selected_folder
@@ -225,6 +260,9 @@ class ImapConnectionPool(ConnectionMixin):
         timeout=DEFAULT_TIMEOUT,
         max_connections=DEFAULT_CONNECTIONS,
         max_attempts=DEFAULT_ATTEMPTS,
+        disable_compression=False,
+        fetch_chunk_size=DEFAULT_FETCH_CHUNK_SIZE,
+        fetch_parallelism=DEFAULT_FETCH_PARALLELISM,
     ):
         self.account = account
         self.host = host
@@ -238,7 +276,19 @@ class ImapConnectionPool(ConnectionMixin):
         self.timeout = timeout
         self.max_attempts = max_attempts
 
+        self.compress = not disable_compression
+        self.transfer_stats = TransferStats()
+
+        # Large header fetches are split into chunks of UIDs, fetched in parallel
+        # over (up to) this many pooled connections.
+        self.fetch_chunk_size = max(1, fetch_chunk_size)
+        self.fetch_parallelism = max(1, min(fetch_parallelism, max_connections))
+        # Account wide limit on parallel fetch workers, shared by bulk syncs and
+        # chunked header fetches so nesting them doesn't multiply connections.
+        self.fetch_workers = BoundedSemaphore(self.fetch_parallelism)
+
         self.pool = LifoQueue()
+        self.spare_connection_lock = Lock()
 
         # Push/start all the connections
         for _ in range(max_connections):
@@ -251,6 +301,61 @@ class ImapConnectionPool(ConnectionMixin):
         connection = self.pool.get()
         self.log("debug", f"Got connection from pool: {self.pool.qsize()} (-1)")
 
+        with self.use_connection(connection, selected_folder=selected_folder):
+            yield connection
+
+    @contextmanager
+    def get_spare_connection(self, selected_folder=None):
+        """
+        Get a connection for background work, only if doing so leaves at least one
+        in the pool for user requests - otherwise yields `None` without waiting.
+        """
+
+        self.check_auth_settings()
+
+        with self.spare_connection_lock:
+            try:
+                connection = self.pool.get_nowait()
+            except Empty:
+                connection = None
+            else:
+                if self.pool.empty():
+                    self.pool.put(connection)
+                    connection = None
+
+        if connection is None:
+            self.log("debug", "No spare connection in pool")
+            yield None
+            return
+
+        self.log("debug", f"Got spare connection from pool: {self.pool.qsize()} (-1)")
+
+        with self.use_connection(connection, selected_folder=selected_folder):
+            yield connection
+
+    @contextmanager
+    def reserve_fetch_workers(self, count, blocking=False):
+        """
+        Reserve up to count of the account's fetch workers, yielding the number
+        reserved. Without blocking this may be zero, and the caller should do the
+        work itself (in the current thread) instead.
+        """
+
+        reserved = 0
+
+        for _ in range(count):
+            if not self.fetch_workers.acquire(blocking=blocking and reserved == 0):
+                break
+            reserved += 1
+
+        try:
+            yield reserved
+        finally:
+            for _ in range(reserved):
+                self.fetch_workers.release()
+
+    @contextmanager
+    def use_connection(self, connection, selected_folder=None):
         try:
             if selected_folder:
                 connection.set_selected_folder(selected_folder)
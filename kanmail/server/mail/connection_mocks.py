@@ -13,6 +13,7 @@ from datetime import datetime
 from os import environ
 from random import choice
 from time import sleep
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
 from faker import Faker
@@ -98,7 +99,6 @@ def make_fake_fetch_data(folder, uid):
     fake_data = {
         b"FLAGS": ["\\Seen"],
         b"BODYSTRUCTURE": make_fake_bodystructure(),
-        b"BODY[1]<0>": f"{body_text[0][:500]}",
         b"BODY[1]": "\n\n".join(body_text),
         b"BODY[HEADER.FIELDS (REFERENCES CONTENT-TRANSFER-ENCODING)]": headers,
         b"RFC822.SIZE": 100,
@@ -138,13 +138,32 @@ def get_fake_fetch_item(folder, uid, keys, imap_host):
         fake_data = make_fake_fetch_data(folder, uid)
         UID_TO_FAKE_DATA[imap_uid] = fake_data
 
-    return {key: value for key, value in fake_data.items() if key in keys}
+    data = {key: value for key, value in fake_data.items() if key in keys}
+
+    # Serve partial fetches (BODY[1]<0.N>) from the start of the full data
+    for key, size in get_partial_key_sizes(keys).items():
+        full_key = key[: key.index(b"<")]
+        if full_key in fake_data:
+            value = fake_data[full_key]
+            if isinstance(value, str):
+                value = value.encode()
+            data[key] = value[:size]
+
+    return data
 
 
 def make_key(key):
-    key = key.replace("BODY.PEEK", "BODY")
-    key = re.sub(r"<0\.[0-9]+>", "<0>", key)
-    return key.encode()
+    # Partial fetch keys (<0.N>) are served by `get_partial_key_sizes`
+    return key.replace("BODY.PEEK", "BODY").encode()
+
+
+def get_partial_key_sizes(keys):
+    key_sizes = {}
+    for key in keys:
+        match = re.search(rb"<0\.([0-9]+)>$", key)
+        if match:
+            key_sizes[key[: match.start()] + b"<0>"] = int(match.group(1))
+    return key_sizes
 
 
 class FakeFolderData(object):
@@ -153,17 +172,24 @@ class FakeFolderData(object):
 
         self.name = name
         self.uids = tuple(range(uid_offset + 1, uid_offset + 10))
-        self.status = {
-            b"UIDVALIDITY": 1,
-        }
+        self.uid_next = uid_offset + 10
 
     def __str__(self):
         return f"FakeFolderData({self.name})"
 
+    @property
+    def status(self):
+        return {
+            b"MESSAGES": len(self.uids),
+            b"UIDNEXT": self.uid_next,
+            b"UIDVALIDITY": 1,
+        }
+
     def add_uids(self, uids):
         new_uids = list(self.uids)
         new_uids.extend(uids)
         self.uids = new_uids
+        self.uid_next = max([self.uid_next - 1, *uids]) + 1
         logger.debug(f"Added {len(uids)} UIDs: {self.uids}")
 
     def remove_uids(self, uids):
@@ -179,6 +205,8 @@ class FakeIMAPClient(object):
         logger.debug(f"Creating fake IMAP: ({args}, {kwargs})")
 
         self._imap_host = imap_host
+        # Stands in for imaplib, whose untagged responses are read directly
+        self._imap = SimpleNamespace(untagged_responses={})
 
         for folder in ALIAS_FOLDERS + OTHER_FOLDERS:
             self._ensure_folder(folder)
@@ -227,6 +255,12 @@ class FakeIMAPClient(object):
         random_sleep()
         return self._ensure_folder(folder_name).status
 
+    def folder_statuses(self, folder_names, keys):
+        random_sleep()
+        return {
+            folder_name: self._ensure_folder(folder_name).status for folder_name in folder_names
+        }
+
     def find_special_folder(self, alias_name):
         return str(alias_name)
 
@@ -239,6 +273,10 @@ class FakeIMAPClient(object):
         folder = self._ensure_folder(new_folder)
         folder.add_uids(uids)
 
+        # Fake folders share UIDs, so copies keep theirs
+        uids = ",".join(str(uid) for uid in uids)
+        return f"[COPYUID 1 {uids} {uids}] Copy completed".encode()
+
     def delete_messages(self, uids):
         random_sleep()
         folder = self._current_folder
@@ -260,6 +298,6 @@ class FakeIMAPClient(object):
 
 
 def bootstrap_fake_connections():
-    patch("kanmail.server.mail.connection.IMAPClient", FakeIMAPClient).start()
+    patch("kanmail.server.mail.connection.KanmailIMAPClient", FakeIMAPClient).start()
     patch("kanmail.server.mail.connection.SMTP", MagicMock()).start()
     patch("kanmail.server.mail.connection.SMTP_SSL", MagicMock()).start()
@@ -1,21 +1,64 @@
+from collections import deque
 from contextlib import contextmanager
 from datetime import date, timedelta
+from threading import Condition, Event, Thread
 
 from imapclient.exceptions import IMAPClientError
+from imapclient.util import to_bytes
 
 from kanmail.log import logger
-from kanmail.server.util import lock_class_method
+from kanmail.server.util import execute_threaded, lock_class_method
 from kanmail.settings import get_system_setting
-from kanmail.settings.constants import DEBUG
+from kanmail.settings.constants import CACHE_ENABLED, DEBUG
 
 from .connection import ImapConnectionError
 from .contacts import add_contacts
 from .fixes import fix_email_uids, fix_missing_uids
-from .folder_cache import FolderCache
-from .util import decode_string, make_email_headers, parse_bodystructure
+from .folder_cache import FolderCache, UnloadedFolder
+from .uid_ranges import (
+    count_uid_ranges,
+    expand_uid_ranges,
+    format_sequence_set,
+    make_uid_ranges,
+    subtract_uid_ranges,
+)
+from .util import (
+    decode_string,
+    make_email_headers,
+    parse_bodystructure,
+    parse_copyuid_response,
+    parse_vanished_responses,
+)
 
 SEEN_FLAG = b"\\Seen"
 
+# Number of syncs that only search for new UIDs before a full UID search
+FULL_UID_SEARCH_INTERVAL = 20
+
+# Server side sort order (RFC 5256) - newest first by date, as displayed
+SORT_CRITERIA = ["REVERSE DATE"]
+
+# Server side threading algorithm (RFC 5256)
+THREAD_ALGORITHM = "REFERENCES"
+# Max new UIDs to add to existing threads before re-threading the folder
+MAX_INCREMENTAL_THREAD_UIDS = 50
+
+# Max time to wait for headers being read ahead before fetching them again
+READ_AHEAD_WAIT_TIMEOUT = 5
+# Max batches of UIDs queued to read ahead, older ones are dropped (scrolled past)
+READ_AHEAD_MAX_QUEUED = 2
+
+
+def _flatten_thread(thread):
+    # Threads are nested tuples of UIDs, ie (1, (2, 3), (4, 5))
+    uids = []
+    for item in thread:
+        if isinstance(item, tuple):
+            uids.extend(_flatten_thread(item))
+        else:
+            uids.append(item)
+    return uids
+
 
 class FolderError(Exception):
     pass
@@ -55,6 +98,26 @@ class Folder(object):
         self.email_uids = set()
         # Set of UIDs we've "seen" - ie ones not to return again
         self.seen_email_uids = set()
+        # UIDs copied/moved here since the last sync, see `add_copied_email_uids`
+        self.copied_email_uids = set()
+        # List of UIDs in server SORT order, see `get_sorted_email_uids`
+        self.sorted_email_uids = None
+        # List of threads (lists of UIDs) from the server, see `get_threads`
+        self.threads = None
+        self.incremental_thread_count = 0
+        # Folder status (+ sync date) as of the last sync, see `sync_emails`
+        self.sync_state = None
+        # Number of syncs since the last full UID search
+        self.incremental_sync_count = 0
+
+        # Batches of UIDs queued to have their headers fetched in the background by
+        # a single worker thread, and the UIDs it's fetching now - see
+        # `read_ahead_email_headers`.
+        self.read_ahead_queue = deque(maxlen=READ_AHEAD_MAX_QUEUED)
+        self.read_ahead_uids = set()
+        self.read_ahead_thread = None
+        self.read_ahead_condition = Condition()
+        self.read_ahead_cancelled = Event()
 
         try:
             # This will use any cached UID values, so either the folder exists
@@ -88,61 +151,88 @@ class Folder(object):
         func(f"[{self}]: {message}")
 
     @contextmanager
-    def get_connection(self):
+    def get_connection(self, connection=None):
         """
-        Shortcut to getting a connection and selecting our folder with it.
+        Shortcut to getting a connection and selecting our folder with it, or using
+        the given one (which already has our folder selected).
         """
 
-        with self.account.get_imap_connection(selected_folder=self.name) as connection:
+        if connection:
             yield connection
+            return
 
-    @lock_class_method  # prevent parallel writes to the same UID (TODO? lock by uid arg)
-    def add_cache_flags(self, uid, new_flag):
-        headers = self.cache.get_headers(uid)
-
-        if headers and new_flag not in headers["flags"]:
-            flags = list(headers["flags"])
-            flags.append(new_flag)
-            headers["flags"] = tuple(flags)
-            self.cache.set_headers(uid, headers)
-
-    @lock_class_method  # prevent parallel writes to the same UID (TODO? lock by uid arg)
-    def remove_cache_flags(self, uid, remove_flag):
-        headers = self.cache.get_headers(uid)
-
-        if headers and remove_flag in headers["flags"]:
-            flags = list(headers["flags"])
-            flags.remove(remove_flag)
-            headers["flags"] = tuple(flags)
-            self.cache.set_headers(uid, headers)
+        with self.account.get_imap_connection(selected_folder=self.name) as connection:
+            yield connection
 
     def get_email_parts(self, email_uids, part, retry=0):
         """
         Fetch actual email body parts, where the part is the same for each email.
         """
 
-        self.log("debug", f"Fetching {len(email_uids)} message parts ({part})")
-
-        body_keyname = f"BODY[{part}]"
+        # Map of UID -> raw (undecoded) part data, starting with any cached parts
+        uid_to_data = self.cache.batch_get_parts(email_uids, part)
+        uids_to_get = [uid for uid in email_uids if uid not in uid_to_data]
 
-        with self.get_connection() as connection:
-            email_parts = connection.fetch(email_uids, [body_keyname])
+        if uids_to_get and self.has_gmail_ids():
+            uid_to_data.update(self.get_shared_email_parts(uids_to_get, part))
+            uids_to_get = [uid for uid in uids_to_get if uid not in uid_to_data]
 
-        # Fix any dodgy UIDs
-        email_parts = fix_email_uids(email_uids, email_parts)
+        cached_uids = list(uid_to_data.keys())
 
-        self.log("debug", f"Fetched {len(email_uids)} email parts ({part})")
+        self.log(
+            "debug",
+            f"Fetching {len(uids_to_get)} message parts ({part}) (+{len(cached_uids)} from cached)",
+        )
 
-        emails = {}
         failed_email_uids = []
-        body_keyname = body_keyname.encode()  # returned as bytes via IMAP
 
-        uid_to_parts = {
-            uid: headers["parts"] for uid, headers in self.get_email_headers(email_uids).items()
-        }
+        if uids_to_get:
+            body_keyname = f"BODY[{part}]"
+
+            with self.get_connection() as connection:
+                email_parts = connection.fetch(uids_to_get, [body_keyname])
 
-        for uid, data in email_parts.items():
-            parts = uid_to_parts.get(uid, {})
+            # Fix any dodgy UIDs
+            email_parts = fix_email_uids(uids_to_get, email_parts)
+
+            self.log("debug", f"Fetched {len(uids_to_get)} email parts ({part})")
+
+            body_keyname = body_keyname.encode()  # returned as bytes via IMAP
+            uid_to_fetched_data = {}
+
+            for uid, data in email_parts.items():
+                if body_keyname not in data:
+                    if retry > connection.config.max_attempts:
+                        raise FolderError(f"Missing data for UID/part {uid}/{part}")
+
+                    failed_email_uids.append(uid)
+                    continue
+
+                uid_to_fetched_data[uid] = data[body_keyname]
+
+            self.cache.batch_set_parts(
+                part,
+                {uid: data for uid, data in uid_to_fetched_data.items() if data is not None},
+            )
+            uid_to_data.update(uid_to_fetched_data)
+
+        uid_to_headers = self.get_email_headers(email_uids)
+
+        # Fetching the part (not peeking) marks the email as seen on the server, so
+        # when served from the cache mark any unseen emails ourselves.
+        unseen_cached_uids = [
+            uid
+            for uid in cached_uids
+            if uid in uid_to_headers and SEEN_FLAG not in uid_to_headers[uid]["flags"]
+        ]
+        if unseen_cached_uids:
+            with self.get_connection() as connection:
+                connection.add_flags(unseen_cached_uids, [SEEN_FLAG])
+
+        emails = {}
+
+        for uid, data in uid_to_data.items():
+            parts = uid_to_headers[uid]["parts"] if uid in uid_to_headers else {}
             data_meta = parts.get(part)
 
             if not data_meta:
@@ -152,20 +242,12 @@ class Folder(object):
                 else:
                     self.log("warning", message)
 
-            if body_keyname not in data:
-                if retry > connection.config.max_attempts:
-                    raise FolderError(f"Missing data for UID/part {uid}/{part}")
-
-                failed_email_uids.append(uid)
-                continue
-
-            data = data[body_keyname]
             if data is not None:
                 data = decode_string(data, data_meta, as_str=False)
 
             emails[uid] = data
 
-            self.add_cache_flags(uid, SEEN_FLAG)
+        self.cache.batch_add_flags(emails.keys(), SEEN_FLAG)
 
         if failed_email_uids:
             self.log(
@@ -181,14 +263,83 @@ class Folder(object):
             )
         return emails
 
-    def get_email_headers(self, email_uids):
+    def has_gmail_ids(self):
         """
-        Fetch email headers/meta information (to display in a folder list).
+        Whether the server provides Gmail message/thread IDs (X-GM-EXT-1), which
+        are the same for a message in any folder (label) - unlike UIDs.
         """
 
-        emails = {}
+        return b"X-GM-EXT-1" in self.account.get_capabilities()
 
-        # First get/remove any cached headers before fetching
+    def get_shared_email_parts(self, email_uids, part):
+        """
+        Get parts for emails cached in any other folder, via the Gmail message IDs
+        in their headers. Found parts are also cached for this folder.
+        """
+
+        uid_to_headers = self.get_email_headers(email_uids)
+        uid_to_gm_msgid = {
+            uid: headers["gm_msgid"]
+            for uid, headers in uid_to_headers.items()
+            if headers.get("gm_msgid")
+        }
+        if not uid_to_gm_msgid:
+            return {}
+
+        gm_msgid_to_data = self.cache.batch_get_parts_by_gm_msgid(uid_to_gm_msgid.values(), part)
+        uid_to_data = {
+            uid: gm_msgid_to_data[gm_msgid]
+            for uid, gm_msgid in uid_to_gm_msgid.items()
+            if gm_msgid in gm_msgid_to_data
+        }
+
+        self.log("debug", f"Found {len(uid_to_data)} message parts ({part}) in other folders")
+
+        if uid_to_data:
+            self.cache.batch_set_parts(part, uid_to_data)
+        return uid_to_data
+
+    def get_shared_email_headers(self, email_uids, connection=None):
+        """
+        Get headers for emails cached in any other folder by fetching just their
+        Gmail message IDs (and flags, which are per folder), rather than the full
+        headers/excerpt. Found headers are also cached for this folder.
+        """
+
+        with self.get_connection(connection) as connection:
+            email_ids = connection.fetch(email_uids, ["FLAGS", "X-GM-MSGID"])
+
+        email_ids = fix_email_uids(email_uids, email_ids)
+        uid_to_gm_msgid = {
+            uid: data[b"X-GM-MSGID"] for uid, data in email_ids.items() if b"X-GM-MSGID" in data
+        }
+
+        gm_msgid_to_headers = self.cache.batch_get_headers_by_gm_msgid(uid_to_gm_msgid.values())
+        uid_to_headers = {}
+
+        for uid, gm_msgid in uid_to_gm_msgid.items():
+            headers = gm_msgid_to_headers.get(gm_msgid)
+            if headers:
+                uid_to_headers[uid] = dict(
+                    headers,
+                    uid=uid,
+                    seq=email_ids[uid].get(b"SEQ"),
+                    flags=email_ids[uid][b"FLAGS"],
+                )
+
+        self.log("debug", f"Found {len(uid_to_headers)} message headers in other folders")
+
+        if uid_to_headers:
+            self.cache.batch_set_headers(uid_to_headers)
+        return uid_to_headers
+
+    def get_cached_email_headers(self, email_uids, connection=None):
+        """
+        Get any cached headers for a list of UIDs, returning a dict of UID -> headers
+        and the list of UIDs not cached.
+        """
+
+        emails = {}
         uids_to_get = []
         uid_to_cached_headers = self.cache.batch_get_headers(email_uids)
 
@@ -205,6 +356,41 @@ class Folder(object):
             else:
                 uids_to_get.append(uid)
 
+        # The same Gmail message is in many folders (labels), so look for it in the
+        # cache of the other folders before fetching everything. Only worth the
+        # (small) extra fetch of the message IDs once any other folder is cached.
+        if uids_to_get and self.has_gmail_ids() and self.cache.has_shared_headers():
+            emails.update(self.get_shared_email_headers(uids_to_get, connection=connection))
+            uids_to_get = [uid for uid in uids_to_get if uid not in emails]
+
+        return emails, uids_to_get
+
+    def get_email_header_fetch_keys(self):
+        fetch_keys = [
+            "FLAGS",
+            "ENVELOPE",
+            "RFC822.SIZE",
+            "BODYSTRUCTURE",
+            # Best-effort excerpt, from just the start of the first part
+            f"BODY.PEEK[1]<0.{get_system_setting('excerpt_fetch_size')}>",
+            # References header for threading
+            # TODO: remove the peek from here?
+            "BODY.PEEK[HEADER.FIELDS (REFERENCES CONTENT-TRANSFER-ENCODING)]",
+        ]
+        if self.has_gmail_ids():
+            fetch_keys.append("X-GM-MSGID")
+        return fetch_keys
+
+    def get_email_headers(self, email_uids):
+        """
+        Fetch email headers/meta information (to display in a folder list).
+        """
+
+        # Rather than fetch the same headers twice, wait for any being read ahead
+        self.wait_for_read_ahead(email_uids)
+
+        emails, uids_to_get = self.get_cached_email_headers(email_uids)
+
         self.log(
             "debug",
             f"Fetching {len(uids_to_get)} message headers (+{len(emails)} from cached)",
@@ -213,24 +399,178 @@ class Folder(object):
         if not uids_to_get:
             return emails
 
-        with self.get_connection() as connection:
-            email_headers = connection.fetch(
-                uids_to_get,
-                [
-                    "FLAGS",
-                    "ENVELOPE",
-                    "RFC822.SIZE",
-                    "BODYSTRUCTURE",
-                    # Best-effort excerpt
-                    "BODY.PEEK[1]",
-                    # References header for threading
-                    # TODO: remove the peek from here?
-                    "BODY.PEEK[HEADER.FIELDS (REFERENCES CONTENT-TRANSFER-ENCODING)]",
-                ],
+        emails.update(self.fetch_email_headers(uids_to_get, self.get_email_header_fetch_keys()))
+        return emails
+
+    def read_ahead_email_headers(self, email_uids):
+        """
+        Fetch headers into the cache in the background, so they're ready when next
+        requested. Batches are queued for one worker thread per folder, which only
+        uses a spare pooled connection, skipping the read ahead if there isn't one.
+        """
+
+        # Read ahead headers would just be thrown away
+        if not CACHE_ENABLED:
+            return
+
+        with self.read_ahead_condition:
+            queued_uids = set(uid for uids in self.read_ahead_queue for uid in uids)
+            email_uids = [
+                uid
+                for uid in email_uids
+                if uid not in self.read_ahead_uids and uid not in queued_uids
+            ]
+            if not email_uids:
+                return
+
+            self.read_ahead_queue.append(email_uids)
+
+            if self.read_ahead_thread is None:
+                self.read_ahead_thread = Thread(
+                    name=f"Read ahead {self}",
+                    target=self.run_read_ahead_worker,
+                )
+                self.read_ahead_thread.daemon = True
+                self.read_ahead_thread.start()
+
+    def run_read_ahead_worker(self):
+        while True:
+            with self.read_ahead_condition:
+                if not self.read_ahead_queue:
+                    self.read_ahead_thread = None
+                    return
+
+                email_uids = self.read_ahead_queue.popleft()
+                self.read_ahead_uids.update(email_uids)
+                cancelled = self.read_ahead_cancelled
+
+            self.run_read_ahead(email_uids, cancelled)
+
+    def run_read_ahead(self, email_uids, cancelled):
+        try:
+            with self.account.connection_pool.get_spare_connection(
+                selected_folder=self.name,
+            ) as connection:
+                if connection is None:
+                    self.log("debug", f"Skipping read ahead of {len(email_uids)} headers")
+                    return
+
+                _, uids_to_get = self.get_cached_email_headers(
+                    email_uids,
+                    connection=connection,
+                )
+                self.finish_read_ahead(set(email_uids) - set(uids_to_get))
+
+                self.log("debug", f"Reading ahead {len(uids_to_get)} message headers")
+
+                chunk_size = self.account.connection_pool.fetch_chunk_size
+                fetch_keys = self.get_email_header_fetch_keys()
+
+                for i in range(0, len(uids_to_get), chunk_size):
+                    if cancelled.is_set():
+                        self.log("debug", "Read ahead cancelled")
+                        return
+
+                    chunk = uids_to_get[i : i + chunk_size]
+                    self.fetch_email_headers_chunk(chunk, fetch_keys, connection=connection)
+                    self.finish_read_ahead(chunk)
+        except Exception as e:
+            self.log("warning", f"Failed to read ahead message headers: {e}")
+        finally:
+            self.finish_read_ahead(email_uids)
+
+    def finish_read_ahead(self, email_uids):
+        with self.read_ahead_condition:
+            self.read_ahead_uids.difference_update(email_uids)
+            self.read_ahead_condition.notify_all()
+
+    def wait_for_read_ahead(self, email_uids):
+        """
+        Wait for any of the UIDs the read ahead is fetching now, each chunk is done
+        once cached. Any still queued are taken off the queue to be fetched directly.
+        """
+
+        email_uids = set(email_uids)
+
+        with self.read_ahead_condition:
+            queued = [
+                [uid for uid in uids if uid not in email_uids] for uids in self.read_ahead_queue
+            ]
+            self.read_ahead_queue.clear()
+            self.read_ahead_queue.extend(uids for uids in queued if uids)
+
+            self.read_ahead_condition.wait_for(
+                lambda: self.read_ahead_uids.isdisjoint(email_uids),
+                READ_AHEAD_WAIT_TIMEOUT,
             )
 
+    def cancel_read_ahead(self):
+        """
+        Stop any read ahead before its next chunk - fetches in progress complete.
+        """
+
+        with self.read_ahead_condition:
+            self.read_ahead_queue.clear()
+            self.read_ahead_cancelled.set()
+            self.read_ahead_cancelled = Event()
+
+    def fetch_email_headers(self, email_uids, fetch_keys):
+        """
+        Fetch headers for a list of UIDs, returned in UID order. Large fetches are
+        split into chunks fetched in parallel over multiple pooled connections, as
+        many as the account has fetch workers free (else in this thread).
+        """
+
+        config = self.account.connection_pool
+
+        email_uids = sorted(email_uids)
+        chunks = [
+            email_uids[i : i + config.fetch_chunk_size]
+            for i in range(0, len(email_uids), config.fetch_chunk_size)
+        ]
+
+        def fetch_chunks(chunks):
+            uid_to_headers = {}
+            for chunk in chunks:
+                uid_to_headers.update(self.fetch_email_headers_chunk(chunk, fetch_keys))
+            return uid_to_headers
+
+        parallelism = 1
+        if len(chunks) > 1:
+            parallelism = min(config.fetch_parallelism, len(chunks))
+
+        with config.reserve_fetch_workers(parallelism) as parallelism:
+            if parallelism > 1:
+                self.log(
+                    "debug",
+                    f"Fetching {len(email_uids)} message headers in {len(chunks)} chunks "
+                    f"over {parallelism} connections",
+                )
+                # Spread the chunks round-robin over the connections
+                results = execute_threaded(
+                    fetch_chunks,
+                    [(chunks[i::parallelism],) for i in range(parallelism)],
+                )
+            else:
+                results = [fetch_chunks(chunks)]
+
+        uid_to_headers = {}
+        for result in results:
+            uid_to_headers.update(result)
+
+        return dict(sorted(uid_to_headers.items()))
+
+    def fetch_email_headers_chunk(self, email_uids, fetch_keys, connection=None):
+        """
+        Fetch & cache headers for a chunk of UIDs - cached as each chunk completes,
+        so if any others fail they needn't be fetched again.
+        """
+
+        with self.get_connection(connection) as connection:
+            email_headers = connection.fetch(email_uids, fetch_keys)
+
         # Fix any dodgy UIDs
-        email_headers = fix_email_uids(uids_to_get, email_headers)
+        email_headers = fix_email_uids(email_uids, email_headers)
         uid_to_headers = {}
         contacts_to_save = set()
 
@@ -240,7 +580,6 @@ class Folder(object):
             if bodystructure:
                 parts = parse_bodystructure(bodystructure)
             headers = make_email_headers(self.account, self, uid, data, parts)
-            emails[uid] = headers
             uid_to_headers[uid] = headers
             contacts_to_save.update(
                 set(
@@ -260,7 +599,7 @@ class Folder(object):
 
         self.cache.batch_set_headers(uid_to_headers)
 
-        return emails
+        return uid_to_headers
 
     def check_update_unread_emails(self, email_uids):
         self.log(
@@ -276,17 +615,24 @@ class Folder(object):
             # For any seen emails, update cache and add to the list
             if SEEN_FLAG in data[b"FLAGS"]:
                 read_uids.append(uid)
-                self.add_cache_flags(uid, SEEN_FLAG)
+
+        self.cache.batch_add_flags(read_uids, SEEN_FLAG)
 
         return read_uids
 
     # UID handling
     #
 
-    def cache_uids(self):
+    def cache_uids(self, new_uids=None, deleted_uids=None):
         # If we're a query folder don't save the UIDs as we use the base, non-query
         # cache object to share header/part cache, but the UID lists differ.
-        if not self.query:
+        if self.query:
+            return
+
+        # Where we know what changed, only write the changes
+        if new_uids is not None or deleted_uids is not None:
+            self.cache.update_uids(new_uids, deleted_uids)
+        else:
             self.cache.set_uids(self.email_uids)
 
     def get_cached_uids(self):
@@ -299,17 +645,12 @@ class Folder(object):
             )
             return cached_uids
 
-    def get_email_uids(self, use_cache=True):
-        if use_cache and not self.query:
-            cached_uids = self.get_cached_uids()
-            if cached_uids:
-                return cached_uids
-
+    def get_search_query(self):
         # Searching
         if isinstance(self.query, (bytes, str)):
             # Use Gmails X-GM-RAW search extension if available - supports full
             # Gmail style search queries.
-            if b"X-GM-EXT-1" in self.account.get_capabilities():
+            if self.has_gmail_ids():
                 search_query = ["X-GM-RAW", self.query]
             else:
                 # IMAP uses polish notation (operator on the left)
@@ -317,13 +658,79 @@ class Folder(object):
 
         # Syncing
         else:
-            sync_days = get_system_setting("sync_days")
-            if sync_days and sync_days > 0:
-                days_ago = date.today() - timedelta(days=sync_days)
-                search_query = ["SINCE", days_ago]
+            since_date = self.get_sync_since_date()
+            if since_date:
+                search_query = ["SINCE", since_date]
             else:
                 search_query = ["ALL"]
 
+        return search_query
+
+    def can_esearch(self):
+        return b"ESEARCH" in self.account.get_capabilities()
+
+    def search_email_uid_ranges(self):
+        """
+        Search for the folder UIDs using ESEARCH (RFC 4731), which returns them as
+        a sequence set - so we get a UID range list without transferring or
+        creating every UID in the folder.
+        """
+
+        search_query = self.get_search_query()
+
+        self.log("debug", "Fetching message ID ranges")
+
+        with self.get_connection() as connection:
+            try:
+                results = connection.esearch(search_query)
+            except UnicodeEncodeError:
+                results = connection.esearch(search_query, charset="utf-8")
+
+        self.log(
+            "info",
+            (
+                f"Fetched {results[b'COUNT']} message UIDs in {len(results[b'ALL'])} ranges "
+                f"(min={results.get(b'MIN')}, max={results.get(b'MAX')})"
+            ),
+        )
+
+        return results[b"ALL"]
+
+    def search_changed_email_uids(self):
+        """
+        Search for the folder UIDs as ranges and diff them against our UIDs, only
+        expanding the differences. Returns (new UIDs, deleted UIDs).
+        """
+
+        uid_ranges = self.search_email_uid_ranges()
+
+        # Our cached UID ranges should always match our UIDs, but check the count
+        # to be sure before falling back to making ranges from the UIDs.
+        local_uid_ranges = None if self.query else self.cache.get_uid_ranges()
+        if local_uid_ranges is None or count_uid_ranges(local_uid_ranges) != len(self.email_uids):
+            local_uid_ranges = make_uid_ranges(self.email_uids)
+
+        new_uids = expand_uid_ranges(subtract_uid_ranges(uid_ranges, local_uid_ranges))
+        deleted_uids = expand_uid_ranges(subtract_uid_ranges(local_uid_ranges, uid_ranges))
+
+        return new_uids, deleted_uids
+
+    def get_email_uids(self, use_cache=True):
+        if use_cache and not self.query:
+            cached_uids = self.get_cached_uids()
+            if cached_uids:
+                return cached_uids
+
+        if self.can_esearch():
+            return expand_uid_ranges(self.search_email_uid_ranges())
+
+        # SORT returns the same UIDs as SEARCH, so keep the order while we're at it
+        if self.can_sort():
+            self.sorted_email_uids = self.sort_email_uids()
+            return set(self.sorted_email_uids)
+
+        search_query = self.get_search_query()
+
         self.log("debug", "Fetching message IDs")
 
         with self.get_connection() as connection:
@@ -338,15 +745,282 @@ class Folder(object):
         uids = set(message_uids)
         return uids
 
-    def check_cache_validity(self):
+    def can_sort(self):
+        return b"SORT" in self.account.get_capabilities()
+
+    def sort_email_uids(self, email_uids=None):
         """
-        Checks if our cached UID validity matches the server.
+        Get UIDs in SORT_CRITERIA order from the server, either all in the folder
+        (matching our search query) or just those given.
         """
 
+        if email_uids is None:
+            search_query = self.get_search_query()
+        else:
+            search_query = ["UID", format_sequence_set(make_uid_ranges(email_uids))]
+
+        self.log("debug", f"Sorting message IDs: {search_query}")
+
+        with self.get_connection() as connection:
+            return connection.sort(SORT_CRITERIA, search_query)
+
+    def get_sorted_email_uids(self):
+        """
+        Get our UIDs newest first. With SORT this is the server's date order, kept
+        up to date incrementally; otherwise by UID (assumed to be date order).
+
+        New UIDs are sorted along with our current newest - when that sorts after
+        them all they're simply newer, otherwise the whole folder is re-sorted.
+        """
+
+        if not self.can_sort():
+            return sorted(self.email_uids, reverse=True)
+
+        sorted_email_uids = [uid for uid in self.sorted_email_uids or [] if uid in self.email_uids]
+        new_email_uids = self.email_uids.difference(sorted_email_uids)
+
+        if new_email_uids and sorted_email_uids:
+            newest_uid = sorted_email_uids[0]
+            sorted_new_email_uids = list(self.sort_email_uids(new_email_uids | {newest_uid}))
+
+            # Empty/missing our newest if messages were expunged since searching
+            if sorted_new_email_uids and sorted_new_email_uids[-1] == newest_uid:
+                sorted_email_uids = sorted_new_email_uids[:-1] + sorted_email_uids
+            else:
+                self.log("debug", "New messages not newest, re-sorting folder")
+                sorted_email_uids = list(self.sort_email_uids())
+
+        elif new_email_uids:
+            sorted_email_uids = list(self.sort_email_uids())
+
+        # Anything the server didn't sort (added since we searched) goes last
+        missing_email_uids = self.email_uids.difference(sorted_email_uids)
+        sorted_email_uids.extend(sorted(missing_email_uids, reverse=True))
+
+        self.sorted_email_uids = [uid for uid in sorted_email_uids if uid in self.email_uids]
+        return self.sorted_email_uids
+
+    def can_thread(self):
+        return f"THREAD={THREAD_ALGORITHM}".encode() in self.account.get_capabilities()
+
+    def thread_email_uids(self, email_uids=None):
+        """
+        Get threads (lists of UIDs) from the server, either of the whole folder
+        (matching our search query) or just the UIDs given.
+        """
+
+        if email_uids is None:
+            search_query = self.get_search_query()
+        else:
+            search_query = ["UID", format_sequence_set(make_uid_ranges(email_uids))]
+
+        self.log("debug", f"Threading message IDs: {search_query}")
+
+        with self.get_connection() as connection:
+            threads = connection.thread(THREAD_ALGORITHM, search_query)
+
+        return [_flatten_thread(thread) for thread in threads]
+
+    def search_linked_email_uids(self, message_ids, references):
+        """
+        Search for messages that are referenced by, or reference, a thread - ie any
+        with a message ID in `references`, or referencing any of `message_ids`.
+        """
+
+        search_keys = [["HEADER", "Message-ID", message_id] for message_id in references]
+        for message_id in message_ids:
+            search_keys.append(["HEADER", "References", message_id])
+            search_keys.append(["HEADER", "In-Reply-To", message_id])
+
+        if not search_keys:
+            return set()
+
+        # IMAP OR takes two keys (polish notation), so nest them
+        search_query = search_keys[-1]
+        for search_key in reversed(search_keys[:-1]):
+            search_query = ["OR", *search_key, *search_query]
+
+        with self.get_connection() as connection:
+            return set(connection.search(search_query))
+
+    def add_email_uids_to_threads(self, threads, email_uids):
+        """
+        Thread new UIDs on the server, then join each new thread to any existing
+        threads its messages reference (or are referenced by).
+        """
+
+        uid_to_headers = self.get_email_headers(sorted(email_uids))
+        uid_to_thread = {uid: thread for thread in threads for uid in thread}
+
+        for new_thread in self.thread_email_uids(email_uids):
+            message_ids = set()
+            references = set()
+
+            for uid in new_thread:
+                headers = uid_to_headers.get(uid)
+                if not headers:
+                    continue
+
+                if headers["message_id"]:
+                    message_ids.add(decode_string(headers["message_id"]))
+                if headers["in_reply_to"]:
+                    references.add(decode_string(headers["in_reply_to"]))
+                references.update(headers["references"] or [])
+
+            linked_threads = []
+            for uid in self.search_linked_email_uids(message_ids, references - message_ids):
+                thread = uid_to_thread.get(uid)
+                if thread and not any(thread is linked for linked in linked_threads):
+                    linked_threads.append(thread)
+
+            thread = [uid for linked_thread in linked_threads for uid in linked_thread]
+            thread.extend(new_thread)
+
+            for uid in thread:
+                uid_to_thread[uid] = thread
+
+        # Unique threads, in order
+        thread_ids = set()
+        threads = []
+        for thread in uid_to_thread.values():
+            if id(thread) not in thread_ids:
+                thread_ids.add(id(thread))
+                threads.append(thread)
+        return threads
+
+    @lock_class_method
+    def get_threads(self):
+        """
+        Get the folder's threads (lists of UIDs) as computed by the server using
+        THREAD=REFERENCES, or `None` when not supported.
+
+        Threads are kept between calls - removed UIDs are dropped and new ones
+        added to the threads they reference. Subject based threading only applies
+        to full re-threads, which happen every FULL_UID_SEARCH_INTERVAL updates.
+        """
+
+        if not self.exists or not self.can_thread():
+            return
+
+        threads = self.threads or []
+
+        threaded_uids = {uid for thread in threads for uid in thread}
+        new_email_uids = self.email_uids - threaded_uids
+
+        if new_email_uids:
+            if (
+                not threads
+                or len(new_email_uids) > MAX_INCREMENTAL_THREAD_UIDS
+                or self.incremental_thread_count >= FULL_UID_SEARCH_INTERVAL
+            ):
+                threads = self.thread_email_uids()
+                self.incremental_thread_count = 0
+            else:
+                threads = self.add_email_uids_to_threads(threads, new_email_uids)
+                self.incremental_thread_count += 1
+
+        # Drop any removed UIDs (& so empty threads)
+        threads = [[uid for uid in thread if uid in self.email_uids] for thread in threads]
+        self.threads = [thread for thread in threads if thread]
+        return self.threads
+
+    def get_incremental_email_uids(self, status):
+        """
+        Get the folder UIDs by searching only for those added since the last sync
+        (UID <last UIDNEXT>:*). Returns `None` when a full search is needed - when
+        messages may have been removed since, or every FULL_UID_SEARCH_INTERVAL
+        syncs as a safety net.
+
+        Messages can only be added with UIDs >= the last UIDNEXT, so if the last
+        MESSAGES count plus those equals the current count nothing was removed.
+        """
+
+        if self.query or not self.sync_state:
+            return
+
+        messages, uid_next, uid_validity, _, since_date = self.sync_state
+
+        if uid_validity != status[b"UIDVALIDITY"] or since_date != self.get_sync_since_date():
+            return
+
+        if self.incremental_sync_count >= FULL_UID_SEARCH_INTERVAL:
+            return
+
+        new_uids = set()
+
+        if status[b"UIDNEXT"] > uid_next:
+            search_query = ["UID", f"{uid_next}:*"]
+            if since_date:
+                search_query.extend(["SINCE", since_date])
+
+            self.log("debug", f"Fetching message IDs from UID {uid_next}")
+
+            with self.get_connection() as connection:
+                new_uids = set(connection.search(search_query))
+
+            # "*" is the highest UID in the folder so N:* always includes it, even
+            # when below N. Also ignore anything added since we got the status.
+            new_uids = {uid for uid in new_uids if uid_next <= uid < status[b"UIDNEXT"]}
+
+        if messages + len(new_uids) != status[b"MESSAGES"]:
+            self.log("debug", "Message count changed, full UID search needed")
+            return
+
+        self.incremental_sync_count += 1
+        return self.email_uids | new_uids
+
+    def can_sync_changes(self):
+        """
+        Whether we can sync only what changed since the last sync using QRESYNC
+        (RFC 7162). Not possible for query folders (which share the base folder's
+        cache) or when limited to the last N days.
+        """
+
+        if self.query or self.get_sync_since_date():
+            return False
+
+        return b"QRESYNC" in self.account.get_capabilities()
+
+    def get_sync_since_date(self):
+        sync_days = get_system_setting("sync_days")
+        if sync_days and sync_days > 0:
+            return date.today() - timedelta(days=sync_days)
+
+    def get_folder_status(self):
+        # Use the account folder overview (all folder statuses in one go) if it's
+        # already loaded, otherwise a single STATUS for this folder
+        status = self.account.get_folder_status(self.name)
+        if status:
+            return status
+
         # Note we don't use self.get_connection because we don't want to actually
         # *select* the folder.
         with self.account.get_imap_connection() as connection:
-            status = connection.folder_status(self.name, [b"UIDVALIDITY"])
+            return connection.folder_status(self.name, self.account.get_folder_status_items())
+
+    def get_sync_state(self, status):
+        """
+        Get the state that identifies the folder contents as of a sync - any
+        message added changes UIDNEXT and any removed changes MESSAGES, unless a
+        message is also added. Synced UIDs also depend on the date when we're
+        limited to the last N days.
+        """
+
+        return (
+            status[b"MESSAGES"],
+            status[b"UIDNEXT"],
+            status[b"UIDVALIDITY"],
+            status.get(b"HIGHESTMODSEQ"),
+            self.get_sync_since_date(),
+        )
+
+    def check_cache_validity(self, status=None):
+        """
+        Checks if our cached UID validity matches the server.
+        """
+
+        if status is None:
+            status = self.get_folder_status()
 
         uid_validity = status[b"UIDVALIDITY"]
         cache_validity = self.cache.get_uid_validity()
@@ -382,36 +1056,103 @@ class Folder(object):
         if not self.exists and not self.check_exists():
             return [], [], []
 
-        message_uids = self.get_email_uids(use_cache=False)
+        # Get the status *before* any UIDs so no changes are missed between the two
+        status = self.get_folder_status()
+        sync_state = self.get_sync_state(status)
+
+        # Nothing added or removed since the last sync, skip selecting/searching
+        # the folder. Query folder results may depend on flags, so always search,
+        # as when the client expects new (just moved) UIDs that may need fixing.
+        if (
+            not self.query
+            and sync_state == self.sync_state
+            and expected_uid_count is None
+            and not self.copied_email_uids
+        ):
+            self.log("debug", "No changes since last sync")
+
+            read_uids = []
+            # Without HIGHESTMODSEQ we can't know if flags changed, so check them
+            if check_unread_uids and b"HIGHESTMODSEQ" not in status:
+                check_unread_uids = [uid for uid in check_unread_uids if uid in self.email_uids]
+                read_uids = self.check_update_unread_emails(check_unread_uids)
+
+            return [], [], read_uids
+
+        highest_mod_seq = None
+        if self.can_sync_changes():
+            highest_mod_seq = status.get(b"HIGHESTMODSEQ")
 
         # Check the folder UIDVALIDITY (busts the cache if needed)
-        uids_valid = self.check_cache_validity()
+        uids_valid = self.check_cache_validity(status)
+        if not uids_valid:
+            self.sorted_email_uids = None
+            self.threads = None
+
+        if uids_valid and highest_mod_seq:
+            mod_seq = self.cache.get_highest_mod_seq()
+            if mod_seq:
+                sync_result = self.sync_changed_emails(
+                    mod_seq,
+                    highest_mod_seq,
+                    expected_uid_count=expected_uid_count,
+                    check_unread_uids=check_unread_uids,
+                )
+                self.sync_state = sync_state
+                return sync_result
+
+        message_uids = None
+        new_message_uids = deleted_message_uids = None
+
+        if uids_valid:
+            # Moved in UIDs may not be in the status yet, so don't rely on it
+            if expected_uid_count is None:
+                message_uids = self.get_incremental_email_uids(status)
+
+            # With ESEARCH diff UID ranges rather than every UID in the folder
+            if message_uids is None and self.can_esearch():
+                new_message_uids, deleted_message_uids = self.search_changed_email_uids()
+                message_uids = (self.email_uids - deleted_message_uids) | new_message_uids
+                self.incremental_sync_count = 0
+
+        if message_uids is None:
+            message_uids = self.get_email_uids(use_cache=False)
+            self.incremental_sync_count = 0
+
         uids_changed = False
 
         if uids_valid:
-            # Remove existing from new to get anything new
-            new_message_uids = message_uids - self.email_uids
-            # Remove new from existing to get deleted
-            deleted_message_uids = self.email_uids - message_uids
+            if new_message_uids is None:
+                # Remove existing from new to get anything new
+                new_message_uids = message_uids - self.email_uids
+                # Remove new from existing to get deleted
+                deleted_message_uids = self.email_uids - message_uids
+
+            new_message_uids |= self.pop_copied_email_uids() & message_uids
 
             uids_changed = len(new_message_uids) > 0 or len(deleted_message_uids) > 0
         else:
             uids_changed = True
+            self.pop_copied_email_uids()
 
             # All old uids invalid, so set all old to deleted
             deleted_message_uids = self.email_uids
 
-            batch_size = get_system_setting("batch_size")
-            sorted_message_uids = sorted(message_uids, reverse=True)
-            new_message_uids = sorted_message_uids[:batch_size]
-
         self.email_uids = message_uids
 
+        # New UIDs are only the first batch of the (now) valid ones
+        if not uids_valid:
+            batch_size = get_system_setting("batch_size")
+            new_message_uids = self.get_sorted_email_uids()[:batch_size]
+
         if uids_changed:
-            self.cache_uids()
+            if uids_valid:
+                self.cache_uids(new_message_uids, deleted_message_uids)
+            else:
+                self.cache_uids()
 
-        for uid in deleted_message_uids:
-            self.cache.delete_headers(uid)
+        if deleted_message_uids:
+            self.cache.batch_delete_headers(deleted_message_uids)
 
         if expected_uid_count:
             new_message_uids = fix_missing_uids(
@@ -442,9 +1183,94 @@ class Folder(object):
             ]
             read_uids = self.check_update_unread_emails(check_unread_uids)
 
+        if highest_mod_seq:
+            self.cache.set_highest_mod_seq(highest_mod_seq)
+
+        self.sync_state = sync_state
+
         # Return the new emails & any deleted uids
         return new_emails, list(deleted_message_uids), read_uids
 
+    def sync_changed_emails(
+        self,
+        mod_seq,
+        highest_mod_seq,
+        expected_uid_count=None,
+        check_unread_uids=None,
+    ):
+        """
+        Get new, deleted & read emails changed since the last sync (at mod_seq)
+        using QRESYNC - without listing every UID in the folder.
+        """
+
+        if highest_mod_seq == mod_seq:
+            self.log("debug", f"No changes since last sync (modseq={mod_seq})")
+            return [], [], []
+
+        with self.get_connection() as connection:
+            # Remove any VANISHED responses left over from previous commands
+            connection.pop_untagged_responses("VANISHED")
+            changed_emails = connection.fetch(
+                "1:*",
+                ["FLAGS"],
+                modifiers=[f"CHANGEDSINCE {mod_seq}", "VANISHED"],
+            )
+            vanished_uids = parse_vanished_responses(
+                connection.pop_untagged_responses("VANISHED"),
+            )
+
+        changed_uids = set(changed_emails.keys()) - vanished_uids
+        new_message_uids = changed_uids - self.email_uids
+        deleted_message_uids = vanished_uids & self.email_uids
+        new_message_uids |= self.pop_copied_email_uids() - deleted_message_uids
+
+        self.email_uids = (self.email_uids - deleted_message_uids) | new_message_uids
+
+        if new_message_uids or deleted_message_uids:
+            self.cache_uids(new_message_uids, deleted_message_uids)
+
+        if deleted_message_uids:
+            self.cache.batch_delete_headers(deleted_message_uids)
+
+        # Update the cached flags for any existing emails that changed
+        uid_to_flags = {
+            uid: changed_emails[uid][b"FLAGS"] for uid in changed_uids - new_message_uids
+        }
+        self.cache.batch_set_flags(uid_to_flags)
+
+        if expected_uid_count:
+            new_message_uids = fix_missing_uids(
+                expected_uid_count,
+                new_message_uids,
+            )
+
+        self.log(
+            "debug",
+            (
+                f"Fetched {len(new_message_uids)} new/{len(deleted_message_uids)} deleted"
+                f"/{len(uid_to_flags)} changed message IDs (modseq={mod_seq})"
+            ),
+        )
+
+        new_emails = []
+
+        if new_message_uids:
+            new_emails = self.get_email_headers(new_message_uids)
+            new_emails = list(new_emails.values())
+            self.seen_email_uids.update(new_message_uids)
+
+        read_uids = []
+        if check_unread_uids:
+            read_uids = [
+                uid
+                for uid in check_unread_uids
+                if uid in uid_to_flags and SEEN_FLAG in uid_to_flags[uid]
+            ]
+
+        self.cache.set_highest_mod_seq(highest_mod_seq)
+
+        return new_emails, list(deleted_message_uids), read_uids
+
     @lock_class_method
     def get_emails(self, reset=False, batch_size=None):
         """
@@ -458,12 +1284,14 @@ class Folder(object):
         if reset:
             self.log("debug", "Resetting folder")
             self.seen_email_uids = set()
+            self.cancel_read_ahead()
 
         if not batch_size:
             batch_size = get_system_setting("batch_size")
 
-        unseen_email_uids = self.email_uids - self.seen_email_uids
-        sorted_unseen_email_uids = sorted(unseen_email_uids, reverse=True)
+        sorted_unseen_email_uids = [
+            uid for uid in self.get_sorted_email_uids() if uid not in self.seen_email_uids
+        ]
 
         # Select the slice of UIDs
         email_uids = sorted_unseen_email_uids[:batch_size]
@@ -476,7 +1304,11 @@ class Folder(object):
         emails = self.get_email_headers(email_uids)
         self.seen_email_uids.update(email_uids)
 
-        return list(emails.values())
+        # Fetch the next batch in the background, so it's cached when requested
+        self.read_ahead_email_headers(sorted_unseen_email_uids[batch_size : batch_size * 2])
+
+        # Return in our sorted order
+        return [emails[uid] for uid in email_uids if uid in emails]
 
     # Functions that affect emails, but not any of the class internals
     #
@@ -485,6 +1317,8 @@ class Folder(object):
         with self.account.get_imap_connection() as connection:
             connection.append(self.name, email_message.as_string(), flags=(SEEN_FLAG,))
 
+        self.account.invalidate_folder_status(self.name)
+
     def delete_emails(self, email_uids):
         """
         Delete emails (by UID) from this folder.
@@ -499,40 +1333,126 @@ class Folder(object):
             connection.delete_messages(email_uids)
             connection.expunge(email_uids)
 
+        self.account.invalidate_folder_status(self.name)
+
     def move_emails(self, email_uids, new_folder):
         """
-        Move (copy + delete) emails (by UID) from this folder to another.
+        Move emails (by UID) from this folder to another, using MOVE if supported
+        and otherwise copy + delete.
 
         Note this method does not update the internal UID list, this is to be
         handled by the `sync_emails` method.
         """
 
-        new_folder = self.account.ensure_folder_exists(new_folder)
+        new_folder_name = self.account.ensure_folder_exists(new_folder)
 
         self.log(
             "debug",
-            f"Moving {len(email_uids)} ({email_uids}) emails to -> {new_folder}",
+            f"Moving {len(email_uids)} ({email_uids}) emails to -> {new_folder_name}",
         )
 
         with self.get_connection() as connection:
-            connection.copy(email_uids, new_folder)
-            connection.delete_messages(email_uids)
-            connection.expunge(email_uids)
+            connection.pop_untagged_responses("COPYUID")
+
+            # MOVE (RFC 6851) is atomic & a single command
+            if b"MOVE" in self.account.get_capabilities():
+                response = connection.move(email_uids, new_folder_name)
+            else:
+                response = connection.copy(email_uids, new_folder_name)
+                connection.delete_messages(email_uids)
+                connection.expunge(email_uids)
+
+            copyuid_responses = connection.pop_untagged_responses("COPYUID")
+
+        self.account.invalidate_folder_status(self.name)
+        self.account.invalidate_folder_status(new_folder_name)
+
+        self.copy_cached_emails(new_folder, new_folder_name, copyuid_responses, response)
 
     def copy_emails(self, email_uids, new_folder):
         """
         Copy emails (by UID) from this folder to another.
         """
 
-        new_folder = self.account.ensure_folder_exists(new_folder)
+        new_folder_name = self.account.ensure_folder_exists(new_folder)
 
         self.log(
             "debug",
-            f"Copying {len(email_uids)} ({email_uids}) emails to -> {new_folder}",
+            f"Copying {len(email_uids)} ({email_uids}) emails to -> {new_folder_name}",
         )
 
         with self.get_connection() as connection:
-            connection.copy(email_uids, new_folder)
+            connection.pop_untagged_responses("COPYUID")
+            response = connection.copy(email_uids, new_folder_name)
+            copyuid_responses = connection.pop_untagged_responses("COPYUID")
+
+        self.account.invalidate_folder_status(new_folder_name)
+
+        self.copy_cached_emails(new_folder, new_folder_name, copyuid_responses, response)
+
+    def copy_cached_emails(self, new_folder, new_folder_name, copyuid_responses, response):
+        """
+        Copy cached headers/parts of emails copied/moved to another folder, so they
+        needn't be fetched again there. The new UIDs come from the UIDPLUS (RFC
+        4315) COPYUID response code - sent untagged by MOVE, in the tagged response
+        to COPY (imaplib collects either with the untagged responses).
+
+        If the other folder is loaded its UIDs are updated too, otherwise only its
+        cache is written to.
+        """
+
+        # Untagged response data is just the code arguments, without the name
+        copyuid_responses = [
+            b"COPYUID " + to_bytes(copyuid_response) for copyuid_response in copyuid_responses
+        ]
+        if isinstance(response, (bytes, str)):
+            copyuid_responses.append(to_bytes(response))
+
+        uid_validity, uid_map = None, {}
+        for copyuid_response in copyuid_responses:
+            uid_validity, uid_map = parse_copyuid_response(copyuid_response)
+            if uid_map:
+                break
+
+        if not uid_map:
+            return
+
+        folder = self.account.folders.get(new_folder_name)
+        if folder:
+            cache = folder.cache
+        else:
+            cache = FolderCache(UnloadedFolder(self.account, new_folder_name, new_folder))
+
+        # Only trust the new UIDs if they're for the UIDVALIDITY we've cached
+        cache_uid_validity = cache.get_uid_validity()
+        if str(uid_validity) != str(cache_uid_validity):
+            self.log(
+                "debug",
+                (
+                    f"Not copying cached emails to {new_folder_name}, UIDVALIDITY "
+                    f"mismatch ({uid_validity} != {cache_uid_validity})"
+                ),
+            )
+            return
+
+        self.cache.copy_to(cache, uid_map)
+
+        if folder:
+            folder.add_copied_email_uids(uid_map.values())
+
+    def add_copied_email_uids(self, email_uids):
+        """
+        Add the UIDs of emails copied/moved here (see `copy_cached_emails`), these
+        are still returned as new by the next sync so clients pick them up.
+        """
+
+        self.email_uids = self.email_uids | set(email_uids)
+        self.copied_email_uids.update(email_uids)
+
+    def pop_copied_email_uids(self):
+        copied_email_uids = self.copied_email_uids
+        self.copied_email_uids = set()
+        return copied_email_uids
 
     def star_emails(self, email_uids):
         """
@@ -544,8 +1464,7 @@ class Folder(object):
         with self.get_connection() as connection:
             connection.add_flags(email_uids, [b"\\Flagged"])
 
-        for uid in email_uids:
-            self.add_cache_flags(uid, b"\\Flagged")
+        self.cache.batch_add_flags(email_uids, b"\\Flagged")
 
     def unstar_emails(self, email_uids):
         """
@@ -557,5 +1476,4 @@ class Folder(object):
         with self.get_connection() as connection:
             connection.remove_flags(email_uids, [b"\\Flagged"])
 
-        for uid in email_uids:
-            self.remove_cache_flags(uid, b"\\Flagged")
+        self.cache.batch_remove_flags(email_uids, b"\\Flagged")
@@ -1,13 +1,84 @@
+import re
+from collections import defaultdict
 from functools import wraps
-from pickle import dumps as pickle_dumps, loads as pickle_loads
+from hashlib import sha256
+from os import listdir, makedirs, path, remove, rename
+from threading import Lock
+from time import sleep, time
 
+from sqlalchemy import and_, exists, func, or_
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 
 from kanmail.log import logger
 from kanmail.server.app import db
 from kanmail.server.util import lock_class_method
 from kanmail.settings import get_settings
-from kanmail.settings.constants import CACHE_ENABLED
+from kanmail.settings.constants import (
+    CACHE_COMPRESSION,
+    CACHE_ENABLED,
+    PART_CACHE_DIR,
+    PART_CACHE_SIZE,
+)
+
+from .cache_compression import (
+    VALUE_HEADER,
+    ZLIB,
+    CompressionDictionary,
+    CompressionError,
+    compress_value,
+    decompress_value,
+    train_dictionary,
+)
+from .cache_writer import FOLDER_CACHE_WRITER
+from .memory_cache import HEADER_MEMORY_CACHE
+from .uid_ranges import add_uid_ranges, expand_uid_ranges, make_uid_ranges, remove_uid_ranges
+from .util import add_part_shortcuts, decode_string
+
+# Bump this whenever the folder cache schema changes - the cache only contains
+# data we can re-fetch from the server, so old versions are simply dropped.
+FOLDER_CACHE_VERSION = 9
+
+# Max number of values bound into a single IN (...) statement, SQLite builds before
+# 3.32 only allow 999 variables per statement.
+SQL_CHUNK_SIZE = 500
+
+# Parts larger than this are stored as files rather than in the DB
+PART_CACHE_MAX_INLINE_SIZE = 64 * 1024
+# Part files are named by their content hash, within a directory named by the
+# first two characters, (temporary files while writing end .tmp).
+PART_FILENAME_REGEX = re.compile(r"^[0-9a-f]{64}(\.tmp)?$")
+
+# Compression dictionaries are (re)trained from this many stored header values
+MIN_DICTIONARY_SAMPLES = 200
+MAX_DICTIONARY_SAMPLES = 5000
+# Retrain the compression dictionary when older than this (seconds)
+DICTIONARY_MAX_AGE = 30 * 24 * 60 * 60
+
+# Cleanup work is done in chunks (of row IDs / free pages) via the cache writer,
+# pausing between each so interactive writes are never stuck behind cleanup.
+CLEANUP_TIME_BUDGET = 30  # seconds per cleanup function
+CLEANUP_CHUNK_SIZE = 5000
+CLEANUP_CHUNK_PAUSE = 0.1
+VACUUM_PAGES_PER_CHUNK = 1000
+
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+
+# Incremented whenever all cache items are busted, so FolderCache instances know to
+# drop their memoized folder rows.
+CACHE_GENERATION = 0
+# Map of folder ID -> number of times the folder has been invalidated after a write
+# to it was dropped, so FolderCache instances know to drop their UID ranges.
+FOLDER_INVALIDATIONS = defaultdict(int)
+
+ADDRESS_FIELDS = ("from", "to", "send", "cc", "bcc", "reply_to")
+SEEN_FLAG = "\\Seen"
+
+
+def _chunk_list(items, size=SQL_CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
 
 
 def execute_if_enabled(func):
@@ -20,13 +91,15 @@ def execute_if_enabled(func):
 
 
 # Database models
-# Folder -> Folderheader -> FolderHeaderPart
+# Folder -> FolderUidRange
+# Folder -> FolderHeader -> FolderHeaderAddress/FolderHeaderStruct
+# Folder -> FolderHeaderPart
 #
 
 
 class FolderCacheItem(db.Model):
     """
-    Store folder UID list and validity.
+    Store folder UID validity (UID list is stored as FolderUidRangeCacheItem's).
     """
 
     __bind_key__ = "folders"
@@ -39,15 +112,40 @@ class FolderCacheItem(db.Model):
     folder_name = db.Column(db.String(300), nullable=False)
 
     uid_validity = db.Column(db.String(300))
-    uids = db.Column(db.Text)
+    # CONDSTORE/QRESYNC (RFC 7162) HIGHESTMODSEQ as of the last sync
+    highest_mod_seq = db.Column(db.BigInteger)
 
     def __str__(self):
         return f"{self.account_name}/{self.folder_name}"
 
 
+class FolderUidRangeCacheItem(db.Model):
+    """
+    A range of UIDs (start -> end, inclusive) in a folder. Ranges are always kept
+    merged, so contiguous UIDs take one row & changes only touch affected rows.
+    """
+
+    __bind_key__ = "folders"
+    __tablename__ = "folder_uid_range_cache_item"
+    __table_args__ = (db.UniqueConstraint("folder_id", "start_uid"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    start_uid = db.Column(db.Integer, nullable=False)
+    end_uid = db.Column(db.Integer, nullable=False)
+
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey("folder_cache_item.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+
 class FolderHeaderCacheItem(db.Model):
     """
-    Email header data, attached to the relevant folder.
+    Email header data, attached to the relevant folder. Fields are stored as
+    columns, addresses & parts in side tables. Only columns that are actually
+    queried are indexed, every index is paid for on each header write.
     """
 
     __bind_key__ = "folders"
@@ -56,8 +154,27 @@ class FolderHeaderCacheItem(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
 
-    uid = db.Column(db.Integer, nullable=False, index=True)
-    data = db.Column(db.Text, nullable=False)
+    uid = db.Column(db.Integer, nullable=False)
+    seq = db.Column(db.Integer)
+
+    # Flags are stored space separated *and* wrapped (" \Seen \Flagged ") so
+    # individual flags can be matched in SQL without false positives.
+    flags = db.Column(db.Text, nullable=False, default=" ")
+    size = db.Column(db.Integer)
+
+    date = db.Column(db.String(50))
+    subject = db.Column(db.Text)
+    from_email = db.Column(db.String(300))
+
+    message_id = db.Column(db.Text)
+    in_reply_to = db.Column(db.Text)
+    # Compressed, see cache_compression.py
+    references = db.Column(db.LargeBinary)
+    excerpt = db.Column(db.LargeBinary)
+    content_encoding = db.Column(db.String(50))
+
+    # Gmail message ID, used to share headers/parts between folders (labels)
+    gm_msgid = db.Column(db.BigInteger, index=True)
 
     folder_id = db.Column(
         db.Integer,
@@ -66,31 +183,355 @@ class FolderHeaderCacheItem(db.Model):
     )
     folder = db.relationship("FolderCacheItem")
 
+    addresses = db.relationship(
+        "FolderHeaderAddressCacheItem",
+        order_by="FolderHeaderAddressCacheItem.position",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    structs = db.relationship(
+        "FolderHeaderStructCacheItem",
+        order_by="FolderHeaderStructCacheItem.position",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
     def __str__(self):
         return f"{self.folder}/{self.uid}"
 
 
-# class FolderHeaderPartCacheItem(db.Model):
-#     '''
-#     Email part (data) cache items, attached to the relevant email header.
-#     '''
+class FolderHeaderAddressCacheItem(db.Model):
+    """
+    Email header address (from/to/cc/etc), attached to the relevant header.
+    """
+
+    __bind_key__ = "folders"
+    __tablename__ = "folder_header_address_cache_item"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    field = db.Column(db.String(10), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+
+    name = db.Column(db.Text)
+    email = db.Column(db.Text, nullable=False)
+
+    header_id = db.Column(
+        db.Integer,
+        db.ForeignKey("folder_header_cache_item.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+
+class FolderHeaderStructCacheItem(db.Model):
+    """
+    Email part meta (from BODYSTRUCTURE), attached to the relevant header.
+    """
+
+    __bind_key__ = "folders"
+    __tablename__ = "folder_header_struct_cache_item"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    position = db.Column(db.Integer, nullable=False)
+
+    # Single part emails are numbered 1 (int), multipart ones "1", "1.2" (str)
+    part_number = db.Column(db.String(50), nullable=False)
+    part_number_is_int = db.Column(db.Boolean, nullable=False, default=False)
+
+    type = db.Column(db.String(100))
+    subtype = db.Column(db.String(100))
+    encoding = db.Column(db.String(100))
+    charset = db.Column(db.String(100))
+    name = db.Column(db.Text)
+    content_id = db.Column(db.Text)
+    size = db.Column(db.Integer)
+
+    header_id = db.Column(
+        db.Integer,
+        db.ForeignKey("folder_header_cache_item.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+
+class FolderHeaderPartCacheItem(db.Model):
+    """
+    Email part (body) data, attached to the relevant folder & UID. Small parts are
+    stored inline, larger ones as content addressed files in the part cache dir.
+    """
+
+    __bind_key__ = "folders"
+    __tablename__ = "folder_header_part_cache_item"
+    __table_args__ = (db.UniqueConstraint("folder_id", "uid", "part_number"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    uid = db.Column(db.Integer, nullable=False)
+    part_number = db.Column(db.String(50), nullable=False)
+
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    accessed_at = db.Column(db.Float, nullable=False, index=True)
+
+    # Only set for parts stored inline (ie <= PART_CACHE_MAX_INLINE_SIZE)
+    data = db.Column(db.LargeBinary)
+
+    folder_id = db.Column(
+        db.Integer,
+        db.ForeignKey("folder_cache_item.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+
+class FolderCacheDictionaryItem(db.Model):
+    """
+    Trained compression dictionaries, referenced (by ID) from compressed values.
+    """
+
+    __bind_key__ = "folders"
+    __tablename__ = "folder_cache_dictionary_item"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    codec = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+
+
+# Map of dictionary ID -> CompressionDictionary (or None if unusable), dictionaries
+# are never changed once saved so can be kept for the lifetime of the process.
+COMPRESSION_DICTIONARIES = {}
+COMPRESSION_DICTIONARIES_LOCK = Lock()
+CURRENT_COMPRESSION_DICTIONARY = None
+CURRENT_COMPRESSION_DICTIONARY_LOADED = False
+
+
+def _get_compression_dictionary(dictionary_id):
+    with COMPRESSION_DICTIONARIES_LOCK:
+        if dictionary_id not in COMPRESSION_DICTIONARIES:
+            dictionary = None
+            dictionary_item = FolderCacheDictionaryItem.query.get(dictionary_id)
+
+            if dictionary_item:
+                try:
+                    dictionary = CompressionDictionary(
+                        dictionary_item.id,
+                        dictionary_item.codec,
+                        dictionary_item.data,
+                    )
+                except CompressionError as e:
+                    logger.warning(f"Unusable compression dictionary {dictionary_id}: {e}")
+
+            COMPRESSION_DICTIONARIES[dictionary_id] = dictionary
+
+        return COMPRESSION_DICTIONARIES[dictionary_id]
+
 
-#     __bind_key__ = 'folders'
-#     __tablename__ = 'folder_header_part_cache_item'
-#     __table_args__ = (
-#         db.UniqueConstraint('part_number', 'header_uid'),
-#     )
+def _get_current_compression_dictionary():
+    global CURRENT_COMPRESSION_DICTIONARY, CURRENT_COMPRESSION_DICTIONARY_LOADED
 
-#     id = db.Column(db.Integer, primary_key=True)
+    if not CURRENT_COMPRESSION_DICTIONARY_LOADED:
+        dictionary_item = (
+            FolderCacheDictionaryItem.query.filter_by(codec=ZLIB)
+            .order_by(FolderCacheDictionaryItem.id.desc())
+            .first()
+        )
+        if dictionary_item:
+            CURRENT_COMPRESSION_DICTIONARY = _get_compression_dictionary(dictionary_item.id)
+        CURRENT_COMPRESSION_DICTIONARY_LOADED = True
 
-#     part_number = db.Column(db.Integer, nullable=False)
-#     data = db.Column(db.Text, nullable=False)
+    return CURRENT_COMPRESSION_DICTIONARY
 
-#     header_id = db.Column(
-#         db.Integer,
-#         db.ForeignKey('folder_header_cache_item.id', ondelete='CASCADE'),
-#         nullable=False,
-#     )
+
+def _compress_value(value):
+    if not CACHE_COMPRESSION:
+        return compress_value(value, compress=False)
+    return compress_value(value, _get_current_compression_dictionary())
+
+
+def _decompress_value(value):
+    try:
+        return decompress_value(value, _get_compression_dictionary)
+    except CompressionError as e:
+        logger.warning(f"Could not decompress cached value: {e}")
+
+
+def _make_flags_column(flags):
+    flags = [decode_string(flag) if isinstance(flag, bytes) else flag for flag in flags]
+    if not flags:
+        return " "
+    return f" {' '.join(flags)} "
+
+
+def _make_flags_tuple(flags_column):
+    return tuple(flag.encode() for flag in flags_column.split())
+
+
+def _make_flag_match(flag):
+    if isinstance(flag, bytes):
+        flag = decode_string(flag)
+    return f" {flag} "
+
+
+def _update_header_cache_item(header_item, headers):
+    """
+    Write a headers dict (as made by `make_email_headers`) into a header cache
+    item and it's address/struct side items.
+    """
+
+    message_id = headers["message_id"]
+    if isinstance(message_id, bytes):
+        message_id = decode_string(message_id)
+
+    in_reply_to = headers["in_reply_to"]
+    if isinstance(in_reply_to, bytes):
+        in_reply_to = decode_string(in_reply_to)
+
+    references = headers["references"]
+    if references is not None:
+        references = " ".join(references)
+
+    from_email = None
+    if headers["from"]:
+        from_email = headers["from"][0][1]
+
+    header_item.seq = headers["seq"]
+    header_item.flags = _make_flags_column(headers["flags"])
+    header_item.size = headers["size"]
+    header_item.date = headers["date"]
+    header_item.subject = headers["subject"]
+    header_item.from_email = from_email
+    header_item.message_id = message_id
+    header_item.in_reply_to = in_reply_to
+    header_item.references = _compress_value(references)
+    header_item.excerpt = _compress_value(headers["excerpt"])
+    header_item.content_encoding = headers["content_encoding"]
+    header_item.gm_msgid = headers.get("gm_msgid")
+
+    header_item.addresses = [
+        FolderHeaderAddressCacheItem(
+            field=field,
+            position=position,
+            name=name,
+            email=email,
+        )
+        for field in ADDRESS_FIELDS
+        for position, (name, email) in enumerate(headers[field])
+    ]
+
+    header_item.structs = [
+        FolderHeaderStructCacheItem(
+            position=position,
+            part_number=f"{part_number}",
+            part_number_is_int=isinstance(part_number, int),
+            type=part["type"],
+            subtype=part["subtype"],
+            encoding=part["encoding"],
+            charset=part.get("charset"),
+            name=part.get("name"),
+            content_id=part["content_id"],
+            size=part["size"],
+        )
+        for position, (part_number, part) in enumerate(headers["parts"].items())
+        if isinstance(part, dict)
+    ]
+
+    return header_item
+
+
+def _make_headers(header_item, folder):
+    """
+    Rebuild a headers dict (as made by `make_email_headers`) from a header cache
+    item, the inverse of `_update_header_cache_item`.
+    """
+
+    addresses = {field: [] for field in ADDRESS_FIELDS}
+    for address in header_item.addresses:
+        addresses[address.field].append((address.name, address.email))
+
+    parts = {}
+    for struct in header_item.structs:
+        part = {
+            "type": struct.type,
+            "subtype": struct.subtype,
+            "encoding": struct.encoding,
+            "content_id": struct.content_id,
+            "size": struct.size,
+        }
+        if struct.charset is not None:
+            part["charset"] = struct.charset
+        if struct.name is not None:
+            part["name"] = struct.name
+
+        part_number = struct.part_number
+        if struct.part_number_is_int:
+            part_number = int(part_number)
+        parts[part_number] = part
+
+    references = _decompress_value(header_item.references)
+    if references is not None:
+        references = references.split()
+
+    return {
+        "uid": header_item.uid,
+        "seq": header_item.seq,
+        "flags": _make_flags_tuple(header_item.flags),
+        "size": header_item.size,
+        "excerpt": _decompress_value(header_item.excerpt),
+        "content_encoding": header_item.content_encoding,
+        "parts": add_part_shortcuts(parts),
+        # Internal meta
+        "account_name": folder.account.name,
+        "server_folder_name": folder.name,
+        "folder_name": folder.alias_name,
+        # Envelope data
+        "date": header_item.date,
+        "subject": header_item.subject,
+        # Address data
+        **addresses,
+        # Threading
+        "in_reply_to": header_item.in_reply_to,
+        "message_id": header_item.message_id,
+        "references": references,
+        "gm_msgid": header_item.gm_msgid,
+    }
+
+
+def _read_parts(get_parts, keys, get_key, get_part=lambda part: part):
+    """
+    Read cached part data for the results of `get_parts` (called with chunks of
+    keys), as a dict of `get_key(result)` -> data. Parts read are touched & any
+    with missing files removed.
+    """
+
+    key_to_data = {}
+    part_ids = []
+    missing_part_ids = []
+
+    for keys_chunk in _chunk_list(keys):
+        for result in get_parts(keys_chunk):
+            part = get_part(result)
+
+            data = part.data
+            if data is None:
+                try:
+                    with open(_get_part_filename(part.content_hash), "rb") as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    missing_part_ids.append(part.id)
+                    continue
+
+            key_to_data[get_key(result)] = data
+            part_ids.append(part.id)
+
+    if part_ids:
+        FOLDER_CACHE_WRITER.write(_touch_parts, part_ids, time())
+    if missing_part_ids:
+        FOLDER_CACHE_WRITER.write(_delete_parts, missing_part_ids)
+
+    return key_to_data
 
 
 def _make_account_key(settings):
@@ -98,59 +539,234 @@ def _make_account_key(settings):
     return f'{imap_settings["username"]}@{imap_settings["host"]}'
 
 
+def _run_cleanup_chunks(name, func, chunk_args, time_budget=CLEANUP_TIME_BUDGET):
+    """
+    Run a cleanup write function via the cache writer for each chunk of args,
+    stopping early once the time budget (if any) is used up.
+    """
+
+    start = time()
+    results = []
+
+    for i, args in enumerate(chunk_args):
+        if time_budget is not None and time() - start > time_budget:
+            logger.info(f"Stopping {name} after {i} chunks, out of time")
+            break
+
+        FOLDER_CACHE_WRITER.write(lambda *args: results.append(func(*args)), *args)
+        FOLDER_CACHE_WRITER.flush()
+        sleep(CLEANUP_CHUNK_PAUSE)
+
+    return results
+
+
+def _iter_id_chunks(model):
+    max_id = model.query.with_entities(func.max(model.id)).scalar() or 0
+    for min_id in range(0, max_id, CLEANUP_CHUNK_SIZE):
+        yield min_id, min_id + CLEANUP_CHUNK_SIZE
+
+
 def remove_stale_folders():
     settings = get_settings()
-    accounts = settings["accounts"]
-    account_names = set()
-    for account in accounts:
-        account_names.add(_make_account_key(account))
-
-    deleted = 0
-    all_folders = FolderCacheItem.query.all()
+    account_names = {_make_account_key(account) for account in settings["accounts"]}
 
-    for folder in all_folders:
-        if folder.account_name not in account_names:
-            logger.info(f"Deleting stale cache folder: {folder}")
-            delete_cache_items(folder)
-            deleted += 1
+    # Everything attached to the folders is removed by the foreign key cascades
+    deleted = FolderCacheItem.query.filter(
+        FolderCacheItem.account_name.notin_(account_names),
+    ).delete(synchronize_session=False)
+    db.session.commit()
 
-    logger.info(f"Deleted {deleted}/{len(all_folders)} cache folders")
+    logger.info(f"Deleted {deleted} stale cache folders")
 
 
-def remove_stale_headers():
-    folder_id_to_uids = {}
+def _delete_stale_items(model, min_id, max_id):
+    uid_in_range = exists().where(
+        and_(
+            FolderUidRangeCacheItem.folder_id == model.folder_id,
+            FolderUidRangeCacheItem.start_uid <= model.uid,
+            FolderUidRangeCacheItem.end_uid >= model.uid,
+        ),
+    )
 
-    for folder in FolderCacheItem.query.all():
-        if folder.uids:
-            folder_id_to_uids[folder.id] = pickle_loads(folder.uids)
+    return model.query.filter(
+        model.id > min_id,
+        model.id <= max_id,
+        ~uid_in_range,
+    ).delete(synchronize_session=False)
 
-    all_headers = FolderHeaderCacheItem.query.all()
-    headers_to_delete = []
 
-    for header in all_headers:
-        if header.uid not in folder_id_to_uids.get(header.folder_id, set()):
-            logger.info(f"Deleting stale cache header: {header}")
-            headers_to_delete.append(header)
+def remove_stale_headers(time_budget=CLEANUP_TIME_BUDGET):
+    """
+    Remove header & part items for UIDs no longer in their folder's UID ranges.
+    """
 
-    if headers_to_delete:
-        delete_cache_items(*headers_to_delete)
+    for model in (FolderHeaderCacheItem, FolderHeaderPartCacheItem):
+        deleted = _run_cleanup_chunks(
+            f"{model.__tablename__} cleanup",
+            _delete_stale_items,
+            ((model, min_id, max_id) for min_id, max_id in _iter_id_chunks(model)),
+            time_budget=time_budget,
+        )
+        logger.info(f"Deleted {sum(deleted)} stale {model.__tablename__} rows")
 
-    logger.info(f"Deleted {len(headers_to_delete)}/{len(all_headers)} cache headers")
 
+def check_folder_cache_version():
+    """
+    Drop all of the folder cache tables if they were created by a different
+    version of the cache schema (the tables are then re-created on boot).
+    """
 
-def vacuum_folder_cache():
     with db.get_engine(bind="folders").begin() as conn:
-        conn.execute("VACUUM")
+        version = conn.execute("PRAGMA user_version").scalar()
+        if version == FOLDER_CACHE_VERSION:
+            return
+
+        logger.warning(
+            f"Dropping folder cache (version={version}, wanted={FOLDER_CACHE_VERSION})",
+        )
+
+        metadata = db.MetaData()
+        metadata.reflect(bind=conn)
+        metadata.drop_all(bind=conn)
+
+        conn.execute(f"PRAGMA user_version = {FOLDER_CACHE_VERSION}")
+
+
+def train_compression_dictionary():
+    """
+    Train a new compression dictionary from the stored header values (if the
+    current one is missing or old) and recompress all values with it.
+    """
+
+    global CURRENT_COMPRESSION_DICTIONARY
+
+    if not CACHE_COMPRESSION:
+        return
+
+    current_dictionary = _get_current_compression_dictionary()
+    if current_dictionary:
+        dictionary_item = FolderCacheDictionaryItem.query.get(current_dictionary.id)
+        if dictionary_item.created_at > time() - DICTIONARY_MAX_AGE:
+            return
+
+    samples = []
+    for excerpt, references in (
+        FolderHeaderCacheItem.query.with_entities(
+            FolderHeaderCacheItem.excerpt,
+            FolderHeaderCacheItem.references,
+        )
+        .order_by(func.random())
+        .limit(MAX_DICTIONARY_SAMPLES)
+    ):
+        for value in (excerpt, references):
+            value = _decompress_value(value)
+            if value:
+                samples.append(value.encode("utf-8", "surrogateescape"))
+
+    if len(samples) < MIN_DICTIONARY_SAMPLES:
+        logger.info(f"Not training compression dictionary, only {len(samples)} samples")
+        return
+
+    dictionary_data = train_dictionary(samples)
+    if not dictionary_data:
+        logger.info("Not saving compression dictionary, nothing repeated in samples")
+        return
+
+    dictionary_item = FolderCacheDictionaryItem(
+        codec=ZLIB,
+        data=dictionary_data,
+        created_at=time(),
+    )
+    save_cache_items(dictionary_item)
+
+    CURRENT_COMPRESSION_DICTIONARY = _get_compression_dictionary(dictionary_item.id)
+    logger.info(
+        f"Trained compression dictionary {dictionary_item.id} "
+        f"({len(dictionary_item.data)} bytes from {len(samples)} samples)",
+    )
+
+    # Recompress everything with the new dictionary (any new writes will use it
+    # already), then remove the old dictionaries once nothing references them.
+    header_ids = [
+        header_id
+        for header_id, in FolderHeaderCacheItem.query.with_entities(
+            FolderHeaderCacheItem.id,
+        )
+    ]
+    for header_ids_chunk in _chunk_list(header_ids):
+        FOLDER_CACHE_WRITER.write(_recompress_headers, header_ids_chunk)
+
+    FOLDER_CACHE_WRITER.write(_delete_unused_compression_dictionaries, dictionary_item.id)
+    FOLDER_CACHE_WRITER.flush()
+
+    logger.info(f"Recompressed {len(header_ids)} cache headers")
+
+
+def remove_orphaned_part_files():
+    # Run via the writer so we never remove files for parts being written
+    FOLDER_CACHE_WRITER.write(_remove_orphaned_part_files)
+    FOLDER_CACHE_WRITER.flush()
+
+
+def _execute_folders_statement(statement):
+    return db.session.execute(statement, bind=db.get_engine(bind="folders"))
+
 
-    logger.info("Folder cache DB vacuumed")
+def _get_folders_pragma(pragma):
+    return _execute_folders_statement(f"PRAGMA {pragma}").scalar()
+
+
+def _enable_incremental_vacuum():
+    _execute_folders_statement("PRAGMA auto_vacuum=INCREMENTAL")
+    _execute_folders_statement("VACUUM")
+
+
+def _incremental_vacuum(pages):
+    # Each (empty) result row is one freed page, so the statement must be stepped
+    # through - which SQLAlchemy won't do for a row-less result, use the raw cursor.
+    connection = db.session.connection(bind=db.get_engine(bind="folders"))
+    cursor = connection.connection.cursor()
+    cursor.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+    cursor.close()
+
+
+def vacuum_folder_cache(time_budget=CLEANUP_TIME_BUDGET):
+    """
+    Release free pages from the folder cache DB, in small incremental steps.
+    """
+
+    if _get_folders_pragma("auto_vacuum") != SQLITE_AUTO_VACUUM_INCREMENTAL:
+        # Databases created before auto_vacuum=INCREMENTAL need a one off full
+        # vacuum to switch over.
+        logger.info("Switching folder cache DB to incremental vacuum")
+        FOLDER_CACHE_WRITER.write(_enable_incremental_vacuum)
+        FOLDER_CACHE_WRITER.flush()
+        return
+
+    free_pages = _get_folders_pragma("freelist_count")
+
+    _run_cleanup_chunks(
+        "folder cache vacuum",
+        _incremental_vacuum,
+        ((VACUUM_PAGES_PER_CHUNK,) for _ in range(0, free_pages, VACUUM_PAGES_PER_CHUNK)),
+        time_budget=time_budget,
+    )
+
+    logger.info(f"Folder cache DB vacuumed ({free_pages} free pages)")
 
 
 @execute_if_enabled
 def bust_all_caches():
+    global CACHE_GENERATION
+
     logger.warning("Busting all cache items!")
+    FOLDER_CACHE_WRITER.flush()
     FolderCacheItem.query.delete()
     db.session.commit()
 
+    HEADER_MEMORY_CACHE.clear()
+    CACHE_GENERATION += 1
+
 
 def save_cache_items(*items):
     for item in items:
@@ -164,6 +780,395 @@ def delete_cache_items(*items):
     db.session.commit()
 
 
+# Write functions, executed by the cache writer thread
+#
+
+
+def _invalidate_folder(folder_id):
+    """
+    Called when a write to a folder is dropped, after which the cached rows may
+    not match the saved UID ranges - so remove both, the folder is then refetched.
+    """
+
+    logger.warning(f"Invalidating folder cache {folder_id} after a dropped write")
+
+    for model in (FolderUidRangeCacheItem, FolderHeaderCacheItem):
+        model.query.filter_by(folder_id=folder_id).delete(synchronize_session=False)
+
+    FOLDER_INVALIDATIONS[folder_id] += 1
+
+
+FOLDER_CACHE_WRITER.on_dropped_folder_write = _invalidate_folder
+
+
+def _write_headers(folder_id, uid_to_headers):
+    for uids_chunk in _chunk_list(uid_to_headers.keys()):
+        existing_headers = {
+            header.uid: header
+            for header in FolderHeaderCacheItem.query.filter(
+                FolderHeaderCacheItem.folder_id == folder_id,
+                FolderHeaderCacheItem.uid.in_(uids_chunk),
+            ).options(
+                selectinload(FolderHeaderCacheItem.addresses),
+                selectinload(FolderHeaderCacheItem.structs),
+            )
+        }
+
+        for uid in uids_chunk:
+            header_item = existing_headers.get(uid)
+            if not header_item:
+                header_item = FolderHeaderCacheItem(folder_id=folder_id, uid=uid)
+
+            db.session.add(_update_header_cache_item(header_item, uid_to_headers[uid]))
+
+
+def _delete_headers(folder_id, uids):
+    # Address/struct items are removed by the foreign key cascades
+    for uids_chunk in _chunk_list(uids):
+        FolderHeaderCacheItem.query.filter(
+            FolderHeaderCacheItem.folder_id == folder_id,
+            FolderHeaderCacheItem.uid.in_(uids_chunk),
+        ).delete(synchronize_session=False)
+
+        FolderHeaderPartCacheItem.query.filter(
+            FolderHeaderPartCacheItem.folder_id == folder_id,
+            FolderHeaderPartCacheItem.uid.in_(uids_chunk),
+        ).delete(synchronize_session=False)
+
+
+def _set_highest_mod_seq(folder_id, highest_mod_seq):
+    FolderCacheItem.query.filter_by(id=folder_id).update(
+        {FolderCacheItem.highest_mod_seq: highest_mod_seq},
+        synchronize_session=False,
+    )
+
+
+def _set_flags(folder_id, uid_to_flags):
+    flags_to_uids = defaultdict(list)
+    for uid, flags in uid_to_flags.items():
+        flags_to_uids[_make_flags_column(flags)].append(uid)
+
+    for flags, uids in flags_to_uids.items():
+        for uids_chunk in _chunk_list(uids):
+            FolderHeaderCacheItem.query.filter(
+                FolderHeaderCacheItem.folder_id == folder_id,
+                FolderHeaderCacheItem.uid.in_(uids_chunk),
+            ).update({FolderHeaderCacheItem.flags: flags}, synchronize_session=False)
+
+
+def _add_flag(folder_id, uids, flag):
+    flag_match = _make_flag_match(flag)
+
+    for uids_chunk in _chunk_list(uids):
+        FolderHeaderCacheItem.query.filter(
+            FolderHeaderCacheItem.folder_id == folder_id,
+            FolderHeaderCacheItem.uid.in_(uids_chunk),
+            func.instr(FolderHeaderCacheItem.flags, flag_match) == 0,
+        ).update(
+            {FolderHeaderCacheItem.flags: FolderHeaderCacheItem.flags + flag_match.lstrip()},
+            synchronize_session=False,
+        )
+
+
+def _remove_flag(folder_id, uids, flag):
+    flag_match = _make_flag_match(flag)
+
+    for uids_chunk in _chunk_list(uids):
+        FolderHeaderCacheItem.query.filter(
+            FolderHeaderCacheItem.folder_id == folder_id,
+            FolderHeaderCacheItem.uid.in_(uids_chunk),
+            func.instr(FolderHeaderCacheItem.flags, flag_match) > 0,
+        ).update(
+            {
+                FolderHeaderCacheItem.flags: func.replace(
+                    FolderHeaderCacheItem.flags, flag_match, " "
+                )
+            },
+            synchronize_session=False,
+        )
+
+
+def _get_part_filename(content_hash):
+    return path.join(PART_CACHE_DIR, content_hash[:2], content_hash)
+
+
+def _write_parts(folder_id, part_number, uid_to_data):
+    accessed_at = time()
+
+    for uids_chunk in _chunk_list(uid_to_data.keys()):
+        FolderHeaderPartCacheItem.query.filter(
+            FolderHeaderPartCacheItem.folder_id == folder_id,
+            FolderHeaderPartCacheItem.part_number == part_number,
+            FolderHeaderPartCacheItem.uid.in_(uids_chunk),
+        ).delete(synchronize_session=False)
+
+    for uid, data in uid_to_data.items():
+        content_hash = sha256(data).hexdigest()
+        inline_data = data
+
+        if len(data) > PART_CACHE_MAX_INLINE_SIZE:
+            inline_data = None
+            filename = _get_part_filename(content_hash)
+
+            if not path.exists(filename):
+                makedirs(path.dirname(filename), exist_ok=True)
+                with open(f"{filename}.tmp", "wb") as f:
+                    f.write(data)
+                rename(f"{filename}.tmp", filename)
+
+        db.session.add(
+            FolderHeaderPartCacheItem(
+                folder_id=folder_id,
+                uid=uid,
+                part_number=part_number,
+                content_hash=content_hash,
+                size=len(data),
+                accessed_at=accessed_at,
+                data=inline_data,
+            ),
+        )
+
+    db.session.flush()
+    _evict_parts()
+
+
+def _touch_parts(part_ids, accessed_at):
+    for part_ids_chunk in _chunk_list(part_ids):
+        FolderHeaderPartCacheItem.query.filter(
+            FolderHeaderPartCacheItem.id.in_(part_ids_chunk),
+        ).update({"accessed_at": accessed_at}, synchronize_session=False)
+
+
+def _delete_parts(part_ids):
+    for part_ids_chunk in _chunk_list(part_ids):
+        FolderHeaderPartCacheItem.query.filter(
+            FolderHeaderPartCacheItem.id.in_(part_ids_chunk),
+        ).delete(synchronize_session=False)
+
+
+def _evict_parts():
+    """
+    Remove the least recently accessed parts until we're back under (90% of)
+    the part cache size.
+    """
+
+    inline_size = (
+        db.session.query(func.sum(FolderHeaderPartCacheItem.size))
+        .filter(FolderHeaderPartCacheItem.data.isnot(None))
+        .scalar()
+        or 0
+    )
+
+    # Parts copied/shared between folders (or identical attachments) share one
+    # file, so count each file once and only free it with its last part.
+    file_hash_to_parts = {}
+    file_size = 0
+    for content_hash, size, part_count in (
+        db.session.query(
+            FolderHeaderPartCacheItem.content_hash,
+            func.max(FolderHeaderPartCacheItem.size),
+            func.count(FolderHeaderPartCacheItem.id),
+        )
+        .filter(FolderHeaderPartCacheItem.data.is_(None))
+        .group_by(FolderHeaderPartCacheItem.content_hash)
+    ):
+        file_hash_to_parts[content_hash] = part_count
+        file_size += size
+
+    total_size = inline_size + file_size
+    if total_size <= PART_CACHE_SIZE:
+        return
+
+    size_to_free = total_size - (PART_CACHE_SIZE * 0.9)
+    part_ids = []
+    file_content_hashes = set()
+
+    for part_id, size, content_hash, is_file in db.session.query(
+        FolderHeaderPartCacheItem.id,
+        FolderHeaderPartCacheItem.size,
+        FolderHeaderPartCacheItem.content_hash,
+        FolderHeaderPartCacheItem.data.is_(None),
+    ).order_by(FolderHeaderPartCacheItem.accessed_at):
+        part_ids.append(part_id)
+
+        if is_file:
+            file_content_hashes.add(content_hash)
+            file_hash_to_parts[content_hash] = file_hash_to_parts.get(content_hash, 1) - 1
+            if file_hash_to_parts[content_hash] > 0:
+                continue
+
+        size_to_free -= size
+        if size_to_free <= 0:
+            break
+
+    logger.info(f"Evicting {len(part_ids)} parts from the part cache")
+    _delete_parts(part_ids)
+
+    # Remove the files of evicted parts no other (copied/shared) part uses, any
+    # others left behind are removed by `remove_orphaned_part_files`.
+    referenced_hashes = set()
+    for content_hashes_chunk in _chunk_list(file_content_hashes):
+        referenced_hashes.update(
+            content_hash
+            for content_hash, in db.session.query(FolderHeaderPartCacheItem.content_hash)
+            .filter(
+                FolderHeaderPartCacheItem.data.is_(None),
+                FolderHeaderPartCacheItem.content_hash.in_(content_hashes_chunk),
+            )
+            .distinct()
+        )
+
+    for content_hash in file_content_hashes - referenced_hashes:
+        _remove_part_file(_get_part_filename(content_hash))
+
+
+def _remove_part_file(filename):
+    try:
+        remove(filename)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove part cache file {filename}: {e}")
+        return False
+    return True
+
+
+def _remove_orphaned_part_files():
+    referenced_hashes = {
+        content_hash
+        for content_hash, in db.session.query(FolderHeaderPartCacheItem.content_hash)
+        .filter(FolderHeaderPartCacheItem.data.is_(None))
+        .distinct()
+    }
+
+    deleted = 0
+
+    try:
+        dirnames = listdir(PART_CACHE_DIR)
+    except OSError as e:
+        logger.warning(f"Failed to list part cache directory: {e}")
+        return
+
+    for dirname in dirnames:
+        dirpath = path.join(PART_CACHE_DIR, dirname)
+        if not path.isdir(dirpath):
+            continue
+
+        try:
+            filenames = listdir(dirpath)
+        except OSError as e:
+            logger.warning(f"Failed to list part cache directory {dirpath}: {e}")
+            continue
+
+        for filename in filenames:
+            # Ignore anything that isn't a part file (eg .DS_Store), temporary files
+            # are never in use here as all part writes go via the cache writer.
+            if not PART_FILENAME_REGEX.match(filename) or filename in referenced_hashes:
+                continue
+
+            if _remove_part_file(path.join(dirpath, filename)):
+                deleted += 1
+
+    logger.info(f"Deleted {deleted} orphaned part cache files")
+
+
+def _recompress_headers(header_ids):
+    for header_item in FolderHeaderCacheItem.query.filter(
+        FolderHeaderCacheItem.id.in_(header_ids),
+    ):
+        header_item.references = _compress_value(_decompress_value(header_item.references))
+        header_item.excerpt = _compress_value(_decompress_value(header_item.excerpt))
+
+
+def _get_headers_using_compression_dictionary(dictionary_item):
+    value_header = VALUE_HEADER.pack(dictionary_item.codec, dictionary_item.id)
+
+    return [
+        header_id
+        for header_id, in FolderHeaderCacheItem.query.with_entities(
+            FolderHeaderCacheItem.id,
+        ).filter(
+            or_(
+                func.substr(FolderHeaderCacheItem.references, 1, VALUE_HEADER.size) == value_header,
+                func.substr(FolderHeaderCacheItem.excerpt, 1, VALUE_HEADER.size) == value_header,
+            ),
+        )
+    ]
+
+
+def _delete_unused_compression_dictionaries(current_dictionary_id):
+    # Headers may still use an old dictionary if they were written, or their
+    # recompress write dropped, after the recompress was queued - so rewrite any
+    # of those before deleting the dictionary.
+    for dictionary_item in FolderCacheDictionaryItem.query.filter(
+        FolderCacheDictionaryItem.id != current_dictionary_id,
+    ):
+        header_ids = _get_headers_using_compression_dictionary(dictionary_item)
+        if header_ids:
+            logger.info(
+                f"Recompressing {len(header_ids)} cache headers still using "
+                f"compression dictionary {dictionary_item.id}",
+            )
+            for header_ids_chunk in _chunk_list(header_ids):
+                _recompress_headers(header_ids_chunk)
+
+        db.session.delete(dictionary_item)
+
+
+def _copy_parts(folder_id, new_folder_id, uid_map):
+    accessed_at = time()
+
+    for uids_chunk in _chunk_list(uid_map.keys()):
+        parts = FolderHeaderPartCacheItem.query.filter(
+            FolderHeaderPartCacheItem.folder_id == folder_id,
+            FolderHeaderPartCacheItem.uid.in_(uids_chunk),
+        ).all()
+
+        FolderHeaderPartCacheItem.query.filter(
+            FolderHeaderPartCacheItem.folder_id == new_folder_id,
+            FolderHeaderPartCacheItem.uid.in_([uid_map[uid] for uid in uids_chunk]),
+        ).delete(synchronize_session=False)
+
+        # Part files are content addressed, so the copies share them
+        for part in parts:
+            db.session.add(
+                FolderHeaderPartCacheItem(
+                    folder_id=new_folder_id,
+                    uid=uid_map[part.uid],
+                    part_number=part.part_number,
+                    content_hash=part.content_hash,
+                    size=part.size,
+                    accessed_at=accessed_at,
+                    data=part.data,
+                ),
+            )
+
+
+def _write_uid_range_changes(folder_id, removed_ranges, added_ranges):
+    for starts_chunk in _chunk_list(start for start, _ in removed_ranges):
+        FolderUidRangeCacheItem.query.filter(
+            FolderUidRangeCacheItem.folder_id == folder_id,
+            FolderUidRangeCacheItem.start_uid.in_(starts_chunk),
+        ).delete(synchronize_session=False)
+
+    db.session.add_all(
+        FolderUidRangeCacheItem(folder_id=folder_id, start_uid=start, end_uid=end)
+        for start, end in added_ranges
+    )
+
+
+class UnloadedFolder(object):
+    """
+    Just the folder identity a `FolderCache` needs, to write to the cache of a
+    folder without loading (listing/searching) it.
+    """
+
+    def __init__(self, account, name, alias_name):
+        self.account = account
+        self.name = name
+        self.alias_name = alias_name
+
+
 class FolderCache(object):
     def __init__(self, folder):
         self.folder = folder
@@ -173,9 +1178,23 @@ class FolderCache(object):
         # TODO: cache cleanup
         self.cache_key = _make_account_key(self.folder.account.settings)
 
+        # The UID ranges as last saved, so we only write changed ranges
+        self.uid_ranges = None
+
+        # The folder cache row ID, UID validity & highest mod sequence, resolved once
+        # (see get_folder_id).
+        self.folder_id = None
+        self.uid_validity = None
+        self.highest_mod_seq = None
+        self.cache_generation = None
+        self.invalidations = 0
+
     def __str__(self):
         return f"FolderCache({self.name})"
 
+    def get_memory_cache_key(self):
+        return (self.cache_key, self.folder.name, self.get_uid_validity())
+
     @lock_class_method
     def get_folder_cache_item(self):
         try:
@@ -190,8 +1209,37 @@ class FolderCache(object):
             )
             save_cache_items(folder_cache_item)
 
+        self.folder_id = folder_cache_item.id
+        self.uid_validity = folder_cache_item.uid_validity
+        self.highest_mod_seq = folder_cache_item.highest_mod_seq
+        self.cache_generation = CACHE_GENERATION
+        self.invalidations = FOLDER_INVALIDATIONS[self.folder_id]
+
         return folder_cache_item
 
+    def reset_folder_id(self):
+        self.folder_id = None
+        self.uid_validity = None
+        self.highest_mod_seq = None
+
+    def get_folder_id(self):
+        """
+        Get the folder cache row ID, only hitting the DB the first time & after
+        the cache is busted.
+        """
+
+        if self.folder_id is None or self.cache_generation != CACHE_GENERATION:
+            self.uid_ranges = None
+            self.get_folder_cache_item()
+
+        elif self.invalidations != FOLDER_INVALIDATIONS[self.folder_id]:
+            self.log("warning", "Folder cache invalidated, reloading UID ranges")
+            self.invalidations = FOLDER_INVALIDATIONS[self.folder_id]
+            self.uid_ranges = None
+            HEADER_MEMORY_CACHE.delete_folder(self.cache_key, self.folder.name)
+
+        return self.folder_id
+
     def log(self, method, message):
         func = getattr(logger, method)
         func(f"[{self}]: {message}")
@@ -199,7 +1247,12 @@ class FolderCache(object):
     @execute_if_enabled
     def bust(self):
         self.log("warning", "busting the cache!")
+        HEADER_MEMORY_CACHE.delete_folder(self.cache_key, self.folder.name)
+        # Make sure there's no pending writes to the folder we're about to delete
+        FOLDER_CACHE_WRITER.flush()
         delete_cache_items(self.get_folder_cache_item())
+        self.reset_folder_id()
+        self.uid_ranges = None
 
     # Single operations
     #
@@ -209,46 +1262,107 @@ class FolderCache(object):
         folder_cache_item = self.get_folder_cache_item()
         folder_cache_item.uid_validity = uid_validity
         save_cache_items(folder_cache_item)
+        self.uid_validity = folder_cache_item.uid_validity
 
     def get_uid_validity(self):
-        uid_validity = self.get_folder_cache_item().uid_validity
-        if uid_validity:
-            return int(uid_validity)
+        self.get_folder_id()
+        if self.uid_validity:
+            return int(self.uid_validity)
+
+    def set_highest_mod_seq(self, highest_mod_seq):
+        self.log("debug", f"Save highest mod sequence: {highest_mod_seq}")
+        # Queued, so only written after any UID/header changes queued before it
+        FOLDER_CACHE_WRITER.write_folder(
+            _set_highest_mod_seq, self.get_folder_id(), highest_mod_seq
+        )
+        self.highest_mod_seq = highest_mod_seq
+
+    def get_highest_mod_seq(self):
+        self.get_folder_id()
+        return self.highest_mod_seq
+
+    @lock_class_method
+    def get_uid_ranges(self):
+        # Resets the memoized UID ranges if the cache was busted/invalidated
+        folder_id = self.get_folder_id()
+
+        if self.uid_ranges is None:
+            FOLDER_CACHE_WRITER.flush_folder(folder_id)
+            self.uid_ranges = [
+                (uid_range.start_uid, uid_range.end_uid)
+                for uid_range in FolderUidRangeCacheItem.query.filter_by(
+                    folder_id=folder_id,
+                ).order_by(FolderUidRangeCacheItem.start_uid)
+            ]
+        return self.uid_ranges
+
+    @lock_class_method
+    def set_uid_ranges(self, uid_ranges):
+        """
+        Save a new list of UID ranges, only writing the rows that changed.
+        """
+
+        old_uid_ranges = set(self.get_uid_ranges())
+        new_uid_ranges = set(uid_ranges)
+
+        removed_ranges = old_uid_ranges - new_uid_ranges
+        added_ranges = new_uid_ranges - old_uid_ranges
+
+        self.log(
+            "debug",
+            f"Saving {len(uid_ranges)} UID ranges (+{len(added_ranges)}/-{len(removed_ranges)})",
+        )
+
+        FOLDER_CACHE_WRITER.write_folder(
+            _write_uid_range_changes,
+            self.get_folder_id(),
+            removed_ranges,
+            added_ranges,
+        )
+
+        self.uid_ranges = list(uid_ranges)
 
     def set_uids(self, uids):
         self.log("debug", f"Saving {len(uids)} UIDs")
-        folder_cache_item = self.get_folder_cache_item()
-        folder_cache_item.uids = pickle_dumps(uids)
-        save_cache_items(folder_cache_item)
+        self.set_uid_ranges(make_uid_ranges(uids))
+
+    @lock_class_method
+    def update_uids(self, new_uids=None, deleted_uids=None):
+        """
+        Apply UID additions/deletions to the saved UIDs, cost is relative to the
+        number of changes, not the number of UIDs.
+        """
+
+        uid_ranges = self.get_uid_ranges()
+
+        if new_uids:
+            uid_ranges = add_uid_ranges(uid_ranges, new_uids)
+        if deleted_uids:
+            uid_ranges = remove_uid_ranges(uid_ranges, deleted_uids)
+
+        self.set_uid_ranges(uid_ranges)
 
     def get_uids(self):
-        uids = self.get_folder_cache_item().uids
-        if uids:
-            return pickle_loads(uids)
+        uid_ranges = self.get_uid_ranges()
+        if uid_ranges:
+            return expand_uid_ranges(uid_ranges)
 
     @execute_if_enabled
     def set_headers(self, uid, headers):
         self.log("debug", f"Set headers for UID {uid}: {headers}")
 
-        headers_data = pickle_dumps(headers)
-
-        headers = self.get_header_cache_item(uid)
-        if headers:
-            headers.data = headers_data
-        else:
-            headers = FolderHeaderCacheItem(
-                folder_id=self.get_folder_cache_item().id,
-                uid=uid,
-                data=headers_data,
-            )
-
-        save_cache_items(headers)
+        HEADER_MEMORY_CACHE.set(self.get_memory_cache_key(), uid, headers)
+        FOLDER_CACHE_WRITER.write_headers(
+            _write_headers,
+            self.get_folder_id(),
+            {uid: headers},
+        )
 
     @execute_if_enabled
     def get_header_cache_item(self, uid):
         try:
             return FolderHeaderCacheItem.query.filter_by(
-                folder_id=self.get_folder_cache_item().id,
+                folder_id=self.get_folder_id(),
                 uid=uid,
             ).one()
         except NoResultFound:
@@ -256,15 +1370,22 @@ class FolderCache(object):
 
     @execute_if_enabled
     def delete_headers(self, uid):
-        headers = self.get_header_cache_item(uid)
-        if headers:
-            delete_cache_items(headers)
+        self.batch_delete_headers([uid])
 
     @execute_if_enabled
     def get_headers(self, uid):
-        headers = self.get_header_cache_item(uid)
-        if headers:
-            return pickle_loads(headers.data)
+        memory_cache_key = self.get_memory_cache_key()
+
+        uid_to_headers = HEADER_MEMORY_CACHE.batch_get(memory_cache_key, [uid])
+        if uid in uid_to_headers:
+            return uid_to_headers[uid]
+
+        FOLDER_CACHE_WRITER.flush_folder(self.get_folder_id())
+        header_item = self.get_header_cache_item(uid)
+        if header_item:
+            headers = _make_headers(header_item, self.folder)
+            HEADER_MEMORY_CACHE.set(memory_cache_key, uid, headers)
+            return headers
 
     @execute_if_enabled
     def get_parts(self, uid):
@@ -272,6 +1393,68 @@ class FolderCache(object):
         if headers:
             return headers["parts"]
 
+    def batch_get_parts(self, uids, part_number):
+        """
+        Get cached raw (undecoded) part data for a list of UIDs.
+        """
+
+        if not CACHE_ENABLED:
+            return {}
+
+        def get_parts(uids_chunk):
+            return FolderHeaderPartCacheItem.query.filter(
+                FolderHeaderPartCacheItem.folder_id == self.get_folder_id(),
+                FolderHeaderPartCacheItem.part_number == f"{part_number}",
+                FolderHeaderPartCacheItem.uid.in_(uids_chunk),
+            )
+
+        return _read_parts(get_parts, uids, lambda part: part.uid)
+
+    def batch_get_parts_by_gm_msgid(self, gm_msgids, part_number):
+        """
+        Get cached raw part data for Gmail message IDs, from any folder in this
+        account, as a dict of Gmail message ID -> data.
+        """
+
+        if not CACHE_ENABLED:
+            return {}
+
+        def get_parts(gm_msgids_chunk):
+            return (
+                db.session.query(FolderHeaderPartCacheItem, FolderHeaderCacheItem.gm_msgid)
+                .join(
+                    FolderHeaderCacheItem,
+                    and_(
+                        FolderHeaderCacheItem.folder_id == FolderHeaderPartCacheItem.folder_id,
+                        FolderHeaderCacheItem.uid == FolderHeaderPartCacheItem.uid,
+                    ),
+                )
+                .join(FolderCacheItem)
+                .filter(
+                    FolderCacheItem.account_name == self.cache_key,
+                    FolderHeaderPartCacheItem.part_number == f"{part_number}",
+                    FolderHeaderCacheItem.gm_msgid.in_(gm_msgids_chunk),
+                )
+            )
+
+        return _read_parts(get_parts, gm_msgids, lambda part: part[1], lambda part: part[0])
+
+    @execute_if_enabled
+    def batch_set_parts(self, part_number, uid_to_data):
+        self.log("debug", f"Batch set {len(uid_to_data)} parts ({part_number})")
+
+        uid_to_data = {
+            uid: data.encode() if isinstance(data, str) else data
+            for uid, data in uid_to_data.items()
+        }
+
+        FOLDER_CACHE_WRITER.write(
+            _write_parts,
+            self.get_folder_id(),
+            f"{part_number}",
+            uid_to_data,
+        )
+
     # Batch operations
     #
 
@@ -279,44 +1462,204 @@ class FolderCache(object):
         if not CACHE_ENABLED:
             return {}
 
-        matched_headers = FolderHeaderCacheItem.query.filter_by(
-            folder_id=self.get_folder_cache_item().id
-        ).filter(FolderHeaderCacheItem.uid.in_(uids))
+        matched_headers = (
+            FolderHeaderCacheItem.query.filter_by(folder_id=self.get_folder_id())
+            .filter(FolderHeaderCacheItem.uid.in_(uids))
+            .options(
+                selectinload(FolderHeaderCacheItem.addresses),
+                selectinload(FolderHeaderCacheItem.structs),
+            )
+        )
 
         return {header.uid: header for header in matched_headers}
 
+    def has_shared_headers(self):
+        """
+        Whether any other folder in this account has cached headers with Gmail
+        message IDs, see `batch_get_headers_by_gm_msgid`.
+        """
+
+        if not CACHE_ENABLED:
+            return False
+
+        return db.session.query(
+            FolderHeaderCacheItem.query.join(FolderCacheItem)
+            .filter(
+                FolderCacheItem.account_name == self.cache_key,
+                FolderHeaderCacheItem.folder_id != self.get_folder_id(),
+                FolderHeaderCacheItem.gm_msgid.isnot(None),
+            )
+            .exists(),
+        ).scalar()
+
+    def batch_get_headers_by_gm_msgid(self, gm_msgids):
+        """
+        Get cached headers for Gmail message IDs, from any folder in this account,
+        as a dict of Gmail message ID -> headers. The UID/seq/flags are those of
+        whichever folder the headers came from.
+        """
+
+        if not CACHE_ENABLED:
+            return {}
+
+        gm_msgid_to_headers = {}
+
+        for gm_msgids_chunk in _chunk_list(gm_msgids):
+            for header in (
+                FolderHeaderCacheItem.query.join(FolderCacheItem)
+                .filter(
+                    FolderCacheItem.account_name == self.cache_key,
+                    FolderHeaderCacheItem.gm_msgid.in_(gm_msgids_chunk),
+                )
+                .options(
+                    selectinload(FolderHeaderCacheItem.addresses),
+                    selectinload(FolderHeaderCacheItem.structs),
+                )
+            ):
+                gm_msgid_to_headers[header.gm_msgid] = _make_headers(header, self.folder)
+
+        return gm_msgid_to_headers
+
     def batch_get_headers(self, uids):
         if not CACHE_ENABLED:
             return {}
 
-        self.log("debug", f"Batch get {len(uids)} headers")
+        memory_cache_key = self.get_memory_cache_key()
 
-        return {
-            uid: pickle_loads(header.data)
-            for uid, header in self.batch_get_header_items(uids).items()
-        }
+        uid_to_headers = HEADER_MEMORY_CACHE.batch_get(memory_cache_key, uids)
+        missing_uids = [uid for uid in uids if uid not in uid_to_headers]
+
+        self.log(
+            "debug",
+            (
+                f"Batch get {len(uids)} headers ({len(uid_to_headers)} from memory, "
+                f"stats={HEADER_MEMORY_CACHE.get_stats()})"
+            ),
+        )
+
+        if missing_uids:
+            # Make sure any queued flag changes/deletes are visible in the DB
+            FOLDER_CACHE_WRITER.flush_folder(self.get_folder_id())
+
+            uid_to_stored_headers = {
+                uid: _make_headers(header, self.folder)
+                for uid, header in self.batch_get_header_items(missing_uids).items()
+            }
+            HEADER_MEMORY_CACHE.batch_set(memory_cache_key, uid_to_stored_headers)
+            uid_to_headers.update(uid_to_stored_headers)
+
+        # Remove any deleted (tombstoned) headers
+        return {uid: headers for uid, headers in uid_to_headers.items() if headers is not None}
 
     @execute_if_enabled
-    def batch_set_headers(self, uid_to_headers):
-        self.log("debug", f"Batch set {len(uid_to_headers)} headers")
+    def batch_delete_headers(self, uids):
+        uids = list(uids)
+        if not uids:
+            return
 
-        existing_headers = self.batch_get_header_items(uid_to_headers.keys())
-        items_to_save = []
-
-        for uid, headers in uid_to_headers.items():
-            headers_data = pickle_dumps(headers)
-
-            existing_header = existing_headers.get(uid)
-            if existing_header:
-                existing_header.data = headers_data
-                items_to_save.append(existing_header)
-            else:
-                items_to_save.append(
-                    FolderHeaderCacheItem(
-                        folder_id=self.get_folder_cache_item().id,
-                        uid=uid,
-                        data=headers_data,
-                    )
+        self.log("debug", f"Batch delete {len(uids)} headers")
+
+        HEADER_MEMORY_CACHE.batch_delete(self.get_memory_cache_key(), uids)
+        FOLDER_CACHE_WRITER.write_folder(_delete_headers, self.get_folder_id(), uids)
+
+    @execute_if_enabled
+    def copy_to(self, other_cache, uid_map):
+        """
+        Copy cached headers & parts to another folder's cache under new UIDs, ie
+        those the server gave emails copied/moved there.
+        """
+
+        uid_to_headers = self.batch_get_headers(list(uid_map.keys()))
+
+        self.log("debug", f"Copy {len(uid_to_headers)} headers to {other_cache}")
+
+        # Save the new UIDs to the destination first (writes are applied in order),
+        # otherwise the copies are removed as stale before it's next synced.
+        other_cache.update_uids(new_uids=list(uid_map.values()))
+
+        other_cache.batch_set_headers(
+            {
+                uid_map[uid]: dict(
+                    headers,
+                    uid=uid_map[uid],
+                    server_folder_name=other_cache.folder.name,
+                    folder_name=other_cache.folder.alias_name,
                 )
+                for uid, headers in uid_to_headers.items()
+            },
+        )
+
+        FOLDER_CACHE_WRITER.write(
+            _copy_parts,
+            self.get_folder_id(),
+            other_cache.get_folder_id(),
+            dict(uid_map),
+        )
+
+    @execute_if_enabled
+    def batch_set_flags(self, uid_to_flags):
+        """
+        Replace the flags of any cached headers, one UPDATE per distinct flag set.
+        """
+
+        if not uid_to_flags:
+            return
+
+        self.log("debug", f"Batch set flags for {len(uid_to_flags)} headers")
+
+        def set_flags(headers):
+            headers["flags"] = tuple(uid_to_flags[headers["uid"]])
+            return headers
+
+        HEADER_MEMORY_CACHE.batch_update(self.get_memory_cache_key(), uid_to_flags, set_flags)
+        FOLDER_CACHE_WRITER.write_folder(_set_flags, self.get_folder_id(), dict(uid_to_flags))
+
+    @execute_if_enabled
+    def batch_add_flags(self, uids, flag):
+        """
+        Add a flag to any cached headers for the UIDs, as a single UPDATE.
+        """
+
+        uids = list(uids)
+        if not uids:
+            return
+
+        self.log("debug", f"Batch add flag {flag} to {len(uids)} headers")
+
+        def add_flag(headers):
+            if flag not in headers["flags"]:
+                headers["flags"] = (*headers["flags"], flag)
+            return headers
+
+        HEADER_MEMORY_CACHE.batch_update(self.get_memory_cache_key(), uids, add_flag)
+        FOLDER_CACHE_WRITER.write_folder(_add_flag, self.get_folder_id(), uids, flag)
+
+    @execute_if_enabled
+    def batch_remove_flags(self, uids, flag):
+        """
+        Remove a flag from any cached headers for the UIDs, as a single UPDATE.
+        """
+
+        uids = list(uids)
+        if not uids:
+            return
+
+        self.log("debug", f"Batch remove flag {flag} from {len(uids)} headers")
+
+        def remove_flag(headers):
+            headers["flags"] = tuple(f for f in headers["flags"] if f != flag)
+            return headers
+
+        HEADER_MEMORY_CACHE.batch_update(self.get_memory_cache_key(), uids, remove_flag)
+        FOLDER_CACHE_WRITER.write_folder(_remove_flag, self.get_folder_id(), uids, flag)
+
+    @execute_if_enabled
+    def batch_set_headers(self, uid_to_headers):
+        self.log("debug", f"Batch set {len(uid_to_headers)} headers")
 
-        save_cache_items(*items_to_save)
+        HEADER_MEMORY_CACHE.batch_set(self.get_memory_cache_key(), uid_to_headers)
+        FOLDER_CACHE_WRITER.write_headers(
+            _write_headers,
+            self.get_folder_id(),
+            uid_to_headers,
+        )
@@ -0,0 +1,221 @@
+"""
+IMAP IDLE (RFC 2177) folder watchers - each watched folder gets a dedicated
+connection (outside the account connection pool) that waits for the server to
+push changes, which are recorded so clients only sync folders that changed.
+"""
+
+from socket import SHUT_RDWR
+from threading import Condition, Lock, Thread
+from time import sleep, time
+
+from kanmail.log import logger
+
+from .connection import ImapConnectionWrapper
+
+# Servers may drop connections idling for 30 minutes (RFC 2177), so restart before
+IDLE_RESTART_INTERVAL = 25 * 60
+# How long each check for IDLE responses blocks
+IDLE_CHECK_TIMEOUT = 30
+
+MIN_RECONNECT_BACKOFF = 1
+MAX_RECONNECT_BACKOFF = 5 * 60
+
+# Each watched folder uses a whole connection, and servers limit connections
+# per account (Gmail: 15, the pool uses 10 by default).
+MAX_WATCHED_FOLDERS_PER_ACCOUNT = 3
+
+# Untagged responses received while idling that mean the folder changed
+CHANGE_RESPONSES = (b"EXISTS", b"EXPUNGE", b"FETCH", b"VANISHED")
+
+
+def _is_change_response(response):
+    return any(item in CHANGE_RESPONSES for item in response if isinstance(item, bytes))
+
+
+class FolderChanges(object):
+    """
+    Change log of account/folders, each change gets a new (increasing) change
+    number so clients can ask for anything changed since the last one they saw.
+    """
+
+    def __init__(self):
+        self.change_number = 0
+        self.key_to_change_number = {}
+        self.condition = Condition()
+
+    def add_change(self, account_name, folder_name):
+        with self.condition:
+            self.change_number += 1
+            self.key_to_change_number[(account_name, folder_name)] = self.change_number
+            self.condition.notify_all()
+
+    def get_change_number(self):
+        with self.condition:
+            return self.change_number
+
+    def get_changes(self, since):
+        with self.condition:
+            changes = [
+                {"account": key[0], "folder": key[1]}
+                for key, change_number in self.key_to_change_number.items()
+                if change_number > since
+            ]
+            return self.change_number, changes
+
+    def wait_for_changes(self, since, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.change_number > since, timeout)
+            return self.get_changes(since)
+
+
+class FolderWatcher(object):
+    def __init__(self, account, folder_name, changes):
+        self.account = account
+        self.folder_name = folder_name
+        self.changes = changes
+
+        self.running = True
+        self.imap = None
+        self.thread = Thread(name=f"IDLE watcher {self}", target=self.run)
+        self.thread.daemon = True
+
+    def __str__(self):
+        return f"{self.account.name}/{self.folder_name}"
+
+    def log(self, method, message):
+        func = getattr(logger, method)
+        func(f"[FolderWatcher: {self}]: {message}")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        # Shutting the socket down wakes up any blocking IDLE check immediately
+        imap = self.imap
+        if imap is not None:
+            try:
+                imap._sock.shutdown(SHUT_RDWR)
+            except Exception:
+                pass
+
+    def add_change(self):
+        server_folder_name = self.account.get_folder(self.folder_name).name
+        self.account.invalidate_folder_status(server_folder_name)
+
+        self.changes.add_change(self.account.name, self.folder_name)
+
+    def run(self):
+        backoff = MIN_RECONNECT_BACKOFF
+        reconnecting = False
+
+        while self.running:
+            started = time()
+
+            try:
+                self.watch(mark_changed=reconnecting)
+            except Exception as e:
+                if not self.running:
+                    break
+
+                # Reset the backoff if we'd been connected a while
+                if time() - started > MAX_RECONNECT_BACKOFF:
+                    backoff = MIN_RECONNECT_BACKOFF
+
+                self.log("warning", f"IDLE connection failed, retry in {backoff}s: {e}")
+                sleep(backoff)
+
+                backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF)
+                reconnecting = True
+
+    def watch(self, mark_changed=False):
+        server_folder_name = self.account.get_folder(self.folder_name).name
+
+        self.account.connection_pool.check_auth_settings()
+        connection = ImapConnectionWrapper(
+            self.account.connection_pool,
+            selected_folder=server_folder_name,
+        )
+        imap = self.imap = connection.get_imap()
+
+        # Anything could have changed while we weren't connected
+        if mark_changed:
+            self.add_change()
+
+        self.log("debug", "Watching folder")
+
+        try:
+            while self.running:
+                imap.idle()
+                idle_started = time()
+
+                try:
+                    while self.running and time() - idle_started < IDLE_RESTART_INTERVAL:
+                        responses = imap.idle_check(timeout=IDLE_CHECK_TIMEOUT)
+                        if any(_is_change_response(response) for response in responses):
+                            self.log("debug", f"Folder changed: {responses}")
+                            self.add_change()
+                finally:
+                    imap.idle_done()
+        finally:
+            self.imap = None
+
+            try:
+                imap.logout()
+            except Exception:
+                pass
+
+
+class FolderWatchers(object):
+    def __init__(self):
+        self.changes = FolderChanges()
+        self.key_to_watcher = {}
+        self.lock = Lock()
+
+    def watch_folders(self, accounts, folder_names):
+        """
+        Ensure the folders are watched in all (IDLE capable) accounts, returning the
+        folder names watched in every account.
+        """
+
+        watched_folder_names = set(folder_names)
+
+        with self.lock:
+            for account in accounts:
+                account_folder_names = set()
+
+                if b"IDLE" in account.get_capabilities():
+                    for folder_name in folder_names:
+                        key = (account.name, folder_name)
+
+                        if key not in self.key_to_watcher:
+                            if (
+                                self.get_account_watcher_count(account)
+                                >= MAX_WATCHED_FOLDERS_PER_ACCOUNT
+                            ):
+                                continue
+
+                            watcher = FolderWatcher(account, folder_name, self.changes)
+                            watcher.start()
+                            self.key_to_watcher[key] = watcher
+
+                        account_folder_names.add(folder_name)
+
+                watched_folder_names &= account_folder_names
+
+        return watched_folder_names
+
+    def get_account_watcher_count(self, account):
+        return sum(
+            1 for (account_name, _) in self.key_to_watcher.keys() if account_name == account.name
+        )
+
+    def stop_all(self):
+        with self.lock:
+            for watcher in self.key_to_watcher.values():
+                watcher.stop()
+            self.key_to_watcher = {}
+
+
+FOLDER_WATCHERS = FolderWatchers()
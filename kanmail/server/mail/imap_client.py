@@ -0,0 +1,277 @@
+"""
+IMAPClient with support for IMAP extensions/commands it doesn't implement,
+built on its (and imaplib's) internals.
+"""
+
+import imaplib
+import zlib
+from threading import Lock
+
+from imapclient import IMAPClient
+from imapclient.imap_utf7 import decode as decode_utf7
+from imapclient.imapclient import _normalise_search_criteria
+from imapclient.response_parser import parse_response
+from imapclient.util import to_bytes, to_unicode
+
+from .uid_ranges import count_uid_ranges, parse_sequence_set
+
+ESEARCH_RETURN_ITEMS = (b"ALL", b"COUNT", b"MIN", b"MAX")
+
+COMPRESS_LEVEL = 6
+COMPRESS_WBITS = -15  # raw deflate, as required by RFC 4978
+COMPRESS_READ_SIZE = 16 * 1024
+
+# As IMAPClient does for the commands it adds, COMPRESS (RFC 4978) is only valid
+# once authenticated.
+if "COMPRESS" not in imaplib.Commands:
+    imaplib.Commands["COMPRESS"] = ("AUTH", "SELECTED")
+
+
+class TransferStats(object):
+    """
+    Bytes sent/received over compressed connections, both before (raw) and after
+    (wire) compression.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.sent = 0
+        self.sent_wire = 0
+        self.received = 0
+        self.received_wire = 0
+
+    def add(self, sent=0, sent_wire=0, received=0, received_wire=0):
+        with self.lock:
+            self.sent += sent
+            self.sent_wire += sent_wire
+            self.received += received
+            self.received_wire += received_wire
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "sent": self.sent,
+                "sent_wire": self.sent_wire,
+                "received": self.received,
+                "received_wire": self.received_wire,
+            }
+
+
+class DeflateSocketIO(object):
+    """
+    Socket wrapper that compresses everything sent & decompresses everything
+    received, for COMPRESS=DEFLATE (RFC 4978). Used in place of imaplib's socket
+    file & send.
+
+    Inflated data is buffered here, rather than by an io.BufferedReader, so when
+    the socket times out (or would block, as it does during IDLE checks) partway
+    through a line nothing is lost - the next read carries on from the buffer.
+    """
+
+    def __init__(self, sock, stats):
+        self.sock = sock
+        self.stats = stats
+
+        self.compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS)
+        self.decompressor = zlib.decompressobj(COMPRESS_WBITS)
+
+        # Inflated data, read up to position
+        self.buffer = bytearray()
+        self.position = 0
+
+    def _fill_buffer(self):
+        # Any socket errors are raised with the buffer untouched
+        data = self.sock.recv(COMPRESS_READ_SIZE)
+        if not data:
+            return False
+
+        inflated_data = self.decompressor.decompress(data)
+        self.stats.add(received=len(inflated_data), received_wire=len(data))
+
+        del self.buffer[: self.position]
+        self.position = 0
+        self.buffer += inflated_data
+        return True
+
+    def _take(self, end):
+        data = bytes(self.buffer[self.position : end])
+        self.position = end
+        return data
+
+    def readline(self, limit=-1):
+        if limit is None:
+            limit = -1
+
+        while True:
+            end = self.buffer.find(b"\n", self.position) + 1
+            if end or 0 <= limit <= len(self.buffer) - self.position:
+                break
+            if not self._fill_buffer():
+                break
+
+        if not end:
+            end = len(self.buffer)
+        if limit >= 0:
+            end = min(end, self.position + limit)
+
+        return self._take(end)
+
+    def read(self, size):
+        while len(self.buffer) - self.position < size:
+            if not self._fill_buffer():
+                break
+
+        return self._take(min(len(self.buffer), self.position + size))
+
+    def close(self):
+        # The socket itself is closed by imaplib
+        pass
+
+    def sendall(self, data):
+        # Each send is flushed so the server can decompress the whole command
+        compressed_data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.sock.sendall(compressed_data)
+        self.stats.add(sent=len(data), sent_wire=len(compressed_data))
+
+
+class KanmailIMAPClient(IMAPClient):
+    def _format_status_items(self, status_items):
+        return "({0})".format(" ".join(to_unicode(item) for item in status_items))
+
+    def _decode_folder_name(self, name):
+        # As IMAPClient._proc_folder_list, quoted numeric names are parsed to ints
+        if isinstance(name, int):
+            return str(name)
+        if self.folder_encode:
+            return decode_utf7(name)
+        return name
+
+    def _pop_status_responses(self):
+        """
+        Pop & parse any untagged STATUS responses imaplib has collected into a
+        dict of folder name -> status.
+        """
+
+        responses = self._imap.untagged_responses.pop("STATUS", [])
+        responses = [response for response in responses if response not in (b"", None)]
+
+        parsed = parse_response(responses)
+
+        folder_statuses = {}
+        for name, status_items in zip(parsed[::2], parsed[1::2]):
+            folder_statuses[self._decode_folder_name(name)] = dict(
+                zip(status_items[::2], status_items[1::2]),
+            )
+
+        return folder_statuses
+
+    def compress(self, stats):
+        """
+        Enable COMPRESS=DEFLATE (RFC 4978), everything after the server's response
+        is compressed in both directions. Transfer sizes are added to `stats`.
+        """
+
+        typ, data = self._imap._simple_command("COMPRESS", "DEFLATE")
+        self._checkok("compress", typ, data)
+
+        deflate_io = DeflateSocketIO(self._imap.sock, stats)
+
+        self._imap.file.close()
+        self._imap.file = deflate_io
+        self._imap.send = deflate_io.sendall
+
+    def esearch(self, criteria="ALL", charset=None, return_items=ESEARCH_RETURN_ITEMS):
+        """
+        Search using ESEARCH (RFC 4731), returning a dict of the return items. ALL
+        is returned as a UID range list rather than every UID.
+        """
+
+        args = [b"RETURN", b"(" + b" ".join(return_items) + b")"]
+        if charset:
+            args.extend([b"CHARSET", to_bytes(charset)])
+        args.extend(_normalise_search_criteria(criteria, charset))
+
+        data = self._raw_command_untagged(b"SEARCH", args, response_name="ESEARCH")
+        data = [item for item in data if item not in (b"", None)]
+
+        # Skip the (TAG "...") correlator & UID indicator
+        items = [item for item in parse_response(data) if not isinstance(item, tuple)]
+        if items and items[0] == b"UID":
+            items = items[1:]
+
+        results = {}
+        for key, value in zip(items[::2], items[1::2]):
+            key = key.upper()
+            if key == b"ALL":
+                # Single UIDs are parsed as ints
+                value = parse_sequence_set(value if isinstance(value, bytes) else str(value))
+            results[key] = value
+
+        # ALL is omitted when nothing matches
+        if b"ALL" in return_items:
+            results.setdefault(b"ALL", [])
+        if b"COUNT" in return_items:
+            results.setdefault(b"COUNT", count_uid_ranges(results.get(b"ALL", [])))
+
+        return results
+
+    def list_folders_with_status(self, status_items, directory="", pattern="*"):
+        """
+        List folders along with their status in a single command using LIST-STATUS
+        (RFC 5819). Returns a list of (flags, delimiter, name, status) tuples,
+        status is `None` for non-selectable folders.
+        """
+
+        # Remove any STATUS responses left over from previous commands
+        self._pop_status_responses()
+
+        typ, data = self._imap._simple_command(
+            "LIST",
+            self._normalise_folder(directory),
+            self._normalise_folder(pattern),
+            "RETURN",
+            "(STATUS {0})".format(self._format_status_items(status_items)),
+        )
+        self._checkok("list", typ, data)
+        typ, data = self._imap._untagged_response(typ, data, "LIST")
+
+        folders = self._proc_folder_list(data)
+        folder_statuses = self._pop_status_responses()
+
+        return [
+            (flags, delimiter, name, folder_statuses.get(name))
+            for flags, delimiter, name in folders
+        ]
+
+    def folder_statuses(self, folder_names, status_items):
+        """
+        Get the status of multiple folders by pipelining STATUS commands - all are
+        sent before reading any responses. Returns a dict of folder name -> status,
+        any folders the server fails to STATUS are missing.
+        """
+
+        self._pop_status_responses()
+
+        status_items = self._format_status_items(status_items)
+        tags = [
+            self._imap._command("STATUS", self._normalise_folder(folder_name), status_items)
+            for folder_name in folder_names
+        ]
+
+        # Read every tagged response, even after a BAD, so none are left unread on
+        # the connection - then raise the first error.
+        error = None
+        for tag in tags:
+            try:
+                self._imap._command_complete("STATUS", tag)
+            except self._imap.abort:
+                raise
+            except self._imap.error as e:
+                error = error or e
+
+        folder_statuses = self._pop_status_responses()
+
+        if error:
+            raise error
+
+        return folder_statuses
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from sys import getsizeof
+from threading import Lock
+
+from kanmail.settings.constants import HEADER_MEMORY_CACHE_SIZE
+
+
+def _get_deep_size(value):
+    size = getsizeof(value)
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _get_deep_size(key) + _get_deep_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _get_deep_size(item)
+
+    return size
+
+
+class HeaderMemoryCache(object):
+    """
+    Process wide, size bounded LRU of decoded email headers, sitting in front of
+    the on-disk folder cache.
+
+    Items are keyed by (account key, folder name, UID validity, UID); everything
+    before the UID is the "folder key". Headers are (shallow) copied on the way
+    in and out as callers modify the dicts they get back.
+
+    Deleted UIDs are kept as `None` tombstones, so readers don't fall through to
+    a stale copy in the DB before the (queued) delete has been written.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # Map of key -> (headers, size of key + headers), least recently used first
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get_stats(self):
+        return {
+            "items": len(self.items),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def batch_get(self, folder_key, uids):
+        uid_to_headers = {}
+
+        with self.lock:
+            for uid in uids:
+                item = self.items.get((*folder_key, uid))
+                if item is None:
+                    self.misses += 1
+                    continue
+
+                self.hits += 1
+                self.items.move_to_end((*folder_key, uid))
+
+                headers = item[0]
+                uid_to_headers[uid] = dict(headers) if headers is not None else None
+
+        return uid_to_headers
+
+    def get(self, folder_key, uid):
+        return self.batch_get(folder_key, [uid]).get(uid)
+
+    def batch_set(self, folder_key, uid_to_headers):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            for uid, headers in uid_to_headers.items():
+                key = (*folder_key, uid)
+                self._delete(key)
+
+                # Keys are counted too, they're all there is of tombstones
+                size = _get_deep_size(key) + _get_deep_size(headers)
+                if size > self.max_size:
+                    continue
+
+                if headers is not None:
+                    headers = dict(headers)
+
+                self.items[key] = (headers, size)
+                self.size += size
+
+            self._evict()
+
+    def set(self, folder_key, uid, headers):
+        self.batch_set(folder_key, {uid: headers})
+
+    def batch_update(self, folder_key, uids, update):
+        """
+        Update any cached (non-tombstoned) headers in place, `update` is called with
+        and returns each headers dict.
+        """
+
+        with self.lock:
+            for uid in uids:
+                key = (*folder_key, uid)
+                item = self.items.get(key)
+                if item is None or item[0] is None:
+                    continue
+
+                headers = update(dict(item[0]))
+                size = _get_deep_size(key) + _get_deep_size(headers)
+
+                self.items[key] = (headers, size)
+                self.size += size - item[1]
+
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_size:
+            _, (_, size) = self.items.popitem(last=False)
+            self.size -= size
+
+    def _delete(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def batch_delete(self, folder_key, uids):
+        self.batch_set(folder_key, {uid: None for uid in uids})
+
+    def delete(self, folder_key, uid):
+        self.batch_delete(folder_key, [uid])
+
+    def delete_folder(self, account_key, folder_name):
+        """
+        Remove all items for a given account/folder, regardless of UID validity.
+        """
+
+        with self.lock:
+            for key in list(self.items.keys()):
+                if key[:2] == (account_key, folder_name):
+                    self._delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+HEADER_MEMORY_CACHE = HeaderMemoryCache(HEADER_MEMORY_CACHE_SIZE)
@@ -0,0 +1,138 @@
+"""
+Compact UID range handling - lists of sorted, non-overlapping & non-adjacent
+(start, end) tuples, like IMAP sequence sets (RFC 3501 "1:5,7,9:20").
+"""
+
+
+def make_uid_ranges(uids):
+    ranges = []
+
+    for uid in sorted(uids):
+        if ranges and uid <= ranges[-1][1] + 1:
+            if uid > ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], uid)
+            continue
+
+        ranges.append((uid, uid))
+
+    return ranges
+
+
+def iter_uid_ranges(ranges):
+    for start, end in ranges:
+        yield from range(start, end + 1)
+
+
+def expand_uid_ranges(ranges):
+    return set(iter_uid_ranges(ranges))
+
+
+def count_uid_ranges(ranges):
+    return sum(end - start + 1 for start, end in ranges)
+
+
+def merge_uid_ranges(ranges, other_ranges):
+    """
+    Merge two range lists into a new (canonical) range list.
+    """
+
+    merged = []
+
+    for start, end in sorted((*ranges, *other_ranges)):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+            continue
+
+        merged.append((start, end))
+
+    return merged
+
+
+def add_uid_ranges(ranges, uids):
+    return merge_uid_ranges(ranges, make_uid_ranges(uids))
+
+
+def remove_uid_ranges(ranges, uids):
+    """
+    Remove UIDs from a range list, returning a new range list.
+    """
+
+    uids = sorted(uids)
+    if not uids:
+        return list(ranges)
+
+    new_ranges = []
+    i = 0
+
+    for start, end in ranges:
+        # Skip any UIDs below this range
+        while i < len(uids) and uids[i] < start:
+            i += 1
+
+        while i < len(uids) and uids[i] <= end:
+            uid = uids[i]
+            if uid > start:
+                new_ranges.append((start, uid - 1))
+            start = uid + 1
+            i += 1
+
+        if start <= end:
+            new_ranges.append((start, end))
+
+    return new_ranges
+
+
+def format_sequence_set(ranges):
+    return ",".join(f"{start}" if start == end else f"{start}:{end}" for start, end in ranges)
+
+
+def parse_sequence_set(sequence_set):
+    if isinstance(sequence_set, bytes):
+        sequence_set = sequence_set.decode()
+
+    ranges = []
+
+    for bit in sequence_set.split(","):
+        bit = bit.strip()
+        if not bit:
+            continue
+
+        if ":" in bit:
+            start, end = sorted(int(uid) for uid in bit.split(":", 1))
+        else:
+            start = end = int(bit)
+
+        ranges.append((start, end))
+
+    return merge_uid_ranges(ranges, [])
+
+
+def subtract_uid_ranges(ranges, other_ranges):
+    """
+    Remove all UIDs in another range list from a range list, returning a new range
+    list - without expanding either.
+    """
+
+    new_ranges = []
+    i = 0
+
+    for start, end in ranges:
+        # Skip any other ranges entirely below this range
+        while i < len(other_ranges) and other_ranges[i][1] < start:
+            i += 1
+
+        # Note the last overlapping other range may also overlap the next range,
+        # so don't move `i` past it.
+        j = i
+        while j < len(other_ranges) and other_ranges[j][0] <= end and start <= end:
+            other_start, other_end = other_ranges[j]
+            if other_start > start:
+                new_ranges.append((start, other_start - 1))
+            start = max(start, other_end + 1)
+            j += 1
+
+        if start <= end:
+            new_ranges.append((start, end))
+
+    return new_ranges
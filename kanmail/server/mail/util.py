@@ -1,3 +1,4 @@
+import codecs
 import email.header
 import quopri
 import re
@@ -9,6 +10,8 @@ from mdx_linkify.mdx_linkify import LinkifyExtension
 
 from kanmail.log import logger
 
+from .uid_ranges import expand_uid_ranges, parse_sequence_set
+
 
 def markdownify(text, linkify=True):
     extensions = [
@@ -23,6 +26,72 @@ def markdownify(text, linkify=True):
     return markdown(text=text, extensions=extensions)
 
 
+def parse_vanished_responses(responses):
+    """
+    Parse untagged QRESYNC VANISHED responses, eg b"(EARLIER) 1:3,7", into a
+    set of UIDs.
+    """
+
+    uids = set()
+
+    for response in responses:
+        if isinstance(response, bytes):
+            response = response.decode()
+
+        if response.upper().startswith("(EARLIER)"):
+            response = response[len("(EARLIER)") :]
+
+        uids.update(expand_uid_ranges(parse_sequence_set(response)))
+
+    return uids
+
+
+COPYUID_REGEX = re.compile(r"COPYUID ([0-9]+) ([0-9:,]+) ([0-9:,]+)", re.IGNORECASE)
+
+
+def _expand_ordered_sequence_set(sequence_set):
+    # Unlike parse_sequence_set keep the given order, COPYUID sets correspond
+    uids = []
+
+    for bit in sequence_set.split(","):
+        if ":" in bit:
+            start, end = (int(uid) for uid in bit.split(":", 1))
+            step = 1 if start <= end else -1
+            uids.extend(range(start, end + step, step))
+        else:
+            uids.append(int(bit))
+
+    return uids
+
+
+def parse_copyuid_response(response):
+    """
+    Parse a UIDPLUS (RFC 4315) COPYUID response, eg b"[COPYUID 38505 304,319:320
+    3956:3958] Done", into the destination UIDVALIDITY and a dict of source ->
+    destination UID. Returns `(None, {})` if there's no (valid) COPYUID.
+    """
+
+    if isinstance(response, bytes):
+        response = response.decode()
+
+    match = COPYUID_REGEX.search(response or "")
+    if not match:
+        return None, {}
+
+    uid_validity, source_uids, destination_uids = match.groups()
+
+    try:
+        source_uids = _expand_ordered_sequence_set(source_uids)
+        destination_uids = _expand_ordered_sequence_set(destination_uids)
+    except ValueError:  # eg "1,,2" or "1:"
+        return None, {}
+
+    if len(source_uids) != len(destination_uids):
+        return None, {}
+
+    return int(uid_validity), dict(zip(source_uids, destination_uids))
+
+
 def format_address(address):
     bits = []
 
@@ -89,19 +158,21 @@ def make_email_headers(account, folder, uid, data, parts):
     # Some servers return data under non-standard keys - there are so many
     # different IMAP implementations it's impossible to handle them all by hand,
     # so attempt to locate the body by looking for a body-like key.
-    body_key = b"BODY[1]"
+    body_key = b"BODY[1]<0>"
     if body_key not in data:
         for key in data.keys():
-            if isinstance(key, bytes) and key.startswith(b"BODY"):
+            if isinstance(key, bytes) and key.startswith(b"BODY[1]"):
                 body_key = key
                 break
 
-    # Attempt to extract an excerpt
+    # Attempt to extract an excerpt, the body is (likely) cut off when only the
+    # start of it was fetched.
     excerpt = None
     if body_key in data:
         excerpt = extract_excerpt(
             data[body_key],
             body_meta,
+            partial=body_key.endswith(b">"),
         )
 
     # Make the summary dict!
@@ -145,6 +216,8 @@ def make_email_headers(account, folder, uid, data, parts):
         "in_reply_to": envelope.in_reply_to,
         "message_id": envelope.message_id,
         "references": references,
+        # Gmail message & thread IDs (X-GM-EXT-1), the same in every folder/label
+        "gm_msgid": data.get(b"X-GM-MSGID"),
     }
 
 
@@ -168,7 +241,28 @@ def decode_header(subject):
     return "".join(bits)
 
 
-def decode_string(string, string_meta=None, as_str=True):
+def _decode_partial_base64(string):
+    # Base64 is a continuous stream split into lines, so drop the whitespace &
+    # any trailing incomplete 4 character group.
+    string = re.sub(rb"\s+", b"", string)
+    string = string[: len(string) - len(string) % 4]
+    return b64decode(string)
+
+
+def _decode_charset(string, charset, partial=False):
+    if partial:
+        # Ignore any multibyte character cut off at the end
+        decoder = codecs.getincrementaldecoder(charset)("replace")
+        return decoder.decode(string, final=False)
+    return string.decode(charset, "replace")
+
+
+def decode_string(string, string_meta=None, as_str=True, partial=False):
+    """
+    Decode a (transfer encoded) string, `partial` strings may be cut off at any
+    point - ie when only the start of a body part was fetched.
+    """
+
     encoding = None
     charset = None
 
@@ -181,41 +275,31 @@ def decode_string(string, string_meta=None, as_str=True):
 
     # Remove any quoted printable stuff
     if encoding == "quoted-printable":
+        if partial:
+            # Drop any escape sequence cut off at the end
+            string = re.sub(rb"=[0-9A-Fa-f\r]?\Z", b"", string)
         string = quopri.decodestring(string)
 
     if encoding == "base64":
         try:
             string = b64decode(string)
 
-        # Handle incomplete payloads (we only fetch the first 1024 bytes of a
-        # message). Split into lines and attempt to decode.
+        # Handle incomplete payloads, where the end of the stream is missing.
         except BinasciiError:
-            string_bits = string.split()
-            valid_bits = []
-
-            for bit in string_bits:
-                try:
-                    valid_bits.append(b64decode(bit))
-                except Exception:
-                    pass
-
-            if not valid_bits:
-                raise
-
-            string = b"\n".join(valid_bits)
+            string = _decode_partial_base64(string)
 
     if charset:
-        string = string.decode(charset, "replace")
+        string = _decode_charset(string, charset, partial=partial)
 
     if as_str and isinstance(string, bytes):
-        string = string.decode("utf-8", "replace")
+        string = _decode_charset(string, "utf-8", partial=partial)
 
     return string
 
 
-def _extract_excerpt(raw_body, raw_body_meta):
+def _extract_excerpt(raw_body, raw_body_meta, partial=False):
     # Decode the body first
-    raw_body = decode_string(raw_body, raw_body_meta)
+    raw_body = decode_string(raw_body, raw_body_meta, partial=partial)
 
     # Remove any style tags *and* content
     raw_body = re.sub(r"<style.*>.*(?:</style>)?", "", raw_body, flags=re.DOTALL)
@@ -252,11 +336,12 @@ def _extract_excerpt(raw_body, raw_body_meta):
     return body
 
 
-def extract_excerpt(raw_body, raw_body_meta):
+def extract_excerpt(raw_body, raw_body_meta, partial=False):
     try:
         return _extract_excerpt(
             raw_body,
             raw_body_meta,
+            partial=partial,
         )
 
     except Exception as e:
@@ -367,7 +452,15 @@ def parse_bodystructure(bodystructure):
 
         raise
 
-    # Attach shortcuts -> part IDs
+    return add_part_shortcuts(items)
+
+
+def add_part_shortcuts(items):
+    """
+    Attach the html/plain/attachments shortcuts -> part IDs to a dict of parsed
+    bodystructure parts (in bodystructure order).
+    """
+
     items["attachments"] = []
 
     for number, part in list(items.items()):
@@ -6,24 +6,33 @@ from flask import Response, jsonify, make_response, request
 
 from kanmail.server.app import add_route
 from kanmail.server.mail import (
+    AccountNotFoundError,
     append_folder_email,
+    bulk_sync_folder_emails,
     copy_folder_emails,
     delete_folder_emails,
     get_account,
     get_all_folders,
+    get_folder_changes,
     get_folder_email_part,
     get_folder_email_texts,
     get_folder_emails,
+    get_folder_threads,
     move_folder_emails,
     star_folder_emails,
     sync_folder_emails,
     unstar_folder_emails,
 )
+from kanmail.server.mail.connection import ConnectionSettingsError, ImapConnectionError
 from kanmail.server.mail.message import make_email_message
 from kanmail.server.util import get_list_or_400, get_or_400, pop_or_400
 from kanmail.settings.constants import IS_APP
 from kanmail.window import get_main_window
 
+# Max time (seconds) a request for folder changes waits, each waiting request
+# holds a server thread so keep this short - clients simply poll again.
+MAX_CHANGES_TIMEOUT = 10
+
 
 @add_route("/api/folders", methods=("GET",))
 def api_get_folders() -> Response:
@@ -103,6 +112,115 @@ def api_sync_account_folder_emails(account, folder) -> Response:
     )
 
 
+def _get_sync_error_status_code(error):
+    # Match the status codes of the error handlers for single folder syncs
+    if isinstance(error, ImapConnectionError):
+        return 503
+    if isinstance(error, AccountNotFoundError):
+        return 404
+    if isinstance(error, ConnectionSettingsError):
+        return 400
+    return 500
+
+
+@add_route("/api/emails/sync", methods=("POST",))
+def api_bulk_sync_emails() -> Response:
+    """
+    Sync emails within many folders, across accounts, in a single request. Each
+    result is as the per folder sync, or the error for that folder.
+    """
+
+    request_data = request.get_json()
+    folders = get_or_400(request_data, "folders")
+
+    folder_syncs = []
+    for folder_data in folders:
+        uid_count = folder_data.get("uid_count")
+        if uid_count:
+            uid_count = int(uid_count)
+
+        folder_syncs.append(
+            {
+                "account_key": get_or_400(folder_data, "account"),
+                "folder_name": get_or_400(folder_data, "folder"),
+                "query": folder_data.get("query"),
+                "expected_uid_count": uid_count,
+                "check_unread_uids": [int(uid) for uid in folder_data.get("unread_uids", [])],
+            },
+        )
+
+    results = []
+
+    for folder_sync, result in zip(folder_syncs, bulk_sync_folder_emails(folder_syncs)):
+        result_data = {
+            "account": folder_sync["account_key"],
+            "folder": folder_sync["folder_name"],
+        }
+
+        if isinstance(result, Exception):
+            result_data.update(
+                status_code=_get_sync_error_status_code(result),
+                error_name=result.__class__.__name__,
+                error_message=f"{result}",
+            )
+        else:
+            new_emails, deleted_uids, read_uids, meta = result
+            result_data.update(
+                new_emails=new_emails,
+                deleted_uids=deleted_uids,
+                read_uids=read_uids,
+                meta=meta,
+            )
+
+        results.append(result_data)
+
+    return jsonify(results=results)
+
+
+@add_route("/api/emails/<account>/<folder>/threads", methods=("GET",))
+@_fix_flask_path_fail
+def api_get_account_folder_threads(account, folder) -> Response:
+    """
+    Get server computed threads (lists of UIDs) for a folder in a given account,
+    threads is null when the server doesn't support threading.
+    """
+
+    threads, meta = get_folder_threads(
+        account,
+        folder,
+        query=request.args.get("query"),
+    )
+
+    return jsonify(threads=threads, meta=meta)
+
+
+@add_route("/api/emails/changes", methods=("GET",))
+def api_get_email_changes() -> Response:
+    """
+    Long poll for folders that changed since a given change number.
+    """
+
+    folder_names = request.args.getlist("folder")
+
+    since = request.args.get("since")
+    if since is not None:
+        since = int(since)
+
+    timeout = min(float(request.args.get("timeout", MAX_CHANGES_TIMEOUT)), MAX_CHANGES_TIMEOUT)
+
+    change_number, changes, watched_folders = get_folder_changes(
+        folder_names,
+        since=since,
+        timeout=timeout,
+    )
+
+    return jsonify(
+        change_number=change_number,
+        changes=changes,
+        watched_folders=watched_folders,
+    )
+
+
 @add_route("/api/emails/<account>/<folder>/text", methods=("GET",))
 @_fix_flask_path_fail
 def api_get_account_email_texts(account, folder) -> Response:
@@ -29,6 +29,7 @@ APP_DIR = environ.get("KANMAIL_APP_DIR", get_app_dir(APP_NAME))
 # Cache directory
 CACHE_DIR = path.join(APP_DIR, "cache")
 ICON_CACHE_DIR = path.join(CACHE_DIR, "icons")
+PART_CACHE_DIR = path.join(CACHE_DIR, "parts")
 
 CONTACTS_CACHE_DB_FILE = path.join(CACHE_DIR, "contacts.db")
 FOLDER_CACHE_DB_FILE = path.join(CACHE_DIR, "folders.db")
@@ -79,6 +80,15 @@ CACHE_ENABLED = (
     and not environ.get("KANMAIL_FAKE_IMAP") == "on"  # never cache fake IMAP responses
 )
 
+# Flag to disable compression of (new) cached header values
+CACHE_COMPRESSION = environ.get("KANMAIL_CACHE_COMPRESSION", "on") == "on"
+
+# Size (MB) of the in-memory LRU of decoded headers in front of the cache DB
+HEADER_MEMORY_CACHE_SIZE = int(environ.get("KANMAIL_HEADER_MEMORY_CACHE_MB", "64")) * 1024 * 1024
+
+# Size (MB) of the on-disk email body/part cache, least recently used are evicted
+PART_CACHE_SIZE = int(environ.get("KANMAIL_PART_CACHE_MB", "512")) * 1024 * 1024
+
 
 # Get the client root directory - if we're frozen (by pyinstaller) this is relative
 # to the executable, otherwise ./client.
@@ -32,6 +32,8 @@ MODEL = {
     "system": {
         "batch_size": (int, 50),
         "initial_batches": (int, 3),
+        # Bytes of the first body part fetched to make excerpts
+        "excerpt_fetch_size": (int, 2048),
         "sync_days": (int, 0),
         "sync_interval": (int, 60000),
         "undo_ms": (int, 5000),
@@ -54,6 +56,11 @@ MODEL = {
             "name": str,
             "imap_connection": {
                 **CONNECTION_DEFAULTS,
+                # Don't negotiate COMPRESS=DEFLATE (RFC 4978) even if supported
+                "disable_compression": (bool, False),
+                # Header fetch tuning: UIDs per FETCH & max parallel connections
+                "fetch_chunk_size": (int, 100),
+                "fetch_parallelism": (int, 4),
             },
             "smtp_connection": {
                 "tls": bool,
@@ -9,8 +9,10 @@ from kanmail.license import validate_or_remove_license
 from kanmail.log import logger
 from kanmail.server.app import boot, server
 from kanmail.server.mail.folder_cache import (
+    remove_orphaned_part_files,
     remove_stale_folders,
     remove_stale_headers,
+    train_compression_dictionary,
     vacuum_folder_cache,
 )
 from kanmail.settings import get_window_settings
@@ -23,6 +25,8 @@ def run_cache_cleanup_later():
     sleep(120)  # TODO: make this more intelligent?
     remove_stale_folders()
     remove_stale_headers()
+    remove_orphaned_part_files()
+    train_compression_dictionary()
     vacuum_folder_cache()
 
 
@@ -5,8 +5,10 @@ import sys
 sys.path.append('.')  # noqa: E402
 
 from kanmail.server.mail.folder_cache import (  # noqa: E402
+    remove_orphaned_part_files,
     remove_stale_folders,
     remove_stale_headers,
+    train_compression_dictionary,
     vacuum_folder_cache,
 )
 
@@ -15,7 +17,13 @@ print('--> Removing stale folders...')
 remove_stale_folders()
 
 print('--> Removing stale headers...')
-remove_stale_headers()
+remove_stale_headers(time_budget=None)
+
+print('--> Removing orphaned part files...')
+remove_orphaned_part_files()
+
+print('--> Training compression dictionary...')
+train_compression_dictionary()
 
 print('--> Vacuuming!')
-vacuum_folder_cache()
+vacuum_folder_cache(time_budget=None)
@@ -0,0 +1,6 @@
+from os import environ
+from tempfile import mkdtemp
+
+# Keep settings/caches written by tests out of the real app directory, this must
+# be set before anything imports kanmail.settings.constants.
+environ.setdefault("KANMAIL_APP_DIR", mkdtemp(prefix="kanmail-tests-"))
@@ -0,0 +1,101 @@
+"""
+Test case for folders/caches backed by the fake IMAP connections (see
+connection_mocks.py) and the folder cache DB.
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from uuid import uuid4
+
+from kanmail.server.app import db
+from kanmail.server.mail import folder_cache
+from kanmail.server.mail.account import Account
+from kanmail.server.mail.cache_writer import FOLDER_CACHE_WRITER
+from kanmail.server.mail.connection_mocks import (
+    FOLDER_NAME_TO_FAKE_FOLDER,
+    FakeIMAPClient,
+)
+
+folder_cache.check_folder_cache_version()
+db.create_all()
+
+
+class FakeMailTestCase(TestCase):
+    """
+    Each test gets a new account (so a new cache) and fresh fake folders. IMAP
+    searches & fetches are recorded in `self.searches` & `self.fetches`.
+    """
+
+    capabilities = ()
+
+    def setUp(self):
+        test = self
+
+        self.searches = []
+        self.fetches = []
+        FOLDER_NAME_TO_FAKE_FOLDER.clear()
+
+        class TestIMAPClient(FakeIMAPClient):
+            def capabilities(self):
+                return list(test.capabilities)
+
+            def enable(self, *capabilities):
+                return list(capabilities)
+
+            def folder_status(self, folder_name, keys):
+                return test.get_folder_status(folder_name, keys)
+
+            def folder_statuses(self, folder_names, keys):
+                return {name: test.get_folder_status(name, keys) for name in folder_names}
+
+            def search(self, query, charset=None):
+                test.searches.append((self._current_folder.name, query))
+                return test.search(self, query)
+
+            def fetch(self, uids, keys, modifiers=None):
+                test.fetches.append((self._current_folder.name, uids, list(keys), modifiers))
+                return test.fetch(self, uids, keys, modifiers)
+
+            def add_flags(self, uids, flags):
+                pass
+
+            def remove_flags(self, uids, flags):
+                pass
+
+        patcher = patch("kanmail.server.mail.connection.KanmailIMAPClient", TestIMAPClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(FOLDER_CACHE_WRITER.flush)
+
+        self.account = Account(
+            "test",
+            {
+                "name": "test",
+                "imap_connection": {
+                    # Fake message data is generated per host
+                    "host": f"{uuid4()}.example.com",
+                    "port": 993,
+                    "username": "test",
+                    "password": "test",
+                },
+                "smtp_connection": {
+                    "host": "example.com",
+                    "port": 465,
+                    "username": "test",
+                    "password": "test",
+                },
+                "folders": {"inbox": "inbox"},
+            },
+        )
+
+    def get_fake_folder(self, name):
+        return FOLDER_NAME_TO_FAKE_FOLDER[name]
+
+    def get_folder_status(self, folder_name, keys):
+        return FOLDER_NAME_TO_FAKE_FOLDER[folder_name].status
+
+    def search(self, client, query):
+        return FakeIMAPClient.search(client, query)
+
+    def fetch(self, client, uids, keys, modifiers=None):
+        return FakeIMAPClient.fetch(client, uids, list(keys))
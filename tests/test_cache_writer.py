@@ -0,0 +1,138 @@
+from threading import Event, Thread
+from unittest import TestCase
+
+from kanmail.server.mail.cache_writer import FOLDER_CACHE_WRITER, CacheWriter
+from kanmail.server.mail.memory_cache import HEADER_MEMORY_CACHE
+
+from .fake_mail import FakeMailTestCase
+
+
+def fail_write(folder_id):
+    raise ValueError(f"Failed write to folder {folder_id}")
+
+
+class TestCacheWriter(TestCase):
+    def setUp(self):
+        self.dropped_folder_ids = []
+        self.writer = CacheWriter(on_dropped_folder_write=self.dropped_folder_ids.append)
+        self.calls = []
+
+        self.release = Event()
+        self.addCleanup(self.release.set)
+
+    def block_writer(self):
+        self.writer.write(self.release.wait, 5)
+
+    def test_writes_applied_in_order(self):
+        self.writer.write(self.calls.append, 1)
+        self.writer.write_folder(lambda folder_id: self.calls.append(("folder", folder_id)), 7)
+        self.writer.write(self.calls.append, 2)
+        self.writer.flush()
+
+        assert self.calls == [1, ("folder", 7), 2]
+
+    def test_consecutive_header_writes_coalesced(self):
+        def write_headers(folder_id, uid_to_headers):
+            self.calls.append((folder_id, uid_to_headers))
+
+        self.block_writer()
+        self.writer.write_headers(write_headers, 1, {1: "a", 2: "b"})
+        self.writer.write_headers(write_headers, 1, {2: "c", 3: "d"})
+        self.writer.write_headers(write_headers, 2, {1: "e"})
+        self.release.set()
+        self.writer.flush()
+
+        assert self.calls == [(1, {1: "a", 2: "c", 3: "d"}), (2, {1: "e"})]
+
+    def test_flush_folder_waits_for_queued_folder_writes(self):
+        self.block_writer()
+        self.writer.write_folder(lambda folder_id: self.calls.append(folder_id), 1)
+
+        # Nothing queued for this folder, so no waiting on the blocked writer
+        self.writer.flush_folder(2)
+        assert self.calls == []
+
+        flushed = Event()
+        thread = Thread(target=lambda: (self.writer.flush_folder(1), flushed.set()))
+        thread.start()
+
+        assert not flushed.wait(0.2)
+
+        self.release.set()
+        thread.join(5)
+
+        assert flushed.is_set()
+        assert self.calls == [1]
+        assert not self.writer.pending_folder_writes
+
+    def test_dropped_folder_write(self):
+        self.block_writer()
+        self.writer.write(self.calls.append, 1)
+        self.writer.write_folder(fail_write, 5)
+        self.writer.write(self.calls.append, 2)
+        self.release.set()
+        self.writer.flush()
+
+        # The batch is retried write by write, only the failed one is dropped and
+        # its folder invalidated.
+        assert self.calls[-2:] == [1, 2]
+        assert self.dropped_folder_ids == [5]
+        assert not self.writer.pending_folder_writes
+
+    def test_dropped_call_write_not_invalidated(self):
+        self.writer.write(fail_write, 5)
+        self.writer.flush()
+
+        assert self.dropped_folder_ids == []
+
+
+class TestFolderCacheWrites(FakeMailTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.folder = self.account.get_folder("Waiting")
+        self.folder.sync_emails()
+        self.uids = sorted(self.folder.email_uids)
+        self.folder.get_email_headers(self.uids)
+        FOLDER_CACHE_WRITER.flush()
+
+        self.cache = self.folder.cache
+        self.folder_id = self.cache.get_folder_id()
+
+        self.release = Event()
+        self.addCleanup(self.release.set)
+
+    def test_read_waits_for_queued_flag_write(self):
+        uid = self.uids[0]
+
+        FOLDER_CACHE_WRITER.write(self.release.wait, 5)
+        self.cache.batch_set_flags({uid: [b"\\Flagged"]})
+
+        # Before the flush, from the (updated) memory cache
+        assert self.cache.batch_get_headers([uid])[uid]["flags"] == (b"\\Flagged",)
+
+        # Missing the memory cache reads the DB, but only once the write is applied
+        HEADER_MEMORY_CACHE.clear()
+        Thread(target=self.release.set).start()
+        assert self.cache.batch_get_headers([uid])[uid]["flags"] == (b"\\Flagged",)
+        assert not FOLDER_CACHE_WRITER.pending_folder_writes.get(self.folder_id)
+
+    def test_read_after_queued_delete(self):
+        uid = self.uids[0]
+
+        FOLDER_CACHE_WRITER.write(self.release.wait, 5)
+        self.cache.batch_delete_headers([uid])
+        HEADER_MEMORY_CACHE.clear()
+        Thread(target=self.release.set).start()
+
+        assert self.cache.batch_get_headers([uid]) == {}
+
+    def test_dropped_write_invalidates_folder(self):
+        assert self.cache.get_uids() == set(self.uids)
+
+        FOLDER_CACHE_WRITER.write_folder(fail_write, self.folder_id)
+        FOLDER_CACHE_WRITER.flush()
+
+        # Rows & UID ranges removed, and the memory cache dropped on next use
+        assert not self.cache.get_uids()
+        assert self.cache.batch_get_headers(self.uids) == {}
@@ -0,0 +1,51 @@
+import quopri
+from base64 import encodebytes
+from unittest import TestCase
+
+from kanmail.server.mail.util import decode_string, extract_excerpt
+
+TEXT = "Grüße from Kanmail – 日本語のテキスト. " * 20
+
+
+class TestDecodePartialString(TestCase):
+    def assert_decodes_prefixes(self, data, string_meta):
+        for size in range(1, len(data)):
+            decoded = decode_string(data[:size], string_meta, partial=True)
+
+            assert "�" not in decoded, f"Bad decode cut at {size}: {decoded!r}"
+            assert TEXT.startswith(decoded), f"Bad decode cut at {size}: {decoded!r}"
+
+        assert decode_string(data, string_meta, partial=True) == TEXT
+
+    def test_decode_partial_utf8(self):
+        self.assert_decodes_prefixes(
+            TEXT.encode("utf-8"),
+            {"encoding": "8bit", "charset": "UTF-8"},
+        )
+
+    def test_decode_partial_base64(self):
+        self.assert_decodes_prefixes(
+            encodebytes(TEXT.encode("utf-8")),
+            {"encoding": "base64", "charset": "utf-8"},
+        )
+
+    def test_decode_partial_quoted_printable(self):
+        self.assert_decodes_prefixes(
+            quopri.encodestring(TEXT.encode("utf-8")),
+            {"encoding": "quoted-printable", "charset": "utf-8"},
+        )
+
+    def test_decode_partial_multibyte_charset(self):
+        self.assert_decodes_prefixes(
+            TEXT.encode("utf-16"),
+            {"encoding": "binary", "charset": "utf-16"},
+        )
+
+    def test_decode_complete_string_replaces_errors(self):
+        assert decode_string(b"abc\xe6\x97", {"encoding": "8bit"}) == "abc�"
+
+    def test_extract_partial_excerpt(self):
+        data = encodebytes("<p>Hello</p>\n<p>World ✓</p>".encode("utf-8"))[:-3]
+
+        excerpt = extract_excerpt(data, {"encoding": "base64"}, partial=True)
+        assert excerpt.startswith("Hello\nWorld")
@@ -0,0 +1,364 @@
+from threading import Event, current_thread
+from threading import enumerate as enumerate_threads
+
+from kanmail.server.mail.cache_writer import FOLDER_CACHE_WRITER
+from kanmail.server.mail.connection_mocks import FakeIMAPClient
+from kanmail.server.mail.folder import FULL_UID_SEARCH_INTERVAL
+from kanmail.server.mail.folder_cache import FolderCache, UnloadedFolder
+from kanmail.server.mail.memory_cache import HEADER_MEMORY_CACHE
+
+from .fake_mail import FakeMailTestCase
+
+
+def get_fake_gm_msgid(uid):
+    # Fake folders share UIDs (and message data), so use them as the message IDs
+    return 10**12 + uid
+
+
+class TestGmailSharedHeaders(FakeMailTestCase):
+    capabilities = (b"X-GM-EXT-1",)
+
+    def fetch(self, client, uids, keys, modifiers=None):
+        email_data = FakeIMAPClient.fetch(
+            client, uids, [key for key in keys if key != "X-GM-MSGID"]
+        )
+
+        if "X-GM-MSGID" in keys:
+            for uid, data in email_data.items():
+                data[b"X-GM-MSGID"] = get_fake_gm_msgid(uid)
+        return email_data
+
+    def test_headers_shared_between_folders(self):
+        folder = self.account.get_folder("Waiting")
+        folder_headers = folder.get_email_headers(sorted(folder.email_uids))
+        FOLDER_CACHE_WRITER.flush()
+
+        other_folder = self.account.get_folder("Needs Reply")
+        shared_uids = folder.email_uids & other_folder.email_uids
+        new_uids = other_folder.email_uids - shared_uids
+        assert shared_uids and new_uids
+
+        self.fetches.clear()
+        other_folder_headers = other_folder.get_email_headers(sorted(other_folder.email_uids))
+
+        # Only the message IDs of all, then everything for those not in Waiting
+        assert [(uids, keys[:2]) for _, uids, keys, _ in self.fetches] == [
+            (sorted(other_folder.email_uids), ["FLAGS", "X-GM-MSGID"]),
+            (sorted(new_uids), ["FLAGS", "ENVELOPE"]),
+        ]
+
+        assert sorted(other_folder_headers) == sorted(other_folder.email_uids)
+        for uid in shared_uids:
+            headers = other_folder_headers[uid]
+            assert headers["subject"] == folder_headers[uid]["subject"]
+            assert headers["gm_msgid"] == get_fake_gm_msgid(uid)
+            assert headers["server_folder_name"] == "Needs Reply"
+
+        # And the shared headers are saved for the folder
+        FOLDER_CACHE_WRITER.flush()
+        HEADER_MEMORY_CACHE.clear()
+        assert sorted(other_folder.cache.batch_get_headers(sorted(shared_uids))) == sorted(
+            shared_uids,
+        )
+
+    def test_no_message_id_fetch_without_other_folders(self):
+        folder = self.account.get_folder("Waiting")
+        folder.get_email_headers(sorted(folder.email_uids))
+
+        assert len(self.fetches) == 1
+        assert "X-GM-MSGID" in self.fetches[0][2]
+
+
+class TestSyncEmails(FakeMailTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stale_statuses = {}
+
+    def get_folder_status(self, folder_name, keys):
+        if folder_name in self.stale_statuses:
+            return self.stale_statuses[folder_name]
+        return super().get_folder_status(folder_name, keys)
+
+    def test_no_search_without_changes(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+
+        self.searches.clear()
+        assert folder.sync_emails() == ([], [], [])
+        assert self.searches == []
+
+    def test_expected_uid_count_skips_no_changes_shortcut(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+
+        # Emails moved in, but the status doesn't show them yet
+        fake_folder = self.get_fake_folder("Waiting")
+        self.stale_statuses["Waiting"] = fake_folder.status
+        fake_folder.add_uids([100, 101])
+
+        assert folder.sync_emails() == ([], [], [])
+        assert 100 not in folder.email_uids
+
+        new_emails, deleted_uids, _ = folder.sync_emails(expected_uid_count=2)
+        assert sorted(email["uid"] for email in new_emails) == [100, 101]
+        assert deleted_uids == []
+        assert {100, 101} <= folder.email_uids
+
+    def test_incremental_search_for_added_emails(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+
+        fake_folder = self.get_fake_folder("Waiting")
+        uid_next = fake_folder.uid_next
+        fake_folder.add_uids([100, 101])
+        self.searches.clear()
+
+        new_emails, deleted_uids, _ = folder.sync_emails()
+
+        # Nothing removed, so only the UIDs since the last UIDNEXT are searched
+        assert self.searches == [("Waiting", ["UID", f"{uid_next}:*"])]
+        assert sorted(email["uid"] for email in new_emails) == [100, 101]
+        assert deleted_uids == []
+        assert folder.email_uids == set(fake_folder.uids)
+
+    def test_full_search_when_emails_removed(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+
+        fake_folder = self.get_fake_folder("Waiting")
+        uid_next = fake_folder.uid_next
+        deleted_uid = min(fake_folder.uids)
+        fake_folder.add_uids([100])
+        fake_folder.remove_uids([deleted_uid])
+        self.searches.clear()
+
+        new_emails, deleted_uids, _ = folder.sync_emails()
+
+        # The message count doesn't add up, so the whole folder is searched
+        assert len(self.searches) == 2
+        assert self.searches[0] == ("Waiting", ["UID", f"{uid_next}:*"])
+        assert self.searches[1][1][:1] != ["UID"]
+        assert [email["uid"] for email in new_emails] == [100]
+        assert deleted_uids == [deleted_uid]
+        assert folder.email_uids == set(fake_folder.uids)
+
+    def test_full_search_when_emails_only_removed(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+
+        fake_folder = self.get_fake_folder("Waiting")
+        deleted_uid = min(fake_folder.uids)
+        fake_folder.remove_uids([deleted_uid])
+        self.searches.clear()
+
+        _, deleted_uids, _ = folder.sync_emails()
+
+        # No new UIDs to search for, straight to the full search
+        assert len(self.searches) == 1
+        assert self.searches[0][1][:1] != ["UID"]
+        assert deleted_uids == [deleted_uid]
+
+    def test_full_search_every_interval(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+        folder.incremental_sync_count = FULL_UID_SEARCH_INTERVAL
+
+        self.get_fake_folder("Waiting").add_uids([100])
+        self.searches.clear()
+
+        new_emails, _, _ = folder.sync_emails()
+
+        assert len(self.searches) == 1
+        assert self.searches[0][1][:1] != ["UID"]
+        assert [email["uid"] for email in new_emails] == [100]
+        assert folder.incremental_sync_count == 0
+
+
+class TestReadAhead(FakeMailTestCase):
+    def setUp(self):
+        super().setUp()
+        self.read_ahead_fetching = Event()
+        self.read_ahead_release = Event()
+        self.addCleanup(self.read_ahead_release.set)
+
+    def fetch(self, client, uids, keys, modifiers=None):
+        if current_thread().name.startswith("Read ahead"):
+            self.read_ahead_fetching.set()
+            self.read_ahead_release.wait(5)
+        return super().fetch(client, uids, keys, modifiers)
+
+    def get_read_ahead_threads(self):
+        return [thread for thread in enumerate_threads() if thread.name.startswith("Read ahead")]
+
+    def test_one_worker_per_folder(self):
+        folder = self.account.get_folder("Waiting")
+        uids = sorted(folder.email_uids)
+
+        folder.read_ahead_email_headers(uids[:2])
+        assert self.read_ahead_fetching.wait(5)
+
+        # Queued behind the fetch in progress, only the latest batches are kept
+        for i in range(2, 8, 2):
+            folder.read_ahead_email_headers(uids[i : i + 2])
+
+        assert self.get_read_ahead_threads() == [folder.read_ahead_thread]
+        assert list(folder.read_ahead_queue) == [uids[4:6], uids[6:8]]
+
+        thread = folder.read_ahead_thread
+        self.read_ahead_release.set()
+        thread.join(5)
+
+        assert folder.read_ahead_thread is None
+        assert not folder.read_ahead_uids
+        fetched_uids = sorted(uid for _, uids, _, _ in self.fetches for uid in uids)
+        assert fetched_uids == uids[:2] + uids[4:8]
+
+    def test_queued_uids_fetched_directly(self):
+        folder = self.account.get_folder("Waiting")
+        uids = sorted(folder.email_uids)
+
+        folder.read_ahead_email_headers(uids[:2])
+        assert self.read_ahead_fetching.wait(5)
+        folder.read_ahead_email_headers(uids[2:4])
+
+        # Not waiting on the read ahead, which is still blocked fetching uids[:2]
+        headers = folder.get_email_headers(uids[2:4])
+        assert sorted(headers) == uids[2:4]
+        assert not folder.read_ahead_queue
+
+
+class TestCopyCachedEmails(FakeMailTestCase):
+    def get_moved_uid(self, folder, other_folder_name):
+        other_uids = set(self.get_fake_folder(other_folder_name).uids)
+        return max(folder.email_uids - other_uids)
+
+    def test_copy_to_loaded_folder(self):
+        folder = self.account.get_folder("Waiting")
+        folder.get_email_headers(sorted(folder.email_uids))
+
+        other_folder = self.account.get_folder("Needs Reply")
+        other_folder.sync_emails()
+
+        uid = self.get_moved_uid(folder, "Needs Reply")
+        folder.move_emails([uid], "Needs Reply")
+
+        assert uid in other_folder.email_uids
+
+        # Still returned as new by the next sync, but from the cache
+        self.fetches.clear()
+        new_emails, _, _ = other_folder.sync_emails()
+        assert [email["uid"] for email in new_emails] == [uid]
+        assert self.fetches == []
+
+        assert other_folder.sync_emails() == ([], [], [])
+
+    def test_copy_to_unloaded_folder(self):
+        other_folder = self.account.get_folder("Needs Reply")
+        other_folder.sync_emails()
+        del self.account.folders["Needs Reply"]
+
+        folder = self.account.get_folder("Waiting")
+        folder.get_email_headers(sorted(folder.email_uids))
+
+        uid = self.get_moved_uid(folder, "Needs Reply")
+        folder.copy_cached_emails(
+            "Needs Reply",
+            "Needs Reply",
+            [],
+            f"[COPYUID 1 {uid} 500] Copy completed".encode(),
+        )
+        FOLDER_CACHE_WRITER.flush()
+
+        assert "Needs Reply" not in self.account.folders
+
+        cache = FolderCache(UnloadedFolder(self.account, "Needs Reply", "Needs Reply"))
+        assert 500 in cache.get_uids()
+        assert cache.batch_get_headers([500])[500]["uid"] == 500
+
+
+class TestQresyncSync(FakeMailTestCase):
+    capabilities = (b"QRESYNC",)
+
+    def setUp(self):
+        super().setUp()
+        self.uid_validity = 1
+        self.highest_mod_seq = 10
+        # UID -> flags of messages changed since the last sync, and VANISHED responses
+        self.changed_uid_flags = {}
+        self.vanished_responses = []
+
+    def get_folder_status(self, folder_name, keys):
+        status = super().get_folder_status(folder_name, keys)
+        status[b"UIDVALIDITY"] = self.uid_validity
+        status[b"HIGHESTMODSEQ"] = self.highest_mod_seq
+        return status
+
+    def fetch(self, client, uids, keys, modifiers=None):
+        if not modifiers:
+            return super().fetch(client, uids, keys)
+
+        client._imap.untagged_responses["VANISHED"] = list(self.vanished_responses)
+        return {uid: {b"FLAGS": flags} for uid, flags in self.changed_uid_flags.items()}
+
+    def get_changed_since_fetches(self):
+        return [modifiers for _, _, _, modifiers in self.fetches if modifiers]
+
+    def make_synced_folder(self):
+        folder = self.account.get_folder("Waiting")
+        folder.sync_emails()
+        assert folder.cache.get_highest_mod_seq() == 10
+        return folder
+
+    def test_sync_changed_emails(self):
+        folder = self.make_synced_folder()
+        deleted_uid, read_uid = sorted(folder.email_uids)[:2]
+
+        fake_folder = self.get_fake_folder("Waiting")
+        fake_folder.add_uids([100])
+        fake_folder.remove_uids([deleted_uid])
+
+        self.highest_mod_seq = 20
+        self.changed_uid_flags = {100: [], read_uid: [b"\\Seen"]}
+        self.vanished_responses = [f"(EARLIER) {deleted_uid}".encode()]
+        self.searches.clear()
+
+        new_emails, deleted_uids, read_uids = folder.sync_emails(check_unread_uids=[read_uid])
+
+        assert [email["uid"] for email in new_emails] == [100]
+        assert deleted_uids == [deleted_uid]
+        assert read_uids == [read_uid]
+        assert folder.email_uids == set(fake_folder.uids)
+
+        # Changes only, no UID search
+        assert self.searches == []
+        assert self.get_changed_since_fetches() == [["CHANGEDSINCE 10", "VANISHED"]]
+
+        # The new HIGHESTMODSEQ & UIDs are saved for the next sync
+        FOLDER_CACHE_WRITER.flush()
+        cache = FolderCache(folder)
+        assert cache.get_highest_mod_seq() == 20
+        assert cache.get_uids() == set(fake_folder.uids)
+
+    def test_sync_vanished_unknown_uids(self):
+        folder = self.make_synced_folder()
+        email_uids = set(folder.email_uids)
+
+        self.highest_mod_seq = 20
+        self.vanished_responses = [b"(EARLIER) 1000:1002"]
+
+        assert folder.sync_emails() == ([], [], [])
+        assert folder.email_uids == email_uids
+
+    def test_uid_validity_change_falls_back_to_search(self):
+        folder = self.make_synced_folder()
+
+        self.uid_validity = 2
+        self.highest_mod_seq = 20
+        self.searches.clear()
+
+        folder.sync_emails()
+
+        assert self.get_changed_since_fetches() == []
+        assert len(self.searches) == 1
+        assert folder.cache.get_uid_validity() == 2
+        assert folder.cache.get_highest_mod_seq() == 20
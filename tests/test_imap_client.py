@@ -0,0 +1,164 @@
+import imaplib
+import zlib
+from unittest import TestCase
+
+from kanmail.server.mail.imap_client import (
+    COMPRESS_WBITS,
+    DeflateSocketIO,
+    KanmailIMAPClient,
+    TransferStats,
+)
+
+
+class FakeIMAP4(object):
+    abort = imaplib.IMAP4.abort
+    error = imaplib.IMAP4.error
+
+    def __init__(self, tag_responses=None):
+        self.untagged_responses = {}
+        self.tag_responses = tag_responses or {}
+        self.sent = []
+        self.completed = []
+
+    def _command(self, *args):
+        self.sent.append(args)
+        return f"T{len(self.sent)}"
+
+    def _command_complete(self, name, tag):
+        self.completed.append(tag)
+
+        response = self.tag_responses.get(tag)
+        if isinstance(response, Exception):
+            raise response
+
+        if response:
+            self.untagged_responses.setdefault("STATUS", []).append(response)
+        return "OK", [b""]
+
+
+def make_client(imap):
+    client = object.__new__(KanmailIMAPClient)
+    client._imap = imap
+    client.folder_encode = True
+    return client
+
+
+class TestFolderStatuses(TestCase):
+    def test_folder_statuses(self):
+        imap = FakeIMAP4(
+            {
+                "T1": b'"INBOX" (MESSAGES 5 UIDNEXT 6)',
+                "T2": b'"Sent" (MESSAGES 7 UIDNEXT 9)',
+            },
+        )
+
+        statuses = make_client(imap).folder_statuses(["INBOX", "Sent"], [b"MESSAGES"])
+
+        assert statuses == {
+            "INBOX": {b"MESSAGES": 5, b"UIDNEXT": 6},
+            "Sent": {b"MESSAGES": 7, b"UIDNEXT": 9},
+        }
+
+    def test_folder_statuses_reads_all_responses_before_error(self):
+        imap = FakeIMAP4(
+            {
+                "T1": imaplib.IMAP4.error("STATUS command error: BAD"),
+                "T2": b'"Sent" (MESSAGES 7 UIDNEXT 9)',
+            },
+        )
+
+        with self.assertRaises(imaplib.IMAP4.error):
+            make_client(imap).folder_statuses(["Bad", "Sent"], [b"MESSAGES"])
+
+        assert imap.completed == ["T1", "T2"]
+        assert "STATUS" not in imap.untagged_responses
+
+
+class TestEsearch(TestCase):
+    def esearch(self, data, **kwargs):
+        client = make_client(FakeIMAP4())
+        commands = []
+
+        def raw_command_untagged(command, args, response_name=None):
+            commands.append((command, args, response_name))
+            return data
+
+        client._raw_command_untagged = raw_command_untagged
+        return client.esearch(**kwargs), commands
+
+    def test_esearch(self):
+        results, commands = self.esearch([b'(TAG "A282") UID COUNT 3 MIN 2 MAX 20 ALL 2,10:20'])
+
+        assert results == {
+            b"COUNT": 3,
+            b"MIN": 2,
+            b"MAX": 20,
+            b"ALL": [(2, 2), (10, 20)],
+        }
+        assert commands == [
+            (b"SEARCH", [b"RETURN", b"(ALL COUNT MIN MAX)", b"ALL"], "ESEARCH"),
+        ]
+
+    def test_esearch_single_uid(self):
+        results, _ = self.esearch([b'(TAG "A3") UID COUNT 1 ALL 7'], return_items=[b"ALL"])
+
+        assert results == {b"COUNT": 1, b"ALL": [(7, 7)]}
+
+    def test_esearch_count_only(self):
+        results, _ = self.esearch([b'(TAG "A3") UID COUNT 4'], return_items=[b"COUNT"])
+
+        assert results == {b"COUNT": 4}
+
+    def test_esearch_empty(self):
+        results, _ = self.esearch([b'(TAG "A4") UID COUNT 0'])
+
+        assert results == {b"COUNT": 0, b"ALL": []}
+
+    def test_esearch_no_response(self):
+        for data in ([None], [b""], []):
+            results, _ = self.esearch(data)
+
+            assert results == {b"COUNT": 0, b"ALL": []}
+
+
+class FakeSocket(object):
+    def __init__(self, recvs):
+        self.recvs = list(recvs)
+
+    def recv(self, size):
+        recv = self.recvs.pop(0)
+        if isinstance(recv, Exception):
+            raise recv
+        return recv
+
+
+def deflate_chunks(*chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, COMPRESS_WBITS)
+    return [compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) for chunk in chunks]
+
+
+class TestDeflateSocketIO(TestCase):
+    def test_readline_keeps_partial_line_on_blocking_error(self):
+        first, second = deflate_chunks(b"* 1 EXISTS\r\n* 2 EXI", b"STS\r\n")
+        deflate_io = DeflateSocketIO(
+            FakeSocket([first, BlockingIOError(), second]),
+            TransferStats(),
+        )
+
+        assert deflate_io.readline() == b"* 1 EXISTS\r\n"
+
+        with self.assertRaises(BlockingIOError):
+            deflate_io.readline()
+
+        assert deflate_io.readline() == b"* 2 EXISTS\r\n"
+
+    def test_read_and_readline_limit(self):
+        (data,) = deflate_chunks(b"* 1 FETCH {5}\r\nhello)\r\n")
+        deflate_io = DeflateSocketIO(FakeSocket([data, b""]), TransferStats())
+
+        assert deflate_io.readline(4) == b"* 1 "
+        assert deflate_io.readline() == b"FETCH {5}\r\n"
+        assert deflate_io.read(5) == b"hello"
+        assert deflate_io.readline() == b")\r\n"
+        # EOF
+        assert deflate_io.readline() == b""
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from kanmail.server.mail.util import parse_copyuid_response, parse_vanished_responses
+
+
+class TestParseVanishedResponses(TestCase):
+    def test_parse_vanished_responses(self):
+        assert parse_vanished_responses([b"1:3,7", "10"]) == {1, 2, 3, 7, 10}
+
+    def test_parse_vanished_earlier_responses(self):
+        assert parse_vanished_responses([b"(EARLIER) 41,43:45", b"(earlier) 50"]) == {
+            41,
+            43,
+            44,
+            45,
+            50,
+        }
+
+    def test_parse_no_vanished_responses(self):
+        assert parse_vanished_responses([]) == set()
+
+    def test_parse_malformed_vanished_response(self):
+        with self.assertRaises(ValueError):
+            parse_vanished_responses([b"(EARLIER) 1:x"])
+
+
+class TestParseCopyuidResponse(TestCase):
+    def test_parse_copyuid_response(self):
+        assert parse_copyuid_response(b"[COPYUID 38505 304,319:320 3956:3958] Done") == (
+            38505,
+            {304: 3956, 319: 3957, 320: 3958},
+        )
+
+    def test_parse_copyuid_response_keeps_order(self):
+        assert parse_copyuid_response("[COPYUID 1 5,3:2 10:12] Moved") == (
+            1,
+            {5: 10, 3: 11, 2: 12},
+        )
+
+    def test_parse_copyuid_response_single_uid(self):
+        assert parse_copyuid_response(b"[copyuid 7 4 9] Done") == (7, {4: 9})
+
+    def test_parse_missing_copyuid_response(self):
+        assert parse_copyuid_response(b"Done") == (None, {})
+        assert parse_copyuid_response(None) == (None, {})
+
+    def test_parse_malformed_copyuid_response(self):
+        # Source & destination UID counts differ
+        assert parse_copyuid_response(b"[COPYUID 1 1:3 10:11] Done") == (None, {})
+        assert parse_copyuid_response(b"[COPYUID 1 1,,2 10:11] Done") == (None, {})
+        assert parse_copyuid_response(b"[COPYUID 1 1: 10] Done") == (None, {})
@@ -0,0 +1,111 @@
+from unittest import TestCase
+
+from kanmail.server.mail.memory_cache import HeaderMemoryCache, _get_deep_size
+
+FOLDER_KEY = ("account", "inbox", 1)
+
+
+def make_headers(uid, subject="Hello"):
+    return {"uid": uid, "subject": subject}
+
+
+def get_item_size(uid, headers):
+    return _get_deep_size((*FOLDER_KEY, uid)) + _get_deep_size(headers)
+
+
+class TestHeaderMemoryCache(TestCase):
+    def test_get_returns_copies(self):
+        cache = HeaderMemoryCache(10000)
+        headers = make_headers(1)
+        cache.set(FOLDER_KEY, 1, headers)
+        headers["subject"] = "Changed"
+
+        cached_headers = cache.get(FOLDER_KEY, 1)
+        assert cached_headers == make_headers(1)
+
+        cached_headers["subject"] = "Changed"
+        assert cache.get(FOLDER_KEY, 1) == make_headers(1)
+
+    def test_lru_eviction_order(self):
+        max_size = sum(get_item_size(uid, make_headers(uid)) for uid in (1, 2, 3))
+        cache = HeaderMemoryCache(max_size)
+        cache.batch_set(FOLDER_KEY, {uid: make_headers(uid) for uid in (1, 2, 3)})
+
+        # Reading 1 makes 2 the least recently used
+        cache.get(FOLDER_KEY, 1)
+        cache.set(FOLDER_KEY, 4, make_headers(4))
+
+        assert list(cache.batch_get(FOLDER_KEY, [1, 2, 3, 4])) == [1, 3, 4]
+        assert [key[-1] for key in cache.items] == [1, 3, 4]
+
+    def test_tombstones(self):
+        cache = HeaderMemoryCache(10000)
+        cache.batch_set(FOLDER_KEY, {1: make_headers(1), 2: make_headers(2)})
+        cache.delete(FOLDER_KEY, 1)
+
+        # Tombstoned UIDs are returned (as None), unknown UIDs are missing
+        assert cache.batch_get(FOLDER_KEY, [1, 2, 3]) == {1: None, 2: make_headers(2)}
+
+        # Updates skip tombstones
+        cache.batch_update(FOLDER_KEY, [1, 2], lambda headers: dict(headers, subject="Hi"))
+        assert cache.batch_get(FOLDER_KEY, [1, 2]) == {1: None, 2: make_headers(2, "Hi")}
+
+        cache.set(FOLDER_KEY, 1, make_headers(1))
+        assert cache.get(FOLDER_KEY, 1) == make_headers(1)
+
+    def test_size_counts_keys(self):
+        cache = HeaderMemoryCache(10000)
+        cache.set(FOLDER_KEY, 1, make_headers(1))
+        cache.delete(FOLDER_KEY, 2)
+
+        assert cache.size == get_item_size(1, make_headers(1)) + get_item_size(2, None)
+
+        cache.delete(FOLDER_KEY, 1)
+        assert cache.size == get_item_size(1, None) + get_item_size(2, None)
+
+    def test_size_bound_with_tombstones(self):
+        cache = HeaderMemoryCache(get_item_size(1, None) * 3)
+        cache.batch_delete(FOLDER_KEY, range(1, 11))
+
+        assert len(cache.items) == 3
+        assert list(cache.batch_get(FOLDER_KEY, range(1, 11))) == [8, 9, 10]
+        assert cache.size <= cache.max_size
+
+    def test_size_bound_on_update(self):
+        max_size = sum(get_item_size(uid, make_headers(uid)) for uid in (1, 2)) + 100
+        cache = HeaderMemoryCache(max_size)
+        cache.batch_set(FOLDER_KEY, {uid: make_headers(uid) for uid in (1, 2)})
+        cache.batch_update(FOLDER_KEY, [2], lambda headers: dict(headers, subject="x" * 200))
+
+        assert list(cache.batch_get(FOLDER_KEY, [1, 2])) == [2]
+        assert cache.size == get_item_size(2, make_headers(2, "x" * 200))
+
+    def test_items_larger_than_max_size_skipped(self):
+        cache = HeaderMemoryCache(get_item_size(1, make_headers(1)))
+        cache.set(FOLDER_KEY, 1, make_headers(1))
+        cache.set(FOLDER_KEY, 2, make_headers(2, "x" * 1000))
+
+        assert cache.batch_get(FOLDER_KEY, [1, 2]) == {1: make_headers(1)}
+
+    def test_disabled(self):
+        cache = HeaderMemoryCache(0)
+        cache.set(FOLDER_KEY, 1, make_headers(1))
+
+        assert cache.get(FOLDER_KEY, 1) is None
+        assert cache.size == 0
+
+    def test_delete_folder(self):
+        cache = HeaderMemoryCache(10000)
+        cache.set(FOLDER_KEY, 1, make_headers(1))
+        cache.set(("account", "inbox", 2), 1, make_headers(1))
+        cache.set(("account", "sent", 1), 1, make_headers(1))
+        cache.delete_folder("account", "inbox")
+
+        assert [key[:3] for key in cache.items] == [("account", "sent", 1)]
+        assert cache.size == _get_deep_size(("account", "sent", 1, 1)) + _get_deep_size(
+            make_headers(1),
+        )
+
+        cache.clear()
+        assert not cache.items
+        assert cache.size == 0
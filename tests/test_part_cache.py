@@ -0,0 +1,132 @@
+from hashlib import sha256
+from os import makedirs, path, remove
+
+from kanmail.server.mail.cache_writer import FOLDER_CACHE_WRITER
+from kanmail.server.mail.folder_cache import (
+    PART_CACHE_MAX_INLINE_SIZE,
+    FolderHeaderPartCacheItem,
+    _get_part_filename,
+    remove_orphaned_part_files,
+)
+
+from .fake_mail import FakeMailTestCase
+
+LARGE_PART_SIZE = PART_CACHE_MAX_INLINE_SIZE + 1
+
+
+def make_part_data(size, fill=b"a"):
+    return fill * size
+
+
+def write_file(filename, data=b""):
+    makedirs(path.dirname(filename), exist_ok=True)
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+class TestPartCache(FakeMailTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = self.account.get_folder("Waiting").cache
+
+    def set_parts(self, uid_to_data, cache=None):
+        cache = cache or self.cache
+        cache.batch_set_parts(1, uid_to_data)
+        FOLDER_CACHE_WRITER.flush()
+
+    def get_part_item(self, uid, cache=None):
+        cache = cache or self.cache
+        return FolderHeaderPartCacheItem.query.filter_by(
+            folder_id=cache.get_folder_id(),
+            uid=uid,
+            part_number="1",
+        ).one()
+
+    def test_small_part_stored_inline(self):
+        data = make_part_data(PART_CACHE_MAX_INLINE_SIZE, b"s")
+        self.set_parts({1: data})
+
+        part = self.get_part_item(1)
+        assert part.data == data
+        assert part.size == len(data)
+        assert not path.exists(_get_part_filename(part.content_hash))
+
+        assert self.cache.batch_get_parts([1], 1) == {1: data}
+
+    def test_large_part_stored_as_file(self):
+        data = make_part_data(LARGE_PART_SIZE, b"l")
+        self.set_parts({1: data})
+
+        part = self.get_part_item(1)
+        assert part.data is None
+        assert part.content_hash == sha256(data).hexdigest()
+
+        filename = _get_part_filename(part.content_hash)
+        with open(filename, "rb") as f:
+            assert f.read() == data
+        assert not path.exists(f"{filename}.tmp")
+
+        assert self.cache.batch_get_parts([1], 1) == {1: data}
+
+    def test_identical_large_parts_share_file(self):
+        data = make_part_data(LARGE_PART_SIZE, b"i")
+        self.set_parts({1: data, 2: data})
+
+        assert self.get_part_item(1).content_hash == self.get_part_item(2).content_hash
+        assert self.cache.batch_get_parts([1, 2], 1) == {1: data, 2: data}
+
+    def test_part_with_missing_file_removed(self):
+        data = make_part_data(LARGE_PART_SIZE, b"m")
+        self.set_parts({1: data})
+        remove(_get_part_filename(self.get_part_item(1).content_hash))
+
+        assert self.cache.batch_get_parts([1], 1) == {}
+
+        FOLDER_CACHE_WRITER.flush()
+        part_items = FolderHeaderPartCacheItem.query.filter_by(
+            folder_id=self.cache.get_folder_id(),
+        )
+        assert not part_items.count()
+
+    def test_remove_orphaned_part_files(self):
+        data = make_part_data(LARGE_PART_SIZE, b"r")
+        self.set_parts({1: data})
+        referenced_filename = _get_part_filename(self.get_part_item(1).content_hash)
+
+        orphaned_filename = _get_part_filename(sha256(b"orphaned").hexdigest())
+        write_file(orphaned_filename)
+        temporary_filename = f"{_get_part_filename(sha256(b'temporary').hexdigest())}.tmp"
+        write_file(temporary_filename)
+
+        # Anything that isn't a part file is left alone
+        other_filenames = [
+            path.join(path.dirname(orphaned_filename), ".DS_Store"),
+            path.join(path.dirname(orphaned_filename), "notes.txt"),
+        ]
+        for filename in other_filenames:
+            write_file(filename)
+
+        remove_orphaned_part_files()
+
+        assert path.exists(referenced_filename)
+        assert not path.exists(orphaned_filename)
+        assert not path.exists(temporary_filename)
+        for filename in other_filenames:
+            assert path.exists(filename)
+
+        assert self.cache.batch_get_parts([1], 1) == {1: data}
+
+    def test_remove_orphaned_part_files_keeps_files_shared_by_other_folders(self):
+        other_cache = self.account.get_folder("Needs Reply").cache
+
+        data = make_part_data(LARGE_PART_SIZE, b"o")
+        self.set_parts({1: data})
+        self.set_parts({2: data}, cache=other_cache)
+        filename = _get_part_filename(self.get_part_item(1).content_hash)
+
+        # Replaced (inline) in one folder, still referenced by the other
+        self.set_parts({1: b"small"})
+        remove_orphaned_part_files()
+
+        assert path.exists(filename)
+        assert other_cache.batch_get_parts([2], 1) == {2: data}
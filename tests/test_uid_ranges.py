@@ -0,0 +1,110 @@
+from unittest import TestCase
+
+from kanmail.server.mail.uid_ranges import (
+    add_uid_ranges,
+    count_uid_ranges,
+    expand_uid_ranges,
+    format_sequence_set,
+    make_uid_ranges,
+    merge_uid_ranges,
+    parse_sequence_set,
+    remove_uid_ranges,
+    subtract_uid_ranges,
+)
+
+
+class TestMakeUidRanges(TestCase):
+    def test_make_uid_ranges(self):
+        assert make_uid_ranges([9, 1, 2, 3, 5, 3, 10]) == [(1, 3), (5, 5), (9, 10)]
+
+    def test_make_uid_ranges_empty(self):
+        assert make_uid_ranges([]) == []
+
+    def test_make_uid_ranges_single_uid(self):
+        assert make_uid_ranges([7]) == [(7, 7)]
+
+    def test_expand_and_count_round_trip(self):
+        uids = {1, 2, 3, 5, 9, 10, 100}
+        ranges = make_uid_ranges(uids)
+
+        assert expand_uid_ranges(ranges) == uids
+        assert count_uid_ranges(ranges) == len(uids)
+        assert expand_uid_ranges([]) == set()
+        assert count_uid_ranges([]) == 0
+
+
+class TestMergeUidRanges(TestCase):
+    def test_merge_overlapping_and_adjacent(self):
+        assert merge_uid_ranges([(1, 3), (10, 12)], [(2, 5), (6, 6), (13, 20)]) == [
+            (1, 6),
+            (10, 20),
+        ]
+
+    def test_merge_contained(self):
+        assert merge_uid_ranges([(1, 10)], [(3, 4)]) == [(1, 10)]
+
+    def test_merge_empty(self):
+        assert merge_uid_ranges([], []) == []
+        assert merge_uid_ranges([(1, 2)], []) == [(1, 2)]
+        assert merge_uid_ranges([], [(4, 4)]) == [(4, 4)]
+
+    def test_add_uid_ranges(self):
+        assert add_uid_ranges([(1, 3)], [4, 8]) == [(1, 4), (8, 8)]
+        assert add_uid_ranges([], [5]) == [(5, 5)]
+        assert add_uid_ranges([(1, 3)], []) == [(1, 3)]
+
+
+class TestRemoveUidRanges(TestCase):
+    def test_remove_uid_ranges(self):
+        assert remove_uid_ranges([(1, 10), (20, 22)], [1, 5, 10, 21, 30]) == [
+            (2, 4),
+            (6, 9),
+            (20, 20),
+            (22, 22),
+        ]
+
+    def test_remove_single_uid_range(self):
+        assert remove_uid_ranges([(5, 5), (7, 8)], [5]) == [(7, 8)]
+
+    def test_remove_empty(self):
+        assert remove_uid_ranges([], [1, 2]) == []
+        assert remove_uid_ranges([(1, 3)], []) == [(1, 3)]
+
+    def test_subtract_uid_ranges(self):
+        ranges = [(1, 10), (15, 20), (30, 30)]
+        other_ranges = [(3, 4), (9, 16), (30, 31)]
+
+        assert subtract_uid_ranges(ranges, other_ranges) == [(1, 2), (5, 8), (17, 20)]
+        assert subtract_uid_ranges(ranges, other_ranges) == make_uid_ranges(
+            expand_uid_ranges(ranges) - expand_uid_ranges(other_ranges),
+        )
+
+    def test_subtract_other_range_spanning_ranges(self):
+        assert subtract_uid_ranges([(1, 5), (8, 10), (12, 12)], [(4, 9)]) == [
+            (1, 3),
+            (10, 10),
+            (12, 12),
+        ]
+
+    def test_subtract_empty(self):
+        assert subtract_uid_ranges([], [(1, 5)]) == []
+        assert subtract_uid_ranges([(1, 5)], []) == [(1, 5)]
+        assert subtract_uid_ranges([(3, 3)], [(3, 3)]) == []
+
+
+class TestSequenceSet(TestCase):
+    def test_format_sequence_set(self):
+        assert format_sequence_set([(1, 3), (5, 5), (9, 20)]) == "1:3,5,9:20"
+
+    def test_parse_sequence_set(self):
+        assert parse_sequence_set(b"9:20,1:3,5, 4") == [(1, 5), (9, 20)]
+        # Reversed ranges are valid IMAP
+        assert parse_sequence_set("20:9") == [(9, 20)]
+
+    def test_sequence_set_round_trip(self):
+        for ranges in ([], [(7, 7)], [(1, 3), (5, 5), (9, 20)]):
+            assert parse_sequence_set(format_sequence_set(ranges)) == ranges
+
+    def test_parse_empty_sequence_set(self):
+        assert parse_sequence_set("") == []
+        assert parse_sequence_set(b"") == []